@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+import compat
+
+
+def create_log(fileName, sizeMb):
+    # build a synthetic log by repeating the lines of the sample logs in random order
+    sampleLines = []
+    for sampleFile in sorted(glob.glob("test/*.log*")) + sorted(glob.glob("test/testlog*.txt")):
+        with open(sampleFile, "r") as thisFile:
+            sampleLines.extend(thisFile.readlines())
+
+    random.seed(42)
+    targetBytes = sizeMb * 1024 * 1024
+    bytesWritten = 0
+    with open(fileName, "w") as logFile:
+        while bytesWritten < targetBytes:
+            thisChunk = "".join(random.choices(sampleLines, k=1000))
+            logFile.write(thisChunk)
+            bytesWritten += len(thisChunk)
+
+
+def scan_legacy(fileName, keywords, ver, maxBytes):
+    # the original technique, every keyword is checked against every line
+    foundDict = {}
+    bytesRead = 0
+    with open(fileName, "r") as logFile:
+        for fileLineNum, thisLine in enumerate(logFile, 1):
+            thisLineLength = len(thisLine)
+            for checkCompat in keywords:
+                if keywords[checkCompat][ver] in ['No','Yes'] and thisLine.find(checkCompat) >= 0:
+                    if compat.double_check(checkCompat, thisLine, thisLineLength):
+                        foundDict.setdefault(checkCompat, []).append(fileLineNum)
+            bytesRead += thisLineLength
+            if bytesRead >= maxBytes:
+                break
+    return foundDict, bytesRead
+
+
+def scan_matcher(fileName, keywords, ver, maxBytes):
+    foundDict = {}
+    bytesRead = 0
+    matcher = compat.build_matcher(keywords, ver)
+    with open(fileName, "r") as logFile:
+        for fileLineNum, thisLine in enumerate(logFile, 1):
+            for checkCompat in compat.match_line(matcher, thisLine):
+                foundDict.setdefault(checkCompat, []).append(fileLineNum)
+            bytesRead += len(thisLine)
+            if bytesRead >= maxBytes:
+                break
+    return foundDict, bytesRead
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compat.py operator matching on a synthetic log file.")
+    parser.add_argument("--size-mb", dest="sizeMb", type=int, default=1024, help="Size of the synthetic log file in MB (default 1024)")
+    parser.add_argument("--legacy-size-mb", dest="legacySizeMb", type=int, default=64, help="MB of the log to scan with the original per-keyword technique (default 64)")
+    parser.add_argument("--version", dest="version", default="5.0", choices=compat.versions, help="DocumentDB version to check (default 5.0)")
+    parser.add_argument("--log-file", dest="logFile", default="benchmark-scan.log", help="Synthetic log file to create")
+    args = parser.parse_args()
+
+    keywords = compat.load_keywords()
+
+    if not os.path.isfile(args.logFile):
+        print("creating {} MB synthetic log {}".format(args.sizeMb, args.logFile))
+        create_log(args.logFile, args.sizeMb)
+
+    legacyBytes = args.legacySizeMb * 1024 * 1024
+
+    startTime = time.time()
+    legacyDict, legacyRead = scan_legacy(args.logFile, keywords, args.version, legacyBytes)
+    legacySeconds = time.time() - startTime
+    print("legacy  : {:.1f} MB in {:.2f} seconds = {:.2f} MB/s".format(legacyRead/1024/1024, legacySeconds, legacyRead/1024/1024/legacySeconds))
+
+    matcherDict, matcherRead = scan_matcher(args.logFile, keywords, args.version, legacyBytes)
+    if matcherDict != legacyDict:
+        print("ERROR - results differ from the original technique")
+        sys.exit(1)
+    print("results match the original technique for the first {:.1f} MB".format(legacyRead/1024/1024))
+
+    startTime = time.time()
+    matcherDict, matcherRead = scan_matcher(args.logFile, keywords, args.version, os.path.getsize(args.logFile))
+    matcherSeconds = time.time() - startTime
+    print("matcher : {:.1f} MB in {:.2f} seconds = {:.2f} MB/s".format(matcherRead/1024/1024, matcherSeconds, matcherRead/1024/1024/matcherSeconds))
+
+    print("speedup : {:.1f}x".format((matcherRead/matcherSeconds)/(legacyRead/legacySeconds)))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,14 +6,28 @@ import sys
 import re
 import argparse
 import json
+import multiprocessing
+import gzip
+import hashlib
+import io
 try:
     import pymongo
 except:
     pass
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import orjson
+    jsonLoads = orjson.loads
+except ImportError:
+    jsonLoads = json.loads
 
 
 versions = ['3.6','4.0','5.0','8.0','EC5.0']
 processingFeedbackLines = 10000
+scanChunkSize = 16
 issuesDict = {}
 detailedIssuesDict = {}
 supportedDict = {}
@@ -21,6 +35,10 @@ skippedFileList = []
 exceptionFileList = []
 numProcessedFiles = 0
 skippedDirectories = []
+namespaceIssuesDict = {}
+shapeIssuesDict = {}
+# command fields that contain query operators, checked when scanning structured logs
+queryFields = ['filter','pipeline','query','q','u','update','updates','deletes','projection','fields','sort','let','arrayFilters']
 
 
 def ensureDirect(uri):
@@ -60,6 +78,124 @@ def double_check(checkOperator, checkLine, checkLineLength):
     return foundOperator
 
 
+def build_matcher(keywords, ver):
+    # compile the keywords for this version once so each line is scanned in a single pass
+    #   every operator starts with $, so a match can only begin at a $ and is a prefix of the run of operator characters that follows it
+    operators = {}
+    tokenChars = set()
+
+    for thisKeyword in keywords:
+        if keywords[thisKeyword][ver] in ['No','Yes']:
+            operators[thisKeyword] = keywords[thisKeyword][ver]
+            tokenChars.update(thisKeyword[1:])
+
+    tokenPattern = re.compile(r'\$(?=([' + ''.join(re.escape(thisChar) for thisChar in sorted(tokenChars)) + r']*))')
+
+    return {'operators':operators, 'pattern':tokenPattern}
+
+
+def match_line(matcher, checkLine):
+    # return the set of operators found in the line, same rules as double_check()
+    foundOperators = set()
+
+    if '$' not in checkLine:
+        return foundOperators
+
+    operators = matcher['operators']
+    checkLineLength = len(checkLine)
+
+    for match in matcher['pattern'].finditer(checkLine):
+        thisToken = '$' + match.group(1)
+        tokenEnd = match.start() + len(thisToken)
+
+        # the whole token, next character is not a..z|A..Z or at EOL
+        if thisToken in operators and ((tokenEnd == checkLineLength) or (not checkLine[tokenEnd].isalpha())):
+            foundOperators.add(thisToken)
+
+        # shorter operators ending on a non-alpha character inside the token, for example $atan within $atan2
+        if not thisToken.lstrip('$').isalpha():
+            for tokenPos in range(1, len(thisToken)):
+                if (not thisToken[tokenPos].isalpha()) and (thisToken[:tokenPos] in operators):
+                    foundOperators.add(thisToken[:tokenPos])
+
+    return foundOperators
+
+
+def match_log_line(matcher, checkLine):
+    # decode a structured (JSON) log line once, anything that is not a log entry is checked as plain text
+    try:
+        logEntry = jsonLoads(checkLine)
+    except ValueError:
+        logEntry = None
+
+    if not isinstance(logEntry, dict) or 't' not in logEntry or 'msg' not in logEntry:
+        return match_line(matcher, checkLine), None
+
+    return match_log_entry(matcher, logEntry)
+
+
+def match_log_entry(matcher, logEntry):
+    # return the set of operators used by the command in a structured (JSON) log entry and the namespace/query shape it belongs to
+    foundOperators = set()
+
+    attr = logEntry.get('attr')
+    if not isinstance(attr, dict) or not isinstance(attr.get('command'), dict):
+        return foundOperators, None
+
+    command = attr['command']
+    for thisField in queryFields:
+        if thisField in command:
+            walk_command(matcher['operators'], command[thisField], foundOperators)
+
+    # update and remove statements are logged with their type, the command name is the first field of other commands
+    if attr.get('type', 'command') != 'command':
+        commandName = attr['type']
+    else:
+        commandName = next(iter(command), 'unknown')
+    if 'ns' in attr:
+        namespace = attr['ns']
+    else:
+        namespace = "{}.{}".format(command.get('$db','unknown'), command.get(commandName))
+
+    # prefer the query shape hash reported by the server
+    queryShape = attr.get('queryShapeHash', attr.get('planCacheShapeHash', attr.get('queryHash')))
+    if queryShape is None:
+        queryShape = hashlib.sha1(json.dumps([commandName, namespace] + [query_shape(command.get(thisField)) for thisField in queryFields], default=str).encode()).hexdigest()[:8].upper()
+
+    return foundOperators, {'ns':namespace, 'shape':queryShape, 'command':commandName}
+
+
+def walk_command(operators, commandPart, foundOperators):
+    # operators are keys, variables such as $$ROOT are string values
+    if isinstance(commandPart, dict):
+        for thisKey, thisValue in commandPart.items():
+            if thisKey in operators:
+                foundOperators.add(thisKey)
+            walk_command(operators, thisValue, foundOperators)
+    elif isinstance(commandPart, list):
+        for thisValue in commandPart:
+            walk_command(operators, thisValue, foundOperators)
+    elif isinstance(commandPart, str) and commandPart.startswith('$$'):
+        thisVariable = commandPart.split('.')[0]
+        if thisVariable in operators:
+            foundOperators.add(thisVariable)
+
+
+def query_shape(commandPart):
+    # replace literal values so commands that differ only by values have the same shape
+    if isinstance(commandPart, dict):
+        return {thisKey: query_shape(thisValue) for thisKey, thisValue in commandPart.items()}
+    elif isinstance(commandPart, list):
+        if all(not isinstance(thisValue, (dict, list)) for thisValue in commandPart):
+            return '?'
+        return [query_shape(thisValue) for thisValue in commandPart]
+    elif isinstance(commandPart, str) and commandPart.startswith('$'):
+        return commandPart
+    elif commandPart is None:
+        return None
+    return '?'
+
+
 def check_all_parents(fileName, excludedDirectories):
     retVal = False
 
@@ -72,9 +208,9 @@ def check_all_parents(fileName, excludedDirectories):
 
 
 def scan_code(args, keywords):
-    global numProcessedFiles, issuesDict, detailedIssuesDict, supportedDict, skippedFileList, exceptionFileList, skippedDirectories
+    global numProcessedFiles
     
-    ver = args.version
+    matcher = build_matcher(keywords, args.version)
 
     usage_map = {}
     cmd_map = {}
@@ -116,57 +252,312 @@ def scan_code(args, keywords):
                         skippedFileList.append(filename)
                    
                     
-    for thisFile in fileArray:
+    # reuse the results of files that have not changed since they were cached
+    scanCache = None
+    cachedResults = {}
+    if args.cacheFile is not None:
+        scanCache = load_scan_cache(args.cacheFile, cache_key(args, keywords))
+        for thisFile in fileArray:
+            fileResult = get_cached_result(scanCache, thisFile)
+            if fileResult is not None:
+                cachedResults[thisFile] = fileResult
+
+    useCache = scanCache is not None
+
+    if args.workers > 1:
+        # scan the files in a process pool, results are merged in file order so the output matches a serial scan
+        with multiprocessing.Pool(args.workers, initializer=init_scan_worker, initargs=(matcher,args.structuredLogs,useCache)) as pool:
+            scannedResults = pool.imap(scan_file_worker, [thisFile for thisFile in fileArray if thisFile not in cachedResults], chunksize=scanChunkSize)
+            for thisFile in fileArray:
+                if thisFile in cachedResults:
+                    fileResult = cachedResults[thisFile]
+                else:
+                    fileResult = next(scannedResults)
+                    update_scan_cache(scanCache, fileResult)
+                print_file_progress(fileResult)
+                merge_file_result(fileResult)
+    else:
+        for thisFile in fileArray:
+            if thisFile in cachedResults:
+                fileResult = cachedResults[thisFile]
+                print_file_progress(fileResult)
+            else:
+                fileResult = scan_file(thisFile, matcher, args.structuredLogs, True, useCache)
+                update_scan_cache(scanCache, fileResult)
+            merge_file_result(fileResult)
+
+    if useCache:
+        save_scan_cache(args.cacheFile, scanCache)
+
+
+def scan_file(thisFile, matcher, structuredLogs, showProgress, useCache):
+    # scan a single file into a local result, see merge_file_result()
+    fileResult = {'fileName':thisFile, 'exception':False, 'numLines':0, 'issues':{}, 'supported':{}, 'namespaces':{}, 'shapes':{}}
+
+    hashReader = None
+    if useCache:
+        # size and mtime are taken before the scan in case the file changes, the content hash is computed while scanning
+        thisStat = os.stat(thisFile)
+        fileResult['signature'] = {'size':thisStat.st_size, 'mtime':thisStat.st_mtime_ns}
+
+    if showProgress:
         print("processing file {}".format(thisFile))
-        with open(thisFile, "r") as code_file:
-            # line by line technique
-            try:
-                fileLines = code_file.readlines()
-            except:
-                print("  exception reading file, skipping")
-                exceptionFileList.append(thisFile)
-                continue
-                
-            fileLineNum = 1
-            
-            for lineNum, thisLine in enumerate(fileLines):
-                thisLineLength = len(thisLine)
-                
-                for checkCompat in keywords:
-                    if (keywords[checkCompat][ver] == 'No'):
-                        # only check for unsupported operators
-                        if (thisLine.find(checkCompat) >= 0):
-                            # check for false positives - for each position found see if next character is not a..z|A..Z or if at EOL
-                            if double_check(checkCompat, thisLine, thisLineLength):
-                                # add it to the counters
-                                if checkCompat in issuesDict:
-                                    issuesDict[checkCompat] += 1
-                                else:
-                                    issuesDict[checkCompat] = 1
-                                # add it to the filenames/line-numbers
-                                if checkCompat in detailedIssuesDict:
-                                    if thisFile in detailedIssuesDict[checkCompat]:
-                                        detailedIssuesDict[checkCompat][thisFile].append(fileLineNum)
-                                    else:
-                                        detailedIssuesDict[checkCompat][thisFile] = [fileLineNum]
-                                else:
-                                    detailedIssuesDict[checkCompat] = {}
-                                    detailedIssuesDict[checkCompat][thisFile] = [fileLineNum]
-
-                    elif (keywords[checkCompat][ver] == 'Yes'):
-                        # check for supported operators
-                        if (thisLine.find(checkCompat) >= 0):
-                            # check for false positives - for each position found see if next character is not a..z|A..Z or if at EOL
-                            if double_check(checkCompat, thisLine, thisLineLength):
-                                if checkCompat in supportedDict:
-                                    supportedDict[checkCompat] += 1
-                                else:
-                                    supportedDict[checkCompat] = 1
-                                
-                if (fileLineNum % processingFeedbackLines) == 0:
+
+    fileLineNum = 1
+
+    try:
+        if useCache:
+            hashReader = HashingReader(thisFile)
+        with open_scan_file(thisFile, hashReader) as code_file:
+            # stream line by line, memory used does not depend on the size of the file
+            for thisLine in code_file:
+                if structuredLogs and thisLine.startswith('{'):
+                    foundOperators, logContext = match_log_line(matcher, thisLine)
+                else:
+                    foundOperators, logContext = match_line(matcher, thisLine), None
+
+                lineIssues = []
+                for checkCompat in foundOperators:
+                    if (matcher['operators'][checkCompat] == 'No'):
+                        # add it to the line-numbers
+                        if checkCompat in fileResult['issues']:
+                            fileResult['issues'][checkCompat].append(fileLineNum)
+                        else:
+                            fileResult['issues'][checkCompat] = [fileLineNum]
+                        lineIssues.append(checkCompat)
+
+                    else:
+                        # supported operator
+                        if checkCompat in fileResult['supported']:
+                            fileResult['supported'][checkCompat] += 1
+                        else:
+                            fileResult['supported'][checkCompat] = 1
+
+                if logContext is not None and len(lineIssues) > 0:
+                    add_log_issues(fileResult, logContext, lineIssues)
+
+                if showProgress and (fileLineNum % processingFeedbackLines) == 0:
                     print("  processing line {}".format(fileLineNum))
                 fileLineNum += 1
 
+            if hashReader is not None:
+                fileResult['signature']['hash'] = hashReader.hexdigest()
+    except:
+        # discard anything found before the exception, the file is reported as skipped
+        if showProgress:
+            print("  exception reading file, skipping")
+        fileResult['exception'] = True
+        fileResult['issues'] = {}
+        fileResult['supported'] = {}
+        fileResult['namespaces'] = {}
+        fileResult['shapes'] = {}
+    finally:
+        # gzip does not close the file object it reads from, and an exception may leave it open
+        if hashReader is not None:
+            hashReader.close()
+
+    fileResult['numLines'] = fileLineNum - 1
+
+    return fileResult
+
+
+def add_log_issues(fileResult, logContext, lineIssues):
+    # aggregate the unsupported operators of a structured log entry by namespace and by query shape
+    thisNamespace = logContext['ns']
+    if thisNamespace not in fileResult['namespaces']:
+        fileResult['namespaces'][thisNamespace] = {}
+    for checkCompat in lineIssues:
+        if checkCompat in fileResult['namespaces'][thisNamespace]:
+            fileResult['namespaces'][thisNamespace][checkCompat] += 1
+        else:
+            fileResult['namespaces'][thisNamespace][checkCompat] = 1
+
+    thisShape = logContext['shape']
+    if thisShape in fileResult['shapes']:
+        fileResult['shapes'][thisShape]['count'] += 1
+        fileResult['shapes'][thisShape]['operators'] = sorted(set(fileResult['shapes'][thisShape]['operators']).union(lineIssues))
+    else:
+        fileResult['shapes'][thisShape] = {'ns':thisNamespace, 'command':logContext['command'], 'operators':sorted(lineIssues), 'count':1}
+
+
+def open_scan_file(thisFile, hashReader=None):
+    # transparently decompress rotated log files, reading through hashReader when supplied
+    if hashReader is None:
+        sourceFile = thisFile
+    else:
+        sourceFile = io.BufferedReader(hashReader)
+
+    if thisFile.lower().endswith('.gz'):
+        return gzip.open(sourceFile, "rt")
+    elif thisFile.lower().endswith('.zst'):
+        if zstandard is None:
+            raise Exception("zstandard module is required to read {}".format(thisFile))
+        return zstandard.open(sourceFile, "rt")
+    elif hashReader is None:
+        return open(thisFile, "r")
+    else:
+        return io.TextIOWrapper(sourceFile)
+
+
+class HashingReader(io.RawIOBase):
+    # hashes the raw bytes of a file as they are read, so the cache does not need a second pass over the file
+    def __init__(self, thisFile):
+        self.rawFile = open(thisFile, "rb", buffering=0)
+        self.fileHash = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        numBytes = self.rawFile.readinto(buffer)
+        if numBytes:
+            self.fileHash.update(memoryview(buffer)[:numBytes])
+        return numBytes
+
+    def hexdigest(self):
+        # include anything the reader above did not consume, such as trailing bytes after the last compressed frame
+        for thisChunk in iter(lambda: self.rawFile.read(1024 * 1024), b""):
+            self.fileHash.update(thisChunk)
+        return self.fileHash.hexdigest()
+
+    def close(self):
+        self.rawFile.close()
+        super().close()
+
+
+def init_scan_worker(matcher, structuredLogs, useCache):
+    global workerMatcher, workerStructuredLogs, workerUseCache
+
+    workerMatcher = matcher
+    workerStructuredLogs = structuredLogs
+    workerUseCache = useCache
+
+
+def scan_file_worker(thisFile):
+    return scan_file(thisFile, workerMatcher, workerStructuredLogs, False, workerUseCache)
+
+
+def cache_key(args, keywords):
+    # cached results are only valid for the same version, scan mode, and keyword table
+    keywordsHash = hashlib.sha256(json.dumps(keywords, sort_keys=True).encode()).hexdigest()
+    return {'version':args.version, 'structuredLogs':args.structuredLogs, 'keywordsHash':keywordsHash}
+
+
+def load_scan_cache(cacheFile, cacheKey):
+    scanCache = {'key':cacheKey, 'files':{}}
+
+    if os.path.isfile(cacheFile):
+        try:
+            with open(cacheFile, "r") as thisCacheFile:
+                savedCache = json.load(thisCacheFile)
+            if savedCache.get('key') == cacheKey:
+                scanCache['files'] = savedCache['files']
+            else:
+                print("scan cache {} was created with a different version, scan mode, or keyword table, rescanning all files".format(cacheFile))
+        except (ValueError, KeyError):
+            print("unable to read scan cache {}, rescanning all files".format(cacheFile))
+
+    return scanCache
+
+
+def save_scan_cache(cacheFile, scanCache):
+    # forget files that no longer exist, write to a temporary file so an interrupted run does not corrupt the cache
+    for thisFile in list(scanCache['files'].keys()):
+        if not os.path.isfile(thisFile):
+            del scanCache['files'][thisFile]
+
+    with open(cacheFile + ".tmp", "w") as thisCacheFile:
+        json.dump(scanCache, thisCacheFile)
+    os.replace(cacheFile + ".tmp", cacheFile)
+
+
+def file_hash(thisFile):
+    fileHash = hashlib.sha256()
+    with open(thisFile, "rb") as hashFile:
+        for thisChunk in iter(lambda: hashFile.read(1024 * 1024), b""):
+            fileHash.update(thisChunk)
+    return fileHash.hexdigest()
+
+
+def get_cached_result(scanCache, thisFile):
+    cacheEntry = scanCache['files'].get(thisFile)
+    if cacheEntry is None:
+        return None
+
+    thisStat = os.stat(thisFile)
+    if cacheEntry['size'] != thisStat.st_size:
+        return None
+
+    if cacheEntry['mtime'] != thisStat.st_mtime_ns:
+        # the file was touched, only rescan if the content changed
+        if cacheEntry['hash'] != file_hash(thisFile):
+            return None
+        cacheEntry['mtime'] = thisStat.st_mtime_ns
+
+    return cacheEntry['result']
+
+
+def update_scan_cache(scanCache, fileResult):
+    # files that could not be read are always rescanned
+    if scanCache is None or fileResult['exception']:
+        return
+
+    fileSignature = fileResult.pop('signature')
+    scanCache['files'][fileResult['fileName']] = {'size':fileSignature['size'], 'mtime':fileSignature['mtime'], 'hash':fileSignature['hash'], 'result':fileResult}
+
+
+def print_file_progress(fileResult):
+    # output the same progress messages as a serial scan of the file
+    print("processing file {}".format(fileResult['fileName']))
+    for fileLineNum in range(processingFeedbackLines, fileResult['numLines'] + 1, processingFeedbackLines):
+        print("  processing line {}".format(fileLineNum))
+    if fileResult['exception']:
+        print("  exception reading file, skipping")
+
+
+def merge_file_result(fileResult):
+    thisFile = fileResult['fileName']
+
+    if fileResult['exception']:
+        exceptionFileList.append(thisFile)
+        return
+
+    for checkCompat in fileResult['issues']:
+        # add it to the counters
+        if checkCompat in issuesDict:
+            issuesDict[checkCompat] += len(fileResult['issues'][checkCompat])
+        else:
+            issuesDict[checkCompat] = len(fileResult['issues'][checkCompat])
+        # add it to the filenames/line-numbers
+        if checkCompat not in detailedIssuesDict:
+            detailedIssuesDict[checkCompat] = {}
+        if thisFile in detailedIssuesDict[checkCompat]:
+            detailedIssuesDict[checkCompat][thisFile].extend(fileResult['issues'][checkCompat])
+        else:
+            detailedIssuesDict[checkCompat][thisFile] = fileResult['issues'][checkCompat]
+
+    for checkCompat in fileResult['supported']:
+        if checkCompat in supportedDict:
+            supportedDict[checkCompat] += fileResult['supported'][checkCompat]
+        else:
+            supportedDict[checkCompat] = fileResult['supported'][checkCompat]
+
+    for thisNamespace in fileResult['namespaces']:
+        if thisNamespace not in namespaceIssuesDict:
+            namespaceIssuesDict[thisNamespace] = {}
+        for checkCompat in fileResult['namespaces'][thisNamespace]:
+            if checkCompat in namespaceIssuesDict[thisNamespace]:
+                namespaceIssuesDict[thisNamespace][checkCompat] += fileResult['namespaces'][thisNamespace][checkCompat]
+            else:
+                namespaceIssuesDict[thisNamespace][checkCompat] = fileResult['namespaces'][thisNamespace][checkCompat]
+
+    for thisShape in fileResult['shapes']:
+        if thisShape in shapeIssuesDict:
+            shapeIssuesDict[thisShape]['count'] += fileResult['shapes'][thisShape]['count']
+            shapeIssuesDict[thisShape]['operators'] = sorted(set(shapeIssuesDict[thisShape]['operators']).union(fileResult['shapes'][thisShape]['operators']))
+        else:
+            shapeIssuesDict[thisShape] = dict(fileResult['shapes'][thisShape])
+
 
 def getOperatorsFromServer(args):
     fullListDict = {}
@@ -234,6 +625,9 @@ def main(args):
     parser.add_argument("--excluded-extensions", dest="excludedExtensions", action="store", default="NONE", help="Filename extensions to exclude from scanning, comma separated", required=False)
     parser.add_argument("--included-extensions", dest="includedExtensions", action="store", default="ALL", help="Filename extensions to include in scanning, comma separated", required=False)
     parser.add_argument("--excluded-directories", dest="excludedDirectories", action="store", default="NONE", help="directories to exclude from scanning, comma separated", required=False)
+    parser.add_argument("--structured-logs", dest="structuredLogs", action="store_true", default=False, help="Decode JSON log entries and only check the query parts of logged commands", required=False)
+    parser.add_argument("--cache-file", dest="cacheFile", action="store", help="File used to cache per-file results, unchanged files are not rescanned", required=False)
+    parser.add_argument("--workers", dest="workers", action="store", type=int, default=1, help="Number of processes used to scan files (default is 1)", required=False)
     parser.add_argument("--version", dest="version", action="store", default="5.0", help="Check for DocumentDB version compatibility (default is 5.0)", choices=versions, required=False)
 
     args = parser.parse_args()
@@ -243,6 +637,9 @@ def main(args):
     
     elif args.scanDir is not None and not os.path.isdir(args.scanDir):
         parser.error("unable to locate directory {}".format(args.scanDir))
+
+    elif args.workers < 1:
+        parser.error("--workers must be at least 1")
         
     keywords = load_keywords()
 
@@ -308,6 +705,20 @@ def main(args):
             print("  {} | lines = found {} time(s)".format(thisKeyPair[0],thisKeyPair[1]))
             for thisFile in detailedIssuesDict[thisKeyPair[0]]:
                 print("    {} | lines = {}".format(thisFile,detailedIssuesDict[thisKeyPair[0]][thisFile]))
+
+        if len(namespaceIssuesDict) > 0:
+            # output structured log findings
+            print("")
+            print("Unsupported operators by namespace:")
+            for thisNamespace in sorted(namespaceIssuesDict.keys()):
+                print("  {}".format(thisNamespace))
+                for thisKeyPair in sorted(namespaceIssuesDict[thisNamespace].items(), key=lambda x: (-x[1],x[0])):
+                    print("    {} | found {} time(s)".format(thisKeyPair[0],thisKeyPair[1]))
+
+            print("")
+            print("Unsupported operators by query shape:")
+            for thisKeyPair in sorted(shapeIssuesDict.items(), key=lambda x: (-x[1]['count'],x[0])):
+                print("  {} | {} | {} | operators = {} | found {} time(s)".format(thisKeyPair[0],thisKeyPair[1]['ns'],thisKeyPair[1]['command'],thisKeyPair[1]['operators'],thisKeyPair[1]['count']))
         
     else:
         print("")
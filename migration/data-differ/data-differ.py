@@ -1,10 +1,26 @@
 import argparse
 import json
+import os
+import shutil
+import tempfile
+import concurrent.futures
+import hashlib
 from pymongo import MongoClient
 from deepdiff import DeepDiff
 from tqdm import tqdm
 from datetime import datetime
 from multiprocessing import Pool, cpu_count
+from bson.objectid import ObjectId
+from bson.decimal128 import Decimal128
+from bson.timestamp import Timestamp
+from bson.binary import Binary
+from bson.regex import Regex
+from bson.min_key import MinKey
+from bson.max_key import MaxKey
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 
 
 def connect_to_db(uri, pool_size):
@@ -16,48 +32,273 @@ def connect_to_db(uri, pool_size):
         return None
 
 
+## $type aliases of each BSON type bracket, numbered as in id_sort_key
+id_type_brackets = {0: ['minKey'], 1: ['null'], 2: ['int', 'long', 'double', 'decimal'], 3: ['string', 'symbol'], 4: ['object'],
+                    6: ['binData'], 7: ['objectId'], 8: ['bool'], 9: ['date'], 10: ['timestamp'], 11: ['regex'], 13: ['maxKey']}
+
+# number of _id values returned per round trip when reading only _id
+id_batch_size = 10000
+
+
+## Filter for _id >= ("$gte") or < ("$lt") a value, comparison operators only match the same type so other types are matched with $type
+def id_bound_filter(id_value, op):
+    bracket = id_sort_key(id_value)[0]
+    other_types = []
+    for this_bracket, this_types in id_type_brackets.items():
+        if (op == '$gte' and this_bracket > bracket) or (op == '$lt' and this_bracket < bracket):
+            other_types.extend(this_types)
+    or_list = [{'_id': {op: id_value}}]
+    if len(other_types) > 0:
+        or_list.append({'_id': {'$type': other_types}})
+    return {'$or': or_list}
+
+
+## Filter for start_id <= _id < end_id, None is unbounded
+def id_range_filter(start_id, end_id):
+    and_list = []
+    if start_id is not None:
+        and_list.append(id_bound_filter(start_id, '$gte'))
+    if end_id is not None:
+        and_list.append(id_bound_filter(end_id, '$lt'))
+    if len(and_list) == 0:
+        return {}
+    return {'$and': and_list}
+
+
+## Split the _id space into ranges of about the same number of documents using a sample of _id values
+def id_range_boundaries(collection, num_ranges):
+    sample_ids = [doc['_id'] for doc in collection.aggregate([{'$sample': {'size': num_ranges * 100}}, {'$project': {'_id': 1}}])]
+    sample_ids.sort(key=id_sort_key)
+    boundaries = [None]
+    for range_num in range(1, num_ranges):
+        this_id = sample_ids[int(range_num * len(sample_ids) / num_ranges)] if len(sample_ids) > 0 else None
+        if this_id is not None and (boundaries[-1] is None or id_sort_key(boundaries[-1]) < id_sort_key(this_id)):
+            boundaries.append(this_id)
+    boundaries.append(None)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)]
+
+
+## Stream the sorted _id values of both collections in a range, the _id values only in target are written to spill_file
+def find_extra_ids_in_range(srcCollection, tgtCollection, start_id, end_id, spill_file):
+    range_filter = id_range_filter(start_id, end_id)
+    src_ids = sorted_docs(srcCollection.find(range_filter, {'_id': 1}).sort('_id', 1).batch_size(id_batch_size), "Source")
+    tgt_ids = sorted_docs(tgtCollection.find(range_filter, {'_id': 1}).sort('_id', 1).batch_size(id_batch_size), "Target")
+
+    num_extra = 0
+    src_key, src_doc = next(src_ids, (None, None))
+    with open(spill_file, 'w') as file:
+        for tgt_key, tgt_doc in tgt_ids:
+            while src_key is not None and src_key < tgt_key:
+                src_key, src_doc = next(src_ids, (None, None))
+            if src_key is None or tgt_key < src_key:
+                file.write(str(tgt_doc['_id']) + '\n')
+                num_extra += 1
+    return num_extra
+
+
 ## Find missing docs in source when doc count in target is higher
-def check_target_for_extra_documents(srcCollection, tgtCollection, output_file):
+def check_target_for_extra_documents(srcCollection, tgtCollection, output_file, num_ranges):
     print("Check if extra documents exist in target database. Scanning......")
-    # Using aggregation pipeline instead of distinct to handle dictionary _id values
-    src_ids = [doc['_id'] for doc in srcCollection.find({}, {'_id': 1})]
-    
-    # Find documents in target that don't exist in source
-    missing_docs = tgtCollection.find({'_id': {'$nin': src_ids}})
-    if len(list(missing_docs.clone())) > 0:
-        write_difference_to_file(output_file, "Document _IDs present in the target collection but not in the source collection:")
-        for doc in missing_docs:
-            print(doc['_id'])
-            write_difference_to_file(output_file, doc['_id'])
+    # memory is bounded by the cursor batches, each range of _id values is compared in parallel and results are spilled to disk
+    id_ranges = id_range_boundaries(tgtCollection, num_ranges)
+    spill_dir = tempfile.mkdtemp(prefix='data-differ-', dir=os.path.dirname(os.path.abspath(output_file)))
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=cpu_count()) as executor:
+            futures = [executor.submit(find_extra_ids_in_range, srcCollection, tgtCollection, start_id, end_id, os.path.join(spill_dir, f"range-{range_num}.txt"))
+                       for range_num, (start_id, end_id) in enumerate(id_ranges)]
+            num_extra = sum(future.result() for future in futures)
+
+        if num_extra > 0:
+            print(f"Found {num_extra} documents in the target collection that are missing in the source collection!")
+            write_difference_to_file(output_file, "Document _IDs present in the target collection but not in the source collection:")
+            with open(output_file, 'a') as file:
+                for range_num in range(len(id_ranges)):
+                    with open(os.path.join(spill_dir, f"range-{range_num}.txt"), 'r') as spill_file:
+                        shutil.copyfileobj(spill_file, file)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
 
 
-## Compare documents for any difference using deepDiff
+## Read documents as raw BSON, they are only decoded when they differ
+def raw_collection(collection):
+    return collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+
+
+def decode_raw(doc):
+    if isinstance(doc, RawBSONDocument):
+        return bson.decode(doc.raw)
+    if isinstance(doc, bytes):
+        return bson.decode(doc)
+    return doc
+
+
+## Compare documents for any difference using deepDiff, returns None when the comparison fails
 def compare_docs_deepdiff(doc1, doc2, output_file):
+    doc1 = decode_raw(doc1)
+    doc2 = decode_raw(doc2)
     try:
         diff = DeepDiff(doc1, doc2, verbose_level=2, report_repetition=True, ignore_order=True, cache_size=5000)
         if diff:
             print("Difference found at doc id:", doc1["_id"])
             write_difference_to_file(output_file, "Difference found at doc id: " + str(doc1["_id"]))
             write_difference_to_file(output_file, diff)
+        return bool(diff)
     except Exception as e:
         print(f"An error occurred while comparing documents: {e}")
 
 
+## Check difference between raw docs, identical BSON means identical documents so only the other pairs are sent to DeepDiff in the pool
+def compare_doc_pairs(pool, matched_doc_pairs, output_file, compare_stats):
+    diff_pairs = []
+    for doc1, doc2 in matched_doc_pairs:
+        if doc2 is None:
+            continue
+        if doc1.raw == doc2.raw:
+            compare_stats['identical'] += 1
+        else:
+            diff_pairs.append((doc1.raw, doc2.raw, output_file))
+
+    if len(diff_pairs) > 0:
+        compare_stats['deepdiff'] += len(diff_pairs)
+        pool.starmap(compare_docs_deepdiff, diff_pairs, chunksize=max(1, len(diff_pairs) // (cpu_count() * 4)))
+
+
+## Helper function to order _id values the same way the server sorts them (BSON comparison order)
+def id_sort_key(id_value):
+    if id_value is None:
+        return (1,)
+    if isinstance(id_value, MinKey):
+        return (0,)
+    if isinstance(id_value, MaxKey):
+        return (13,)
+    if isinstance(id_value, bool):
+        return (8, id_value)
+    if isinstance(id_value, (int, float)):
+        return (2, id_value)
+    if isinstance(id_value, Decimal128):
+        return (2, id_value.to_decimal())
+    if isinstance(id_value, str):
+        return (3, id_value)
+    if isinstance(id_value, (dict, RawBSONDocument)):
+        # embedded documents compare field by field, type then name then value
+        return (4, tuple((id_sort_key(v)[0], k, id_sort_key(v)) for k, v in id_value.items()))
+    if isinstance(id_value, Binary):
+        return (6, len(id_value), id_value.subtype, bytes(id_value))
+    if isinstance(id_value, bytes):
+        return (6, len(id_value), 0, id_value)
+    if isinstance(id_value, ObjectId):
+        return (7, id_value.binary)
+    if isinstance(id_value, datetime):
+        return (9, id_value)
+    if isinstance(id_value, Timestamp):
+        return (10, id_value.time, id_value.inc)
+    if isinstance(id_value, Regex):
+        return (11, id_value.pattern, str(id_value.flags))
+    raise TypeError(f"Unsupported _id type for merge join: {type(id_value)}")
+
+
+## Read a cursor sorted by _id, checking the server order matches id_sort_key
+def sorted_docs(cursor, side):
+    last_key = None
+    for doc in cursor:
+        this_key = id_sort_key(doc['_id'])
+        if last_key is not None and this_key < last_key:
+            raise ValueError(f"{side} _id {doc['_id']} is out of order, merge join is not supported for this collection")
+        last_key = this_key
+        yield this_key, doc
+
+
+## Walk two cursors sorted by _id in lockstep, yields (source doc, target doc) with None for a document only on one side
+def merge_by_id(source_cursor, target_cursor):
+    src_docs = sorted_docs(source_cursor, "Source")
+    tgt_docs = sorted_docs(target_cursor, "Target")
+    src_key, src_doc = next(src_docs, (None, None))
+    tgt_key, tgt_doc = next(tgt_docs, (None, None))
+
+    while src_doc is not None or tgt_doc is not None:
+        if tgt_doc is None or (src_doc is not None and src_key < tgt_key):
+            yield src_doc, None
+            src_key, src_doc = next(src_docs, (None, None))
+        elif src_doc is None or tgt_key < src_key:
+            yield None, tgt_doc
+            tgt_key, tgt_doc = next(tgt_docs, (None, None))
+        else:
+            yield src_doc, tgt_doc
+            src_key, src_doc = next(src_docs, (None, None))
+            tgt_key, tgt_doc = next(tgt_docs, (None, None))
+
+
+## Compare documents by walking both collections in _id order
+def compare_document_data_merge_join(pool, srcCollection, tgtCollection, batch_size, output_file, src_count, compare_stats):
+    source_cursor = raw_collection(srcCollection).find().sort('_id', 1).batch_size(batch_size)
+    target_cursor = raw_collection(tgtCollection).find().sort('_id', 1).batch_size(batch_size)
+
+    progress_bar = tqdm(total=src_count, desc='Comparing documents', unit='doc')
+    tgt_missing_ids = []
+    src_missing_ids = []
+    processed_docs = 0
+
+    try:
+        matched_doc_pairs = []
+
+        for src_doc, tgt_doc in merge_by_id(source_cursor, target_cursor):
+            if tgt_doc is None:
+                tgt_missing_ids.append(src_doc['_id'])
+                processed_docs += 1
+                progress_bar.update(1)
+            elif src_doc is None:
+                src_missing_ids.append(tgt_doc['_id'])
+            else:
+                matched_doc_pairs.append((src_doc, tgt_doc))
+
+            if len(matched_doc_pairs) >= batch_size:
+                compare_doc_pairs(pool, matched_doc_pairs, output_file, compare_stats)
+                processed_docs += len(matched_doc_pairs)
+                progress_bar.update(len(matched_doc_pairs))
+                matched_doc_pairs = []
+
+        compare_doc_pairs(pool, matched_doc_pairs, output_file, compare_stats)
+        processed_docs += len(matched_doc_pairs)
+        progress_bar.update(len(matched_doc_pairs))
+
+    except Exception as e:
+        print(f"An error occurred while comparing documents: {e}")
+
+    if len(tgt_missing_ids) > 0:
+        print(f"Found {len(tgt_missing_ids)} documents in the source collection that are missing in the target collection!")
+        write_difference_to_file(output_file, "Document _IDs present in the source collection, but not in the target collection:")
+        for doc_id in tgt_missing_ids:
+            write_difference_to_file(output_file, str(doc_id))
+
+    if len(src_missing_ids) > 0:
+        print(f"Found {len(src_missing_ids)} documents in the target collection that are missing in the source collection!")
+        write_difference_to_file(output_file, "Document _IDs present in the target collection but not in the source collection:")
+        for doc_id in src_missing_ids:
+            write_difference_to_file(output_file, str(doc_id))
+
+    progress_bar.n = processed_docs
+    progress_bar.refresh()
+    progress_bar.close()
+
+
 ## Helper function to make _id hashable
 def make_id_hashable(id_value):
+    if isinstance(id_value, RawBSONDocument):
+        return id_value.raw
     if isinstance(id_value, dict):
         return json.dumps(id_value, sort_keys=True)
     return id_value
 
 ## Main compare document function
-def compare_document_data(srcCollection, tgtCollection, batch_size, output_file, src_count, sample_size_percent, sampling_timeout_ms):
+def compare_document_data(pool, srcCollection, tgtCollection, batch_size, output_file, src_count, sample_size_percent, sampling_timeout_ms, compare_stats):
     if sample_size_percent:
         percentage_in_decimal = sample_size_percent / 100
         docs_to_sample = int(percentage_in_decimal * src_count)
-        source_cursor = srcCollection.aggregate([ { "$sample": { "size": docs_to_sample } } ], batchSize=batch_size, maxTimeMS=sampling_timeout_ms)
+        source_cursor = raw_collection(srcCollection).aggregate([ { "$sample": { "size": docs_to_sample } } ], batchSize=batch_size, maxTimeMS=sampling_timeout_ms)
         total_docs = docs_to_sample
     else:
-        source_cursor = srcCollection.find().sort('_id').batch_size(batch_size)
+        source_cursor = raw_collection(srcCollection).find().sort('_id').batch_size(batch_size)
         total_docs = src_count
 
     progress_bar = tqdm(total=total_docs, desc='Comparing documents', unit='doc')
@@ -76,7 +317,7 @@ def compare_document_data(srcCollection, tgtCollection, batch_size, output_file,
                     src_ids_list.append(document['_id'])
 
             # Use MongoDB's $in operator directly without converting to set
-            tgt_docs = tgtCollection.find({"_id": {"$in": src_ids_list}})
+            tgt_docs = raw_collection(tgtCollection).find({"_id": {"$in": src_ids_list}})
             
             # Create a dictionary mapping hashable versions of _id to documents
             tgt_docs_map = {}
@@ -93,10 +334,7 @@ def compare_document_data(srcCollection, tgtCollection, batch_size, output_file,
                 if tgt_doc is None:
                     tgt_missing_ids.append(src_doc['_id'])
 
-            # Check difference between docs, multi process based on cpu_count()
-            pool_size = cpu_count()
-            with Pool(pool_size) as pool:
-                pool.starmap(compare_docs_deepdiff, [(doc1, doc2, output_file) for doc1, doc2 in matched_doc_pairs if doc2 is not None])
+            compare_doc_pairs(pool, matched_doc_pairs, output_file, compare_stats)
 
             processed_docs += len(matched_doc_pairs)
             progress_bar.update(len(matched_doc_pairs))
@@ -133,7 +371,139 @@ def write_difference_to_file(output_file, content):
         file.write(str(content) + '\n')
 
 
-def compare_collections(srcCollection, tgtCollection, batch_size, output_file, check_target, sample_size_percent, sampling_timeout_ms):
+## Per-process connections for the range comparison workers
+range_worker = {}
+
+
+def init_range_worker(range_config):
+    src_client = connect_to_db(range_config['source_uri'], 10)
+    tgt_client = connect_to_db(range_config['target_uri'], 10)
+    range_worker['src'] = src_client[range_config['source_db']][range_config['source_coll']]
+    range_worker['tgt'] = tgt_client[range_config['target_db']][range_config['target_coll']]
+    range_worker['output_file'] = range_config['output_file']
+    range_worker['batch_size'] = range_config['batch_size']
+
+
+## Count and hash of the raw BSON of the documents in a range, in _id order, documents are not decoded
+def range_digest(collection, start_id, end_id, batch_size):
+    digest = hashlib.sha256()
+    num_docs = 0
+    for doc in raw_collection(collection).find(id_range_filter(start_id, end_id)).sort('_id', 1).batch_size(batch_size):
+        digest.update(doc.raw)
+        num_docs += 1
+    return num_docs, digest.hexdigest()
+
+
+## Compare one range of _id values, documents are only compared one by one when the range digests differ
+def compare_range(range_task):
+    range_num, start_id, end_id = range_task
+    src_collection = range_worker['src']
+    tgt_collection = range_worker['tgt']
+    output_file = range_worker['output_file']
+    batch_size = range_worker['batch_size']
+
+    src_digest = range_digest(src_collection, start_id, end_id, batch_size)
+    tgt_digest = range_digest(tgt_collection, start_id, end_id, batch_size)
+    result = {'range': range_num, 'source_count': src_digest[0], 'target_count': tgt_digest[0], 'differences': 0, 'errors': 0}
+
+    if src_digest != tgt_digest:
+        range_filter = id_range_filter(start_id, end_id)
+        source_cursor = raw_collection(src_collection).find(range_filter).sort('_id', 1).batch_size(batch_size)
+        target_cursor = raw_collection(tgt_collection).find(range_filter).sort('_id', 1).batch_size(batch_size)
+        for src_doc, tgt_doc in merge_by_id(source_cursor, target_cursor):
+            if tgt_doc is None:
+                write_difference_to_file(output_file, "Document _ID present in the source collection, but not in the target collection: " + str(src_doc['_id']))
+                result['differences'] += 1
+            elif src_doc is None:
+                write_difference_to_file(output_file, "Document _ID present in the target collection but not in the source collection: " + str(tgt_doc['_id']))
+                result['differences'] += 1
+            elif src_doc.raw != tgt_doc.raw:
+                doc_differs = compare_docs_deepdiff(src_doc, tgt_doc, output_file)
+                if doc_differs is None:
+                    # the documents are not identical, so a failed comparison must not leave the range verified
+                    write_difference_to_file(output_file, "Error comparing document _ID: " + str(src_doc['_id']))
+                    result['errors'] += 1
+                elif doc_differs:
+                    result['differences'] += 1
+
+    if result['errors'] > 0:
+        result['status'] = 'error'
+    elif result['differences'] > 0:
+        result['status'] = 'differences'
+    else:
+        result['status'] = 'verified'
+    return result
+
+
+## The checkpoint file holds the _id ranges on the first line, then one line per compared range
+def load_range_checkpoint(checkpoint_file):
+    checkpoint = None
+    completed_ranges = {}
+    if os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'r+') as file:
+            lines = file.readlines()
+            if len(lines) > 0 and not lines[-1].endswith('\n'):
+                # partially written line from an interrupted run
+                lines.pop()
+                file.truncate(sum(len(line.encode('utf-8')) for line in lines))
+            for line in lines:
+                try:
+                    entry = json_util.loads(line)
+                except ValueError:
+                    continue
+                if 'ranges' in entry:
+                    checkpoint = entry
+                else:
+                    # differences of a completed range are already in the output file, so the range is not compared again
+                    completed_ranges[entry['range']] = entry
+    return checkpoint, completed_ranges
+
+
+def write_range_checkpoint(checkpoint_file, entry):
+    with open(checkpoint_file, 'a') as file:
+        file.write(json_util.dumps(entry, json_options=json_util.CANONICAL_JSON_OPTIONS) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+## Compare ranges of _id values in parallel processes, ranges compared by an earlier run are skipped
+def compare_document_data_by_range(srcCollection, range_config):
+    checkpoint_file = range_config['checkpoint_file']
+    namespaces = {'source': range_config['source_db'] + '.' + range_config['source_coll'], 'target': range_config['target_db'] + '.' + range_config['target_coll']}
+
+    checkpoint, completed_ranges = load_range_checkpoint(checkpoint_file)
+    if checkpoint is None:
+        id_ranges = id_range_boundaries(srcCollection, range_config['num_ranges'])
+        write_range_checkpoint(checkpoint_file, dict(namespaces, ranges=[list(id_range) for id_range in id_ranges]))
+    elif checkpoint['source'] != namespaces['source'] or checkpoint['target'] != namespaces['target']:
+        print(f"Checkpoint file {checkpoint_file} is for {checkpoint['source']} and {checkpoint['target']}, remove it or use a different --checkpoint-file")
+        return
+    else:
+        id_ranges = [tuple(id_range) for id_range in checkpoint['ranges']]
+        print(f"Resuming from {checkpoint_file}, {len(completed_ranges)} of {len(id_ranges)} ranges already compared")
+
+    range_tasks = [(range_num, start_id, end_id) for range_num, (start_id, end_id) in enumerate(id_ranges) if range_num not in completed_ranges]
+    progress_bar = tqdm(total=len(id_ranges), initial=len(id_ranges) - len(range_tasks), desc='Comparing ranges', unit='range')
+    # totals include the ranges compared by earlier runs
+    num_differences = sum(entry['differences'] for entry in completed_ranges.values())
+    num_errors = sum(entry.get('errors', 0) for entry in completed_ranges.values())
+
+    with Pool(range_config['num_workers'], initializer=init_range_worker, initargs=(range_config,)) as pool:
+        for result in pool.imap_unordered(compare_range, range_tasks):
+            write_range_checkpoint(checkpoint_file, result)
+            num_differences += result['differences']
+            num_errors += result['errors']
+            progress_bar.update(1)
+
+    progress_bar.close()
+    # every range has been compared, a later run starts a new comparison
+    os.remove(checkpoint_file)
+    print(f"Compared {len(id_ranges)} ranges ({len(range_tasks)} in this run), {num_differences} differences found")
+    if num_errors > 0:
+        print(f"{num_errors} documents could not be compared, see {range_config['output_file']}")
+
+
+def compare_collections(srcCollection, tgtCollection, batch_size, output_file, check_target, sample_size_percent, sampling_timeout_ms, merge_join, check_target_ranges, range_config=None):
     src_count = srcCollection.count_documents({})
     trg_count = tgtCollection.count_documents({})
 
@@ -150,10 +520,24 @@ def compare_collections(srcCollection, tgtCollection, batch_size, output_file, c
     write_difference_to_file(output_file, "Count of documents in target:" + str(trg_count) )
 
     print(f"Starting data differ at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} , output is saved to {output_file}")
-    compare_document_data(srcCollection, tgtCollection, batch_size, output_file, src_count, sample_size_percent, sampling_timeout_ms)
+    if range_config is not None:
+        # also finds the documents only in target, no need for check_target
+        compare_document_data_by_range(srcCollection, range_config)
+        compare_indexes(srcCollection, tgtCollection, output_file)
+        return
+
+    # one pool of DeepDiff workers for the whole comparison
+    compare_stats = {'identical': 0, 'deepdiff': 0}
+    with Pool(cpu_count()) as pool:
+        if merge_join:
+            # also finds the documents only in target, no need for check_target
+            compare_document_data_merge_join(pool, srcCollection, tgtCollection, batch_size, output_file, src_count, compare_stats)
+        else:
+            compare_document_data(pool, srcCollection, tgtCollection, batch_size, output_file, src_count, sample_size_percent, sampling_timeout_ms, compare_stats)
+    print(f"{compare_stats['identical']} documents were identical, {compare_stats['deepdiff']} documents were compared with DeepDiff")
     compare_indexes(srcCollection, tgtCollection, output_file)
-    if check_target:
-        check_target_for_extra_documents(srcCollection, tgtCollection, output_file)
+    if check_target and not merge_join:
+        check_target_for_extra_documents(srcCollection, tgtCollection, output_file, check_target_ranges)
 
 
 def main():
@@ -169,8 +553,26 @@ def main():
     parser.add_argument('--target-coll', type=str, required=True, help='Target collection name (required)')
     parser.add_argument('--sample-size-percent', type=int, required=False, help='optional, if set only samples a percentage of the documents')
     parser.add_argument('--sampling-timeout-ms', type=int, default=500, required=False, help='optional, override the timeout for returning a sample of documents when using the --sample-size-percent argument')
+    parser.add_argument('--merge-join', action='store_true', default=False, help='optional, compare by reading both collections in _id order, also finds extra documents in target')
+    parser.add_argument('--check-target-ranges', type=int, default=cpu_count() * 4, help='optional, number of _id ranges compared in parallel by --check-target (default: 4 x number of CPUs)')
+    parser.add_argument('--range-compare', action='store_true', default=False, help='optional, compare ranges of _id values in parallel processes using per-range checksums, resumable with --checkpoint-file')
+    parser.add_argument('--num-ranges', type=int, default=256, help='optional, number of _id ranges for --range-compare (default: 256)')
+    parser.add_argument('--workers', type=int, default=cpu_count(), help='optional, number of processes for --range-compare (default: number of CPUs)')
+    parser.add_argument('--checkpoint-file', type=str, required=False, help='optional, file recording the progress of --range-compare, a rerun of an interrupted comparison skips ranges already compared (default: <output-file>.checkpoint)')
     args = parser.parse_args()
 
+    if (args.merge_join or args.range_compare) and args.sample_size_percent:
+        parser.error("--merge-join and --range-compare cannot be combined with --sample-size-percent")
+
+    range_config = None
+    if args.range_compare:
+        range_config = {'source_uri': args.source_uri, 'target_uri': args.target_uri,
+                        'source_db': args.source_db, 'source_coll': args.source_coll,
+                        'target_db': args.target_db, 'target_coll': args.target_coll,
+                        'output_file': args.output_file, 'batch_size': args.batch_size,
+                        'num_ranges': args.num_ranges, 'num_workers': args.workers,
+                        'checkpoint_file': args.checkpoint_file or args.output_file + '.checkpoint'}
+
     # Connect to the source database cluster
     cluster1_client = connect_to_db(args.source_uri, 50)
     srcdb = cluster1_client[args.source_db]
@@ -182,7 +584,7 @@ def main():
     tgtCollection = tgtdb[args.target_coll]
 
     # Compare collections and report differences
-    compare_collections(srcCollection, tgtCollection, args.batch_size, args.output_file, args.check_target, args.sample_size_percent, args.sampling_timeout_ms)
+    compare_collections(srcCollection, tgtCollection, args.batch_size, args.output_file, args.check_target, args.sample_size_percent, args.sampling_timeout_ms, args.merge_join, args.check_target_ranges, range_config)
 
 if __name__ == '__main__':
     main()
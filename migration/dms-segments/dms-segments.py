@@ -6,10 +6,14 @@ import time
 import os
 import argparse
 import warnings
+import concurrent.futures
 
 
 supportedIdTypes=['int','string','objectId']
 
+# BSON comparison order of the $type aliases, types in the same bracket compare by value
+bsonTypeBrackets=[['minKey'],['undefined','null','missing'],['int','long','double','decimal'],['symbol','string'],['object'],['array'],['binData'],['objectId'],['bool'],['date'],['timestamp'],['regex'],['maxKey']]
+
 
 def via_skips(appConfig):
     # get boundaries by performing large server-side skips
@@ -139,6 +143,190 @@ def via_cursor(appConfig):
 
     client.close()
 
+def type_bracket(typeName):
+    for bracketNum, thisBracket in enumerate(bsonTypeBrackets):
+        if typeName in thisBracket:
+            return bracketNum
+    return len(bsonTypeBrackets)
+
+
+def types_after(typeName):
+    # $type aliases that sort after every value of this type, excluding the placeholder aliases
+    afterTypes = []
+    for thisBracket in bsonTypeBrackets[type_bracket(typeName)+1:]:
+        afterTypes.extend(thisBracket)
+    return [t for t in afterTypes if t not in ['undefined','missing']]
+
+
+def types_before(typeName):
+    beforeTypes = []
+    for thisBracket in bsonTypeBrackets[:type_bracket(typeName)]:
+        beforeTypes.extend(thisBracket)
+    return [t for t in beforeTypes if t not in ['undefined','missing']]
+
+
+def boundary_filter(segmentFields, boundary, compareOp):
+    # filter for documents ordered >= ("$gte") or < ("$lt") the boundary across all segment fields
+    #   comparison operators only match values of the same type bracket, so values of later (or earlier) types are matched with $type
+    #   compound boundaries compare field by field, equal on the leading fields and then greater (or less) on the next
+    orList = []
+    for fieldNum, thisField in enumerate(segmentFields):
+        thisValue = boundary['values'][fieldNum]
+        thisType = boundary['types'][fieldNum]
+        isLastField = (fieldNum == len(segmentFields)-1)
+
+        prefixFilter = {}
+        for prefixNum in range(fieldNum):
+            prefixFilter[segmentFields[prefixNum]] = boundary['values'][prefixNum]
+
+        if compareOp == "$gte":
+            valueOp = "$gte" if isLastField else "$gt"
+            otherTypes = types_after(thisType)
+        else:
+            valueOp = "$lt"
+            otherTypes = types_before(thisType)
+
+        thisFilter = dict(prefixFilter)
+        thisFilter[thisField] = {valueOp:thisValue}
+        orList.append(thisFilter)
+
+        if len(otherTypes) > 0:
+            thisFilter = dict(prefixFilter)
+            thisFilter[thisField] = {"$type":otherTypes}
+            orList.append(thisFilter)
+
+        if 'null' in otherTypes:
+            # missing fields sort with null but are not matched by $type
+            thisFilter = dict(prefixFilter)
+            thisFilter[thisField] = {"$exists":False}
+            orList.append(thisFilter)
+
+    return {"$or":orList}
+
+
+def range_filter(segmentFields, startBoundary, endBoundary):
+    andList = []
+    if startBoundary is not None:
+        andList.append(boundary_filter(segmentFields, startBoundary, "$gte"))
+    if endBoundary is not None:
+        andList.append(boundary_filter(segmentFields, endBoundary, "$lt"))
+    if len(andList) == 0:
+        return {}
+    return {"$and":andList}
+
+
+def boundary_stages(segmentFields):
+    # sort by the segment fields and return each value with its BSON type
+    sortStage = {}
+    projectStage = {"_id":False}
+    for fieldNum, thisField in enumerate(segmentFields):
+        sortStage[thisField] = pymongo.ASCENDING
+        projectStage["v{}".format(fieldNum)] = {"$ifNull":["$"+thisField,None]}
+        projectStage["t{}".format(fieldNum)] = {"$type":"$"+thisField}
+    return [{"$sort":sortStage},{"$project":projectStage}]
+
+
+def as_boundary(segmentFields, thisDoc):
+    return {'values':[thisDoc["v{}".format(fieldNum)] for fieldNum in range(len(segmentFields))],
+            'types':[thisDoc["t{}".format(fieldNum)] for fieldNum in range(len(segmentFields))]}
+
+
+def boundary_as_string(thisBoundary):
+    return ",".join('"{}"'.format(i) for i in thisBoundary['values'])
+
+
+def count_range(col, segmentFields, startBoundary, endBoundary):
+    return col.count_documents(range_filter(segmentFields, startBoundary, endBoundary))
+
+
+def via_sampling(appConfig):
+    # get boundaries from the quantiles of a random sample, then count the documents in each segment in parallel
+    warnings.filterwarnings("ignore","You appear to be connected to a DocumentDB cluster.")
+
+    numBoundaries = appConfig['numSegments'] - 1
+    segmentFields = appConfig['segmentFields']
+
+    client = pymongo.MongoClient(host=appConfig['uri'],appname='segmentr')
+    db = client[appConfig['database']]
+    col = db[appConfig['collection']]
+
+    collStats = db.command("collStats",appConfig['collection'])
+    numDocuments = collStats['count']
+    feedbackDocuments = int(numDocuments/appConfig['numSegments'])
+    sampleSize = min(appConfig['sampleSize'],numDocuments)
+
+    print("")
+    print("collection {}.{} contains {} documents".format(appConfig['database'],appConfig['collection'],numDocuments))
+    print("finding {} values for {} chunks, approximately {} documents in each".format(",".join(segmentFields),appConfig['numSegments'],feedbackDocuments))
+
+    queryStartTime = time.time()
+
+    # quantiles of a sorted random sample
+    sampleList = list(col.aggregate([{"$sample":{"size":sampleSize}}] + boundary_stages(segmentFields), allowDiskUse=True))
+    print("  sampled {} documents in {} seconds".format(len(sampleList),int(time.time() - queryStartTime)))
+
+    sampledBoundaries = []
+    sampledCounts = []
+    lastSampleNum = 0
+    for x in range(numBoundaries):
+        sampleNum = int(round((x+1)*len(sampleList)/appConfig['numSegments']))
+        if (sampleNum <= lastSampleNum) or (sampleNum >= len(sampleList)):
+            continue
+        thisBoundary = as_boundary(segmentFields, sampleList[sampleNum])
+        if (len(sampledBoundaries) > 0) and (thisBoundary == sampledBoundaries[-1]):
+            # duplicate values cannot be a boundary more than once
+            continue
+        sampledBoundaries.append(thisBoundary)
+        sampledCounts.append(int(numDocuments*(sampleNum-lastSampleNum)/len(sampleList)))
+        lastSampleNum = sampleNum
+    sampledCounts.append(numDocuments - sum(sampledCounts))
+
+    boundaryList = sampledBoundaries
+
+    if appConfig['estimateOnly']:
+        # counts in proportion to the sample, no queries beyond the sample
+        segmentCounts = sampledCounts
+    else:
+        # exact count of each segment that is output, every count is an independent range of the index
+        rangeList = [None] + boundaryList + [None]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=appConfig['numThreads']) as executor:
+            segmentCounts = list(executor.map(lambda rangeNum: count_range(col, segmentFields, rangeList[rangeNum], rangeList[rangeNum+1]), range(len(rangeList)-1)))
+        print("  counted {} segments in {} seconds".format(len(segmentCounts),int(time.time() - queryStartTime)))
+
+    print("")
+
+    # output full boundary list
+    print("Boundary list")
+    for boundaryNum, thisBoundary in enumerate(boundaryList):
+        print("  boundary {:3d} - {} {}".format(boundaryNum+1,"/".join(thisBoundary['types']),boundary_as_string(thisBoundary)))
+
+    print("")
+
+    if appConfig['estimateOnly']:
+        print("Estimated documents per segment")
+    else:
+        print("Documents per segment")
+    for segmentNum, thisCount in enumerate(segmentCounts):
+        print("  segment {:3d} - {:12,d}".format(segmentNum+1,thisCount))
+
+    print("")
+
+    boundaryListAsString = "{}".format(",".join(boundary_as_string(i) for i in boundaryList))
+    print("boundaries as list | {}".format(boundaryListAsString))
+
+    boundaryListAsStringForDms = "[{}]".format("],[".join(boundary_as_string(i) for i in boundaryList))
+    print("")
+    print("boundaries as list for DMS | {}".format(boundaryListAsStringForDms))
+
+    print("")
+
+    queryElapsedSecs = int(time.time() - queryStartTime)
+    print('query required {} seconds'.format(queryElapsedSecs))
+
+    print("")
+
+    client.close()
+
 
 def check_for_mixed_types(appConfig):
     # grab the first document and last document as ordered by _id, check for unsupported or differing data types
@@ -203,6 +391,34 @@ def main():
                         action='store_true',
                         help='Scan the full _id index using a cursor')
 
+    parser.add_argument('--sample',
+                        required=False,
+                        action='store_true',
+                        help='Find boundaries from a random sample, the documents in each segment are counted in parallel')
+
+    parser.add_argument('--sample-size',
+                        required=False,
+                        type=int,
+                        default=10000,
+                        help='Number of documents to sample for --sample')
+
+    parser.add_argument('--estimate-only',
+                        required=False,
+                        action='store_true',
+                        help='Output the sampled boundaries with counts estimated from the sample, without counting each segment')
+
+    parser.add_argument('--segment-fields',
+                        required=False,
+                        type=str,
+                        default='_id',
+                        help='Comma separated list of fields to segment on for --sample, an index on these fields is required')
+
+    parser.add_argument('--threads',
+                        required=False,
+                        type=int,
+                        default=8,
+                        help='Number of concurrent queries for --sample')
+
     args = parser.parse_args()
 
     appConfig = {}
@@ -210,8 +426,20 @@ def main():
     appConfig['database'] = args.database
     appConfig['collection'] = args.collection
     appConfig['numSegments'] = int(args.num_segments)
+    appConfig['sampleSize'] = args.sample_size
+    appConfig['estimateOnly'] = args.estimate_only
+    appConfig['segmentFields'] = args.segment_fields.split(',')
+    appConfig['numThreads'] = args.threads
+
+    if (appConfig['segmentFields'] != ['_id']) and (not args.sample):
+        print("--segment-fields is only supported with --sample, stopping")
+        sys.exit(1)
+
+    if args.sample:
+        # sampling supports mixed data types
+        via_sampling(appConfig)
 
-    if check_for_mixed_types(appConfig):
+    elif check_for_mixed_types(appConfig):
         if args.single_cursor:
             via_cursor(appConfig)
 
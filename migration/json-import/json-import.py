@@ -8,9 +8,15 @@ from pymongo import InsertOne, DeleteOne, ReplaceOne, UpdateOne
 import time
 import threading
 import os
+import re
+import io
+import gzip
+import mmap
 import multiprocessing as mp
 import argparse
+import bson
 from bson.json_util import loads
+from bson.raw_bson import RawBSONDocument
 
 
 def initializeLogFile(appConfig):
@@ -79,6 +85,7 @@ def reporter(appConfig,perfQ):
         
         numLatencyBatches = 0
         numLatencyMs = 0
+        numDecodeMs = 0
 
         queueMessagesProcessed = 0
         queueDrained = False
@@ -87,11 +94,13 @@ def reporter(appConfig,perfQ):
                 qMessage = perfQ.get_nowait()
             except Empty:
                 queueDrained = True
+                continue
             queueMessagesProcessed += 1
             if qMessage['name'] == "batchCompleted":
                 totalOps += qMessage['operations']
                 numLatencyBatches += 1
                 numLatencyMs += qMessage['latency']
+                numDecodeMs += qMessage['decodeLatency']
             elif qMessage['name'] == "processCompleted":
                 numWorkersCompleted += 1
 
@@ -113,8 +122,10 @@ def reporter(appConfig,perfQ):
             intervalOpsPerSecond = 0
         if numLatencyBatches > 0:
             intervalLatencyMs = numLatencyMs // numLatencyBatches
+            intervalDecodeMs = numDecodeMs // numLatencyBatches
         else:
             intervalLatencyMs = 0
+            intervalDecodeMs = 0
         
         # recent intervals
         if len(recentTps) == numIntervalsTps:
@@ -126,27 +137,200 @@ def reporter(appConfig,perfQ):
         avgRecentTps = totRecentTps / len(recentTps)
         
         logTimeStamp = datetime.utcnow().isoformat()[:-3] + 'Z'
-        logAndPrint(appConfig,"[{}] elapsed {} | total ins/upd {:16,d} at {:12,.2f} p/s | last {} {:12,.2f} p/s | interval {:12,.2f} p/s | lat (ms) {:12}"
-        .format(logTimeStamp,thisHMS,totalOps,opsPerSecond,numIntervalsTps,avgRecentTps,intervalOpsPerSecond,intervalLatencyMs))
+        logAndPrint(appConfig,"[{}] elapsed {} | total ins/upd {:16,d} at {:12,.2f} p/s | last {} {:12,.2f} p/s | interval {:12,.2f} p/s | lat (ms) {:12} | decode (ms) {:12}"
+        .format(logTimeStamp,thisHMS,totalOps,opsPerSecond,numIntervalsTps,avgRecentTps,intervalOpsPerSecond,intervalLatencyMs,intervalDecodeMs))
         nextReportTime = nowTime + numSecondsFeedback
         
         lastTime = nowTime
         lastTotalOps = totalOps
 
 
-def task_worker(workerNum,appConfig,perfQ):
-    numOpsPerBatch = appConfig['numOpsPerBatch']
+def isCompressed(fileName):
+    return fileName.endswith('.gz') or fileName.endswith('.zst')
+
+
+def openInputFile(fileName):
+    # compressed files are decompressed as a stream, so they can only be read from the start
+    if fileName.endswith('.gz'):
+        return gzip.open(fileName, 'rb')
+    elif fileName.endswith('.zst'):
+        import zstandard
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(fileName, 'rb'), read_across_frames=True, closefd=True))
+    else:
+        return open(fileName, 'rb')
+
+
+def checkpointHeader(appConfig):
+    # chunk numbers only identify the same lines when the same file is split the same way and loaded the same way into the same collection
+    # credentials are left out of the uri so they are not written to the checkpoint file
+    checkpointHeader = {"fileName":os.path.abspath(appConfig['fileName']),"fileSize":os.path.getsize(appConfig['fileName'])}
+    checkpointHeader['uri'] = re.sub(r'://[^/]*@', '://', appConfig['uri'])
+    checkpointHeader['databaseName'] = appConfig['databaseName']
+    checkpointHeader['collectionName'] = appConfig['collectionName']
+    checkpointHeader['mode'] = appConfig['mode']
+    if isCompressed(appConfig['fileName']):
+        checkpointHeader['linesPerChunk'] = appConfig['linesPerChunk']
+    else:
+        checkpointHeader['chunkSizeMb'] = appConfig['chunkSizeMb']
+    return checkpointHeader
+
+
+def initializeCheckpoint(appConfig):
+    checkpointFile = appConfig['checkpointFile']
+    with open(checkpointFile + ".tmp", 'w') as f:
+        f.write(json.dumps(checkpointHeader(appConfig)) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(checkpointFile + ".tmp", checkpointFile)
+
+
+def loadCheckpoint(appConfig):
+    # returns the header, the completed chunk numbers, and the highest chunk number started
+    checkpointFile = appConfig['checkpointFile']
+
+    # a crash can leave a partial last line, it is removed so new lines are not appended to it
+    with open(checkpointFile, 'rb+') as f:
+        checkpointBytes = f.read()
+        if not checkpointBytes.endswith(b"\n"):
+            f.truncate(checkpointBytes.rfind(b"\n") + 1)
+
+    header = None
+    completedChunks = set()
+    lastStartedChunk = -1
+    for thisLine in checkpointBytes.split(b"\n")[:-1]:
+        try:
+            thisEntry = json.loads(thisLine)
+        except ValueError:
+            continue
+        if header is None:
+            header = thisEntry
+        elif thisEntry['status'] == 'completed':
+            completedChunks.add(thisEntry['chunkNum'])
+        elif thisEntry['status'] == 'started':
+            lastStartedChunk = max(lastStartedChunk, thisEntry['chunkNum'])
+
+    return header, completedChunks, lastStartedChunk
+
+
+def recordChunk(checkpointFd, chunkNum, status):
+    # a single append per entry so workers never interleave within a line
+    os.write(checkpointFd, (json.dumps({"chunkNum":chunkNum,"status":status}) + "\n").encode())
+    os.fsync(checkpointFd)
+
+
+def chunk_feeder(appConfig,workQ,completedChunks,lastStartedChunk):
+    # the file is read once no matter how many workers, each chunk is given to the next available worker
+    #   uncompressed - chunks are byte ranges ending on a line boundary, workers read their own ranges
+    #   compressed - the file is decompressed here and chunks of lines are sent to the workers
+    # when resuming, completed chunks are skipped and chunks that may have been partially loaded are upserted
     numWorkers = appConfig['numWorkers']
-    linesPerChunk = appConfig['linesPerChunk']
-    opMode = appConfig['mode']
-    numChunks = 1
-    
-    myLineStart = (workerNum*linesPerChunk)+1
-    myLineEnd = (workerNum+1)*linesPerChunk
-    
-    if appConfig['debugLevel'] >= 1:
-        logAndPrint(appConfig,"worker {} - start {} end {} chunk {}".format(workerNum,myLineStart,myLineEnd,numChunks))
+    chunkNum = 0
+
+    if isCompressed(appConfig['fileName']):
+        linesPerChunk = appConfig['linesPerChunk']
+        chunkLines = []
+        with openInputFile(appConfig['fileName']) as f:
+            for thisLine in f:
+                chunkLines.append(thisLine)
+                if len(chunkLines) >= linesPerChunk:
+                    if chunkNum not in completedChunks:
+                        workQ.put({"chunkNum":chunkNum,"mode":chunkMode(appConfig,chunkNum,lastStartedChunk),"data":b"".join(chunkLines)})
+                    chunkNum += 1
+                    chunkLines = []
+        if len(chunkLines) > 0:
+            if chunkNum not in completedChunks:
+                workQ.put({"chunkNum":chunkNum,"mode":chunkMode(appConfig,chunkNum,lastStartedChunk),"data":b"".join(chunkLines)})
+            chunkNum += 1
+
+    else:
+        chunkBytes = appConfig['chunkSizeMb'] * 1024 * 1024
+        fileSize = os.path.getsize(appConfig['fileName'])
+        startByte = 0
+        with open(appConfig['fileName'], 'rb') as f:
+            while startByte < fileSize:
+                if startByte + chunkBytes >= fileSize:
+                    endByte = fileSize
+                else:
+                    # extend to the end of the line
+                    f.seek(startByte + chunkBytes)
+                    f.readline()
+                    endByte = f.tell()
+                if chunkNum not in completedChunks:
+                    workQ.put({"chunkNum":chunkNum,"mode":chunkMode(appConfig,chunkNum,lastStartedChunk),"startByte":startByte,"endByte":endByte,"data":None})
+                chunkNum += 1
+                startByte = endByte
 
+    if appConfig['debugLevel'] >= 1:
+        logAndPrint(appConfig,"feeder - sent {} chunks".format(chunkNum))
+
+    # tell each worker there is nothing left
+    for loop in range(numWorkers):
+        workQ.put(None)
+
+
+def chunkMode(appConfig,chunkNum,lastStartedChunk):
+    # chunks are handed out in order, so any chunk up to the last one started may have been partially loaded
+    if (appConfig['mode'] == 'insert') and (chunkNum <= lastStartedChunk):
+        return 'replace'
+    return appConfig['mode']
+
+
+def chunkLines(thisChunk,f,mm):
+    # lines of a chunk, byte ranges are read from the memory mapped file when available
+    if thisChunk['data'] is not None:
+        return thisChunk['data'].split(b"\n")
+    elif mm is not None:
+        return mm[thisChunk['startByte']:thisChunk['endByte']].split(b"\n")
+    else:
+        f.seek(thisChunk['startByte'])
+        return f.read(thisChunk['endByte'] - thisChunk['startByte']).split(b"\n")
+
+
+def decodeLines(batchLines):
+    # a single decode for the whole batch, decoding line by line when that fails so the bad line is reported
+    try:
+        docList = loads(b"[" + b",".join(batchLines) + b"]")
+        if len(docList) == len(batchLines):
+            return docList
+    except ValueError:
+        pass
+    return [loads(thisLine) for thisLine in batchLines]
+
+
+def write_batch(col,opMode,batchLines,perfQ):
+    decodeStartTime = time.time()
+    docList = decodeLines(batchLines)
+
+    if opMode == 'insert':
+        # encoded to BSON once here, pymongo sends RawBSONDocument bytes as-is
+        opList = [RawBSONDocument(bson.encode(thisDoc)) for thisDoc in docList]
+    elif opMode == 'replace':
+        # documents without an _id can only be inserted
+        opList = [ReplaceOne({"_id":thisDoc['_id']},thisDoc,upsert=True) if '_id' in thisDoc else InsertOne(thisDoc) for thisDoc in docList]
+    elif opMode == 'update':
+        opList = [UpdateOne({"_id":thisDoc['_id']},{"$set":thisDoc},upsert=True) for thisDoc in docList]
+    decodeElapsedMs = int((time.time() - decodeStartTime) * 1000)
+
+    batchStartTime = time.time()
+    if opMode == 'insert':
+        col.insert_many(opList, ordered=False)
+    else:
+        col.bulk_write(opList, ordered=False)
+    batchElapsedMs = int((time.time() - batchStartTime) * 1000)
+    perfQ.put({"name":"batchCompleted","operations":len(opList),"latency":batchElapsedMs,"decodeLatency":decodeElapsedMs,"timeAt":time.time()})
+
+
+def task_worker(workerNum,appConfig,workQ,perfQ):
+    try:
+        load_chunks(workerNum,appConfig,workQ,perfQ)
+    finally:
+        # the reporter waits for every worker, including one that failed
+        perfQ.put({"name":"processCompleted","processNum":workerNum,"timeAt":time.time()})
+
+
+def load_chunks(workerNum,appConfig,workQ,perfQ):
+    numOpsPerBatch = appConfig['numOpsPerBatch']
+    
     client = pymongo.MongoClient(host=appConfig['uri'],appname='jsonimp')
     db = client[appConfig['databaseName']]
     col = db[appConfig['collectionName']]
@@ -154,57 +338,59 @@ def task_worker(workerNum,appConfig,perfQ):
     if appConfig['debugLevel'] >= 1:
         logAndPrint(appConfig,"starting worker process {} - using collection {}.{}".format(workerNum,appConfig['databaseName'],appConfig['collectionName']))
 
-    startTime = time.time()
-    lastTime = time.time()
+    # byte ranges of uncompressed files are read directly
+    f = None
+    mm = None
+    if not isCompressed(appConfig['fileName']):
+        f = open(appConfig['fileName'], 'rb')
+        if appConfig['useMmap'] and os.path.getsize(appConfig['fileName']) > 0:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    checkpointFd = os.open(appConfig['checkpointFile'], os.O_WRONLY | os.O_APPEND)
 
     numBatchesCompleted = 0
-    numBatchOps = 0
-    fileLineNum = 0
-    insList = []
 
-    with open(appConfig['fileName'], 'r') as f:
-        for thisLine in f:
-            fileLineNum += 1
+    while True:
+        thisChunk = workQ.get()
+        if thisChunk is None:
+            break
+
+        if appConfig['debugLevel'] >= 1:
+            logAndPrint(appConfig,"worker {} - chunk {} mode {}".format(workerNum,thisChunk['chunkNum'],thisChunk['mode']))
+
+        recordChunk(checkpointFd, thisChunk['chunkNum'], 'started')
+
+        opMode = thisChunk['mode']
+
+        # lines are decoded a batch at a time
+        batchLines = []
+
+        for thisLine in chunkLines(thisChunk,f,mm):
+            if len(thisLine.strip()) == 0:
+                continue
+
+            # add to batch
+            batchLines.append(thisLine)
+            
+            if (len(batchLines) >= numOpsPerBatch):
+                write_batch(col,opMode,batchLines,perfQ)
+                numBatchesCompleted += 1
+                batchLines = []
             
-            if (fileLineNum >= myLineStart) and (fileLineNum <= myLineEnd):
-                # add to batch
-                thisDict = loads(thisLine)
-                numBatchOps += 1
-                
-                if opMode == 'insert':
-                    insList.append(InsertOne(thisDict.copy()))
-                elif opMode == 'replace':
-                    insList.append(ReplaceOne({"_id":thisDict['_id']},thisDict.copy(),upsert=True))
-                elif opMode == 'update':
-                    insList.append(UpdateOne({"_id":thisDict['_id']},{"$set":thisDict.copy()},upsert=True))
-                
-                if (numBatchOps >= numOpsPerBatch):
-                    batchStartTime = time.time()
-                    result = col.bulk_write(insList, ordered=False)
-                    batchElapsedMs = int((time.time() - batchStartTime) * 1000)
-                    numBatchesCompleted += 1
-                    perfQ.put({"name":"batchCompleted","operations":numBatchOps,"latency":batchElapsedMs,"timeAt":time.time()})
-                    insList = []
-                    numBatchOps = 0
-                
-            if (fileLineNum == myLineEnd):
-                # increment boundaries
-                myLineStart += (numWorkers*linesPerChunk)
-                myLineEnd += (numWorkers*linesPerChunk)
-                numChunks += 1
-                if appConfig['debugLevel'] >= 1:
-                    logAndPrint(appConfig,"worker {} - start {} end {} chunk {}".format(workerNum,myLineStart,myLineEnd,numChunks))
-                
-        if numBatchOps > 0:
-            batchStartTime = time.time()
-            result = col.bulk_write(insList, ordered=False)
-            batchElapsedMs = int((time.time() - batchStartTime) * 1000)
+        # batches do not span chunks
+        if len(batchLines) > 0:
+            write_batch(col,opMode,batchLines,perfQ)
             numBatchesCompleted += 1
-            perfQ.put({"name":"batchCompleted","operations":numBatchOps,"latency":batchElapsedMs,"timeAt":time.time()})
+
+        recordChunk(checkpointFd, thisChunk['chunkNum'], 'completed')
     
+    os.close(checkpointFd)
+    if mm is not None:
+        mm.close()
+    if f is not None:
+        f.close()
+
     client.close()
-    
-    perfQ.put({"name":"processCompleted","processNum":workerNum,"timeAt":time.time()})
 
 
 def main():
@@ -254,7 +440,18 @@ def main():
                         required=False,
                         type=int,
                         default=1000,
-                        help='Number of lines each worker reserves before jumping ahead in the file to the next chunk')
+                        help='Number of lines in each chunk of a compressed (.gz or .zst) file')
+
+    parser.add_argument('--chunk-size-mb',
+                        required=False,
+                        type=int,
+                        default=16,
+                        help='Size of each chunk of an uncompressed file in megabytes, chunks are extended to the end of a line')
+
+    parser.add_argument('--mmap',
+                        required=False,
+                        action='store_true',
+                        help='Read chunks of an uncompressed file using a memory map')
 
     parser.add_argument('--debug-level',
                         required=False,
@@ -273,6 +470,11 @@ def main():
                         action='store_true',
                         help='Drop the collection prior to loading data')
 
+    parser.add_argument('--checkpoint-file',
+                        required=False,
+                        type=str,
+                        help='File recording the chunks loaded so an interrupted import can be resumed, default is the log file name followed by .checkpoint')
+
     args = parser.parse_args()
 
     MIN_PYTHON = (3, 7)
@@ -288,9 +490,15 @@ def main():
     appConfig['fileName'] = args.file_name
     appConfig['logFileName'] = args.log_file_name
     appConfig['linesPerChunk'] = args.lines_per_chunk
+    appConfig['chunkSizeMb'] = args.chunk_size_mb
+    appConfig['useMmap'] = args.mmap
     appConfig['debugLevel'] = args.debug_level
     appConfig['mode'] = args.mode
     appConfig['dropCollection'] = args.drop_collection
+    if args.checkpoint_file is not None:
+        appConfig['checkpointFile'] = args.checkpoint_file
+    else:
+        appConfig['checkpointFile'] = "{}.checkpoint".format(args.log_file_name)
     
     initializeLogFile(appConfig)
 
@@ -310,27 +518,59 @@ def main():
  
     setup(appConfig)
 
+    # resume from the checkpoint of an interrupted import, dropping the collection starts over
+    completedChunks = set()
+    lastStartedChunk = -1
+    if os.path.isfile(appConfig['checkpointFile']) and not appConfig['dropCollection']:
+        header, completedChunks, lastStartedChunk = loadCheckpoint(appConfig)
+        if header != checkpointHeader(appConfig):
+            sys.exit("\nCheckpoint file {} is for a different file, chunk size, target collection, or mode, remove it or use --drop-collection to start over.\n".format(appConfig['checkpointFile']))
+        logAndPrint(appConfig,"resuming | {} chunks already loaded, chunks up to {} may be partially loaded".format(len(completedChunks),lastStartedChunk))
+        if appConfig['mode'] == 'insert':
+            logAndPrint(appConfig,"resuming | chunks that may be partially loaded are upserted")
+        if appConfig['mode'] in ['insert','replace']:
+            logAndPrint(appConfig,"resuming | WARNING - documents without an _id in chunks that may be partially loaded are inserted again and may be duplicated")
+    else:
+        initializeCheckpoint(appConfig)
+
     mp.set_start_method('spawn')
 
     random.seed()
     
     q = mp.Manager().Queue()
 
+    # bounded so the feeder stays just ahead of the workers
+    workQ = mp.Queue(maxsize=appConfig['numWorkers']*4)
+
     t = threading.Thread(target=reporter,args=(appConfig,q))
     t.start()
     
     processList = []
     for loop in range(appConfig['numWorkers']):
-        p = mp.Process(target=task_worker,args=(loop,appConfig,q))
+        p = mp.Process(target=task_worker,args=(loop,appConfig,workQ,q))
         processList.append(p)
         
     for process in processList:
         process.start()
+
+    # a daemon so a failed import does not wait on a feeder with no workers left
+    feeder = threading.Thread(target=chunk_feeder,args=(appConfig,workQ,completedChunks,lastStartedChunk),daemon=True)
+    feeder.start()
         
     for process in processList:
         process.join()
         
     t.join()
+
+    # the checkpoint is only needed to resume an import that did not finish
+    if all(process.exitcode == 0 for process in processList):
+        feeder.join()
+        os.remove(appConfig['checkpointFile'])
+    else:
+        logAndPrint(appConfig,"import did not complete, run again with the same options to resume using {}".format(appConfig['checkpointFile']))
+        # chunks still queued for the workers are discarded rather than waiting at exit for a reader that is gone
+        workQ.cancel_join_thread()
+        sys.exit(1)
     
     reportCollectionInfo(appConfig)
     
@@ -6,10 +6,12 @@ import pymongo
 from bson.timestamp import Timestamp
 import threading
 import multiprocessing as mp
-import hashlib
 import argparse
 import boto3
 import warnings
+import cdc_dispatch
+import cdc_checkpoint
+import cdc_bulk
 
 
 def logIt(threadnum, message):
@@ -17,7 +19,7 @@ def logIt(threadnum, message):
     print("[{}] thread {:>3d} | {}".format(logTimeStamp,threadnum,message))
 
 
-def oplog_processor(threadnum, appConfig, perfQ):
+def oplog_processor(threadnum, appConfig, perfQ, dispatchQ=None):
     warnings.filterwarnings("ignore","You appear to be connected to a DocumentDB cluster.")
 
     if appConfig['verboseLogging']:
@@ -30,6 +32,11 @@ def oplog_processor(threadnum, appConfig, perfQ):
     destDatabase = destConnection[appConfig["targetNs"].split('.',1)[0]]
     destCollection = destDatabase[appConfig["targetNs"].split('.',1)[1]]
 
+    # durably record the position of the last applied change so a restart can resume from it
+    checkpointer = None
+    if (appConfig['checkpointDir'] is not None) and (not appConfig['dryRun']):
+        checkpointer = cdc_checkpoint.Checkpointer(appConfig, threadnum)
+
     '''
     i  = insert
     u  = update
@@ -47,9 +54,10 @@ def oplog_processor(threadnum, appConfig, perfQ):
     threadOplogEntries = 0
 
     bulkOpList = []
+
+    # inserts of existing documents retried as upserts
+    bulkStats = cdc_bulk.new_bulk_stats()
     
-    # list with replace, not insert, in case document already exists (replaying old oplog)
-    bulkOpListReplace = []
     numCurrentBulkOps = 0
     
     numTotalBatches = 0
@@ -61,24 +69,28 @@ def oplog_processor(threadnum, appConfig, perfQ):
     endTs = appConfig["startTs"]
 
     while not allDone:
-        if appConfig['verboseLogging']:
-            logIt(threadnum,"Creating oplog tailing cursor for timestamp {}".format(endTs.as_datetime()))
+        if dispatchQ is not None:
+            # changes are routed to this thread by the single reader
+            cursor = cdc_dispatch.DispatchedCursor(dispatchQ)
+        else:
+            if appConfig['verboseLogging']:
+                logIt(threadnum,"Creating oplog tailing cursor for timestamp {}".format(endTs.as_datetime()))
 
-        cursor = oplog.find({'ts': {'$gte': endTs},'ns':appConfig["sourceNs"]},cursor_type=pymongo.CursorType.TAILABLE_AWAIT,oplog_replay=True)
+            cursor = oplog.find({'ts': {'$gte': endTs},'ns':appConfig["sourceNs"]},cursor_type=pymongo.CursorType.TAILABLE_AWAIT,oplog_replay=True)
 
         while cursor.alive and not allDone:
             for doc in cursor:
-                # check if time to exit
-                if ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
+                # check if time to exit, when using a single reader the reader decides
+                if (dispatchQ is None) and ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
                     allDone = True
                     break
 
                 endTs = doc['ts']
 
-                # NOTE: Python's non-deterministic hash() cannot be used as it is seeded at startup, since this code is multiprocessing we need all hash calls to be the same between processes
-                #   hash(str(doc['o']['_id']))
-                if (((doc['op'] in ['i','d']) and (doc['ns'] == appConfig["sourceNs"]) and ((int(hashlib.sha512(str(doc['o']['_id']).encode('utf-8')).hexdigest(), 16) % appConfig["numProcessingThreads"]) == threadnum)) or
-                    ((doc['op'] in ['u']) and (doc['ns'] == appConfig["sourceNs"]) and ((int(hashlib.sha512(str(doc['o2']['_id']).encode('utf-8')).hexdigest(), 16) % appConfig["numProcessingThreads"]) == threadnum))):
+                # NOTE: Python's non-deterministic hash() cannot be used as it is seeded at startup, partition_for() hashes the BSON encoded _id so all processes agree
+                if ((dispatchQ is not None) or
+                    ((doc['op'] in ['i','d']) and (doc['ns'] == appConfig["sourceNs"]) and (cdc_dispatch.partition_for(doc['o']['_id'], appConfig["numProcessingThreads"]) == threadnum)) or
+                    ((doc['op'] in ['u']) and (doc['ns'] == appConfig["sourceNs"]) and (cdc_dispatch.partition_for(doc['o2']['_id'], appConfig["numProcessingThreads"]) == threadnum))):
                     # this is for my thread
 
                     threadOplogEntries += 1
@@ -92,9 +104,7 @@ def oplog_processor(threadnum, appConfig, perfQ):
                         # insert
                         if (doc['ns'] == appConfig["sourceNs"]):
                             myCollectionOps += 1
-                            bulkOpList.append(pymongo.InsertOne(doc['o']))
-                            # if playing old oplog, need to change inserts to be replaces (the inserts will fail due to _id uniqueness)
-                            bulkOpListReplace.append(pymongo.ReplaceOne({'_id':doc['o']['_id']},doc['o'],upsert=True))
+                            bulkOpList.append(cdc_bulk.InsertOne(doc['o']))
                             numCurrentBulkOps += 1
                         else:
                             pass
@@ -106,8 +116,6 @@ def oplog_processor(threadnum, appConfig, perfQ):
                             # field "$v" is not present in MongoDB 3.4
                             doc['o'].pop('$v',None)
                             bulkOpList.append(pymongo.UpdateOne(doc['o2'],doc['o'],upsert=False))
-                            # if playing old oplog, need to change inserts to be replaces (the inserts will fail due to _id uniqueness)
-                            bulkOpListReplace.append(pymongo.UpdateOne(doc['o2'],doc['o'],upsert=False))
                             numCurrentBulkOps += 1
                         else:
                             pass
@@ -117,8 +125,6 @@ def oplog_processor(threadnum, appConfig, perfQ):
                         if (doc['ns'] == appConfig["sourceNs"]):
                             myCollectionOps += 1
                             bulkOpList.append(pymongo.DeleteOne(doc['o']))
-                            # if playing old oplog, need to change inserts to be replaces (the inserts will fail due to _id uniqueness)
-                            bulkOpListReplace.append(pymongo.DeleteOne(doc['o']))
                             numCurrentBulkOps += 1
                         else:
                             pass
@@ -137,55 +143,54 @@ def oplog_processor(threadnum, appConfig, perfQ):
 
                 if ((numCurrentBulkOps >= appConfig["maxOperationsPerBatch"]) or (time.time() >= (lastBatch + appConfig["maxSecondsBetweenBatches"]))) and (numCurrentBulkOps > 0):
                     if not appConfig['dryRun']:
-                        try:
-                            result = destCollection.bulk_write(bulkOpList,ordered=True)
-                        except:
-                            # replace inserts as replaces
-                            result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
+                        cdc_bulk.bulk_write_with_retry(destCollection,bulkOpList,bulkStats)
+                        if checkpointer is not None:
+                            checkpointer.commit(endTs, None)
                     perfQ.put({"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum})
                     bulkOpList = []
-                    bulkOpListReplace = []
                     numCurrentBulkOps = 0
                     numTotalBatches += 1
                     lastBatch = time.time()
 
+                if (checkpointer is not None) and (numCurrentBulkOps == 0):
+                    # nothing pending, everything read so far has been applied
+                    checkpointer.idle(endTs, None)
+
             if ((numCurrentBulkOps >= appConfig["maxOperationsPerBatch"]) or (time.time() >= (lastBatch + appConfig["maxSecondsBetweenBatches"]))) and (numCurrentBulkOps > 0):
                 if not appConfig['dryRun']:
-                    try:
-                        result = destCollection.bulk_write(bulkOpList,ordered=True)
-                    except:
-                        # replace inserts as replaces
-                        result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
+                    cdc_bulk.bulk_write_with_retry(destCollection,bulkOpList,bulkStats)
+                    if checkpointer is not None:
+                        checkpointer.commit(endTs, None)
                 perfQ.put({"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum})
                 bulkOpList = []
-                bulkOpListReplace = []
                 numCurrentBulkOps = 0
                 numTotalBatches += 1
                 lastBatch = time.time()
 
-            # nothing arrived in the oplog for 1 second, pause before trying again
-            time.sleep(1)
+            if dispatchQ is None:
+                # nothing arrived in the oplog for 1 second, pause before trying again
+                time.sleep(1)
+            elif not cursor.alive:
+                # the single reader has finished
+                allDone = True
 
     if (numCurrentBulkOps > 0):
         if not appConfig['dryRun']:
-            try:
-                result = destCollection.bulk_write(bulkOpList,ordered=True)
-            except:
-                # replace inserts as replaces
-                result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
+            cdc_bulk.bulk_write_with_retry(destCollection,bulkOpList,bulkStats)
+            if checkpointer is not None:
+                checkpointer.commit(endTs, None)
         perfQ.put({"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum})
         bulkOpList = []
-        bulkOpListReplace = []
         numCurrentBulkOps = 0
         numTotalBatches += 1
 
     c.close()
     destConnection.close()
 
-    perfQ.put({"name":"processCompleted","processNum":threadnum})
+    perfQ.put({"name":"processCompleted","processNum":threadnum,"conflicts":bulkStats['conflicts'],"retries":bulkStats['retries']})
 
 
-def change_stream_processor(threadnum, appConfig, perfQ):
+def change_stream_processor(threadnum, appConfig, perfQ, dispatchQ=None):
     warnings.filterwarnings("ignore","You appear to be connected to a DocumentDB cluster.")
 
     #orderedBulkWrite = False
@@ -202,6 +207,11 @@ def change_stream_processor(threadnum, appConfig, perfQ):
     destDatabase = destConnection[appConfig["targetNs"].split('.',1)[0]]
     destCollection = destDatabase[appConfig["targetNs"].split('.',1)[1]]
 
+    # durably record the position of the last applied change so a restart can resume from it
+    checkpointer = None
+    if (appConfig['checkpointDir'] is not None) and (not appConfig['dryRun']):
+        checkpointer = cdc_checkpoint.Checkpointer(appConfig, threadnum)
+
     startTime = time.time()
     lastFeedback = time.time()
     lastBatch = time.time()
@@ -213,8 +223,9 @@ def change_stream_processor(threadnum, appConfig, perfQ):
 
     bulkOpList = []
 
-    # list with replace, not insert, in case document already exists (replaying old oplog)
-    bulkOpListReplace = []
+    # inserts of existing documents retried as upserts
+    bulkStats = cdc_bulk.new_bulk_stats()
+
     numCurrentBulkOps = 0
     numReportBulkOps = 0
 
@@ -225,8 +236,12 @@ def change_stream_processor(threadnum, appConfig, perfQ):
 
     # starting timestamp
     endTs = appConfig["startTs"]
+    resumeToken = None
 
-    if (appConfig["startTs"] == "RESUME_TOKEN"):
+    if dispatchQ is not None:
+        # changes are routed to this thread by the single reader
+        stream = cdc_dispatch.DispatchedCursor(dispatchQ)
+    elif (appConfig["startTs"] == "RESUME_TOKEN"):
         stream = sourceColl.watch(resume_after={'_data': appConfig["startPosition"]}, full_document='updateLookup', pipeline=[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}])
     else:
         stream = sourceColl.watch(start_at_operation_time=endTs, max_await_time_ms=1000, full_document='updateLookup', pipeline=[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}])
@@ -241,9 +256,13 @@ def change_stream_processor(threadnum, appConfig, perfQ):
         #for change in stream:
         change = stream.try_next()
 
+        if (change is None) and (dispatchQ is not None) and (not stream.alive):
+            # the single reader has finished
+            allDone = True
+
         if change is not None:
-            # check if time to exit
-            if ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
+            # check if time to exit, when using a single reader the reader decides
+            if (dispatchQ is None) and ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
                 allDone = True
                 break
 
@@ -252,11 +271,10 @@ def change_stream_processor(threadnum, appConfig, perfQ):
             thisNs = change['ns']['db']+'.'+change['ns']['coll']
             thisOp = change['operationType']
 
-            # NOTE: Python's non-deterministic hash() cannot be used as it is seeded at startup, since this code is multiprocessing we need all hash calls to be the same between processes
-            #   hash(str(doc['o']['_id']))
+            # NOTE: Python's non-deterministic hash() cannot be used as it is seeded at startup, partition_for() hashes the BSON encoded _id so all processes agree
             #if ((thisOp in ['insert','update','replace','delete']) and
             #     (thisNs == appConfig["sourceNs"]) and
-            if ((int(hashlib.sha512(str(change['documentKey']).encode('utf-8')).hexdigest(), 16) % appConfig["numProcessingThreads"]) == threadnum):
+            if (dispatchQ is not None) or (cdc_dispatch.partition_for(change['documentKey']['_id'], appConfig["numProcessingThreads"]) == threadnum):
                 # this is for my thread
 
                 threadOplogEntries += 1
@@ -270,10 +288,7 @@ def change_stream_processor(threadnum, appConfig, perfQ):
                     # insert
                     if (thisNs == appConfig["sourceNs"]):
                         myCollectionOps += 1
-                        bulkOpList.append(pymongo.InsertOne(change['fullDocument']))
-                        # if playing old oplog, need to change inserts to be replaces (the inserts will fail due to _id uniqueness)
-                        #bulkOpListReplace.append(pymongo.ReplaceOne({'_id':change['documentKey']},change['fullDocument'],upsert=True))
-                        bulkOpListReplace.append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
+                        bulkOpList.append(cdc_bulk.InsertOne(change['fullDocument']))
                         numCurrentBulkOps += 1
                     else:
                         pass
@@ -285,9 +300,6 @@ def change_stream_processor(threadnum, appConfig, perfQ):
                             myCollectionOps += 1
                             #bulkOpList.append(pymongo.ReplaceOne({'_id':change['documentKey']},change['fullDocument'],upsert=True))
                             bulkOpList.append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
-                            # if playing old oplog, need to change inserts to be replaces (the inserts will fail due to _id uniqueness)
-                            #bulkOpListReplace.append(pymongo.ReplaceOne({'_id':change['documentKey']},change['fullDocument'],upsert=True))
-                            bulkOpListReplace.append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
                             numCurrentBulkOps += 1
                         else:
                             pass
@@ -297,8 +309,6 @@ def change_stream_processor(threadnum, appConfig, perfQ):
                     if (thisNs == appConfig["sourceNs"]):
                         myCollectionOps += 1
                         bulkOpList.append(pymongo.DeleteOne({'_id':change['documentKey']['_id']}))
-                        # if playing old oplog, need to change inserts to be replaces (the inserts will fail due to _id uniqueness)
-                        bulkOpListReplace.append(pymongo.DeleteOne({'_id':change['documentKey']['_id']}))
                         numCurrentBulkOps += 1
                     else:
                         pass
@@ -307,6 +317,10 @@ def change_stream_processor(threadnum, appConfig, perfQ):
                     # operations we do not track
                     pass
 
+                elif (thisOp == 'watermark'):
+                    # position of the single reader, nothing to apply
+                    pass
+
                 else:
                     print(change)
                     sys.exit(1)
@@ -318,47 +332,34 @@ def change_stream_processor(threadnum, appConfig, perfQ):
 
         if ((numCurrentBulkOps >= appConfig["maxOperationsPerBatch"]) or (time.time() >= (lastBatch + appConfig["maxSecondsBetweenBatches"]))) and (numCurrentBulkOps > 0):
             if not appConfig['dryRun']:
-                try:
-                    #result = destCollection.bulk_write(bulkOpList,ordered=orderedBulkWrite)
-                    with destConnection.start_session() as session:
-                       # Start transaction
-                       with session.start_transaction():
-                           # Execute bulk write within the transaction
-                           result = destCollection.bulk_write(bulkOpList,ordered=orderedBulkWrite,session=session)
-
-                except:
-                    # replace inserts as replaces
-                    #result = destCollection.bulk_write(bulkOpListReplace,ordered=orderedBulkWrite)
-                    with destConnection.start_session() as session:
-                       # Start transaction
-                       with session.start_transaction():
-                           # Execute bulk write within the transaction
-                           result = destCollection.bulk_write(bulkOpListReplace,ordered=orderedBulkWrite,session=session)
+                cdc_bulk.bulk_write_with_retry(destCollection,bulkOpList,bulkStats,ordered=orderedBulkWrite,destConnection=destConnection)
+                if checkpointer is not None:
+                    checkpointer.commit(endTs, resumeToken)
 
             bulkOpList = []
-            bulkOpListReplace = []
             numReportBulkOps += numCurrentBulkOps
             numCurrentBulkOps = 0
             numTotalBatches += 1
             lastBatch = time.time()
 
+        if (checkpointer is not None) and (numCurrentBulkOps == 0) and (resumeToken is not None):
+            # nothing pending, everything read so far has been applied
+            checkpointer.idle(endTs, resumeToken)
+
     if (numCurrentBulkOps > 0):
         if not appConfig['dryRun']:
-            try:
-                result = destCollection.bulk_write(bulkOpList,ordered=orderedBulkWrite)
-            except:
-                # replace inserts as replaces
-                result = destCollection.bulk_write(bulkOpListReplace,ordered=orderedBulkWrite)
+            cdc_bulk.bulk_write_with_retry(destCollection,bulkOpList,bulkStats,ordered=orderedBulkWrite)
+            if checkpointer is not None:
+                checkpointer.commit(endTs, resumeToken)
         perfQ.put({"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum,"resumeToken":resumeToken})
         bulkOpList = []
-        bulkOpListReplace = []
         numCurrentBulkOps = 0
         numTotalBatches += 1
 
     sourceConnection.close()
     destConnection.close()
 
-    perfQ.put({"name":"processCompleted","processNum":threadnum})
+    perfQ.put({"name":"processCompleted","processNum":threadnum,"conflicts":bulkStats['conflicts'],"retries":bulkStats['retries']})
 
 
 def get_resume_token(appConfig):
@@ -406,6 +407,8 @@ def reporter(appConfig, perfQ):
     resumeToken = 'N/A'
 
     numWorkersCompleted = 0
+    numBulkConflicts = 0
+    numBulkRetries = 0
     numProcessedOplogEntries = 0
     
     dtDict = {}
@@ -434,6 +437,8 @@ def reporter(appConfig, perfQ):
 
             elif qMessage['name'] == "processCompleted":
                 numWorkersCompleted += 1
+                numBulkConflicts += qMessage['conflicts']
+                numBulkRetries += qMessage['retries']
 
         # total total
         elapsedSeconds = nowTime - startTime
@@ -479,6 +484,8 @@ def reporter(appConfig, perfQ):
 
             lastCloudwatchPutTime = time.time()
 
+    logIt(-1,"bulk write retries = {:,d} | conflicting inserts retried as upserts = {:,d}".format(numBulkRetries,numBulkConflicts))
+
 
 def main():
     warnings.filterwarnings("ignore","You appear to be connected to a DocumentDB cluster.")
@@ -546,9 +553,14 @@ def main():
                         help='Read source changes only, do not apply to target')
 
     parser.add_argument('--start-position',
-                        required=True,
+                        required=False,
+                        type=str,
+                        help='Starting position - 0 for all available changes, YYYY-MM-DD+HH:MM:SS in UTC, or change stream resume token, defaults to the checkpoint in --checkpoint-dir')
+
+    parser.add_argument('--checkpoint-dir',
+                        required=False,
                         type=str,
-                        help='Starting position - 0 for all available changes, YYYY-MM-DD+HH:MM:SS in UTC, or change stream resume token')
+                        help='Directory to record the last applied position of each thread, restart without --start-position to resume from it')
 
     parser.add_argument('--verbose',
                         required=False,
@@ -570,6 +582,11 @@ def main():
                         action='store_true',
                         help='Display the current change stream resume token')
 
+    parser.add_argument('--single-reader',
+                        required=False,
+                        action='store_true',
+                        help='Read the oplog or change stream once and route changes to the processing threads')
+
     parser.add_argument('--create-cloudwatch-metrics',required=False,action='store_true',help='Create CloudWatch metrics when garbage collection is active')
     parser.add_argument('--cluster-name',required=False,type=str,help='Name of cluster for CloudWatch metrics')
 
@@ -591,6 +608,10 @@ def main():
         message = "--start-position must be supplied as YYYY-MM-DD+HH:MM:SS in UTC or resume token when executing in --use-change-stream mode"
         parser.error(message)
 
+    if (args.start_position is None) and (args.checkpoint_dir is None) and (not args.get_resume_token):
+        message = "Must supply --start-position unless resuming from --checkpoint-dir"
+        parser.error(message)
+
     if args.create_cloudwatch_metrics and (args.cluster_name is None):
         sys.exit("\nMust supply --cluster-name when capturing CloudWatch metrics.\n")
 
@@ -612,6 +633,8 @@ def main():
     appConfig['verboseLogging'] = args.verbose
     appConfig['createCloudwatchMetrics'] = args.create_cloudwatch_metrics
     appConfig['clusterName'] = args.cluster_name
+    appConfig['singleReader'] = args.single_reader
+    appConfig['checkpointDir'] = args.checkpoint_dir
 
     if args.get_resume_token:
         get_resume_token(appConfig)
@@ -624,7 +647,21 @@ def main():
 
     logIt(-1,"processing {} using {} threads".format(appConfig['cdcSource'],appConfig['numProcessingThreads']))
 
-    if len(appConfig["startPosition"]) == 36:
+    if appConfig["startPosition"] is None:
+        # resume from the earliest position all threads have applied
+        checkpoint = cdc_checkpoint.load_checkpoint(appConfig)
+        if checkpoint is None:
+            sys.exit("\nNo checkpoints found in {}, must supply --start-position.\n".format(appConfig['checkpointDir']))
+
+        if checkpoint['ts'] is None:
+            appConfig["startTs"] = "RESUME_TOKEN"
+            appConfig["startPosition"] = checkpoint['resumeToken']
+            logIt(-1,"resuming from checkpoint with resume token = {}".format(appConfig["startPosition"]))
+        else:
+            appConfig["startTs"] = checkpoint['ts']
+            logIt(-1,"resuming from checkpoint with timestamp = {}".format(appConfig["startTs"].as_datetime()))
+
+    elif len(appConfig["startPosition"]) == 36:
         # resume token
         appConfig["startTs"] = "RESUME_TOKEN"
 
@@ -647,6 +684,9 @@ def main():
 
         logIt(-1,"starting with timestamp = {}".format(appConfig["startTs"].as_datetime()))
 
+    if (appConfig['checkpointDir'] is not None) and (not appConfig['dryRun']):
+        cdc_checkpoint.initialize_checkpoints(appConfig)
+
     mp.set_start_method('spawn')
     q = mp.Manager().Queue()
 
@@ -654,11 +694,22 @@ def main():
     t.start()
     
     processList = []
+
+    dispatchQueues = [None] * appConfig["numProcessingThreads"]
+    if appConfig['singleReader']:
+        # one process reads the source and routes each change to a processing thread by _id
+        dispatchQueues = [mp.Queue(maxsize=cdc_dispatch.dispatchQueueDepth) for loop in range(appConfig["numProcessingThreads"])]
+        if (appConfig['cdcSource'] == 'oplog'):
+            p = mp.Process(target=cdc_dispatch.oplog_reader,args=(appConfig,dispatchQueues))
+        else:
+            p = mp.Process(target=cdc_dispatch.change_stream_reader,args=(appConfig,dispatchQueues))
+        processList.append(p)
+
     for loop in range(appConfig["numProcessingThreads"]):
         if (appConfig['cdcSource'] == 'oplog'):
-            p = mp.Process(target=oplog_processor,args=(loop,appConfig,q))
+            p = mp.Process(target=oplog_processor,args=(loop,appConfig,q,dispatchQueues[loop]))
         else:
-            p = mp.Process(target=change_stream_processor,args=(loop,appConfig,q))
+            p = mp.Process(target=change_stream_processor,args=(loop,appConfig,q,dispatchQueues[loop]))
         processList.append(p)
         
     for process in processList:
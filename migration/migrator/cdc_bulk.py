@@ -0,0 +1,97 @@
+import pymongo
+from pymongo.errors import BulkWriteError
+
+
+# server error code for a duplicate key
+duplicateKeyErrorCode = 11000
+
+
+def new_bulk_stats():
+    # conflicts = inserts retried as upserts, retries = bulk_write calls repeated after a failure
+    return {'conflicts':0, 'retries':0}
+
+
+class InsertOne(pymongo.InsertOne):
+    # keeps the inserted document so the insert can be retried as an upsert
+    __slots__ = ('document',)
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.document = document
+
+
+def run_bulk_write(destCollection, bulkOpList, ordered, destConnection):
+    if destConnection is None:
+        destCollection.bulk_write(bulkOpList,ordered=ordered)
+    else:
+        with destConnection.start_session() as session:
+            # Start transaction
+            with session.start_transaction():
+                # Execute bulk write within the transaction
+                destCollection.bulk_write(bulkOpList,ordered=ordered,session=session)
+
+
+def bulk_write_with_retry(destCollection, bulkOpList, bulkStats, ordered=True, destConnection=None):
+    # an insert of an _id that already exists (replaying old changes) fails and is retried as an upsert
+    #   unordered - every other operation has been applied so retry only the failing inserts
+    #   ordered - the batch stops at the first error and everything before it has been applied, the inserts after it
+    #     are likely to conflict as well so the rest of the batch is retried once with every insert as an upsert
+    #   transaction (destConnection supplied) - nothing has been applied so retry the full batch with every insert as an upsert
+    # any other error falls back to retrying once with every insert as an upsert
+    startIndex = 0
+    fallbackUsed = False
+
+    while True:
+        try:
+            run_bulk_write(destCollection, bulkOpList[startIndex:], ordered, destConnection)
+            return
+
+        except BulkWriteError as bwe:
+            writeErrors = bwe.details.get('writeErrors',[])
+            conflictErrors = []
+            for thisError in writeErrors:
+                if (thisError['code'] == duplicateKeyErrorCode) and isinstance(bulkOpList[startIndex + thisError['index']], InsertOne):
+                    conflictErrors.append(thisError)
+            onlyConflicts = (len(writeErrors) > 0) and (len(conflictErrors) == len(writeErrors))
+
+            if onlyConflicts and (not ordered) and (destConnection is None):
+                bulkOpList = [upsert_op(bulkOpList[startIndex + thisError['index']]) for thisError in conflictErrors]
+                startIndex = 0
+                bulkStats['conflicts'] += len(conflictErrors)
+
+            else:
+                if fallbackUsed:
+                    raise
+                if ordered and (destConnection is None) and (len(writeErrors) > 0):
+                    startIndex += writeErrors[0]['index']
+                bulkOpList, numReplaced = replace_inserts(bulkOpList, startIndex)
+                fallbackUsed = True
+                if onlyConflicts:
+                    bulkStats['conflicts'] += numReplaced
+
+        except Exception:
+            # unknown how much of the batch was applied, retry all of it once with inserts as upserts
+            if fallbackUsed:
+                raise
+            bulkOpList, numReplaced = replace_inserts(bulkOpList, startIndex)
+            fallbackUsed = True
+
+        bulkStats['retries'] += 1
+
+
+def upsert_op(insertOp):
+    # upserts succeed when the document already exists
+    return pymongo.ReplaceOne({'_id':insertOp.document['_id']},insertOp.document,upsert=True)
+
+
+def replace_inserts(bulkOpList, startIndex):
+    # only built on failure, returns the new list and the number of inserts replaced
+    replaceOpList = bulkOpList[:startIndex]
+    numReplaced = 0
+    for thisOp in bulkOpList[startIndex:]:
+        if isinstance(thisOp, InsertOne):
+            replaceOpList.append(upsert_op(thisOp))
+            numReplaced += 1
+        else:
+            replaceOpList.append(thisOp)
+    return replaceOpList, numReplaced
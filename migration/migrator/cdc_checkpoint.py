@@ -0,0 +1,95 @@
+import glob
+import json
+import os
+import time
+from bson.timestamp import Timestamp
+
+
+# minimum number of seconds between checkpoints of an idle processing thread
+checkpointIdleSeconds = 5
+
+
+def checkpoint_file_name(appConfig, threadnum):
+    return os.path.join(appConfig['checkpointDir'], "cdc-{}-thread-{}.checkpoint".format(appConfig['sourceNs'],threadnum))
+
+
+def checkpoint_file_pattern(appConfig):
+    return os.path.join(glob.escape(appConfig['checkpointDir']), "cdc-{}-thread-*.checkpoint".format(glob.escape(appConfig['sourceNs'])))
+
+
+def save_checkpoint(fileName, endTs, resumeToken):
+    # write to a temporary file and rename so a crash never leaves a partial checkpoint
+    checkpoint = {'ts':None, 'resumeToken':resumeToken}
+    if isinstance(endTs, Timestamp):
+        checkpoint['ts'] = {'t':endTs.time, 'i':endTs.inc}
+
+    with open(fileName + ".tmp", 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(fileName + ".tmp", fileName)
+
+
+def load_checkpoint(appConfig):
+    # the earliest checkpoint across all processing threads, everything before it has been applied by every thread
+    minCheckpoint = None
+    minKey = None
+
+    for fileName in glob.glob(checkpoint_file_pattern(appConfig)):
+        with open(fileName, 'r') as f:
+            checkpoint = json.load(f)
+
+        # a checkpoint without a timestamp was written before the first change was applied
+        if checkpoint['ts'] is None:
+            thisKey = (0, 0, 0)
+        else:
+            thisKey = (1, checkpoint['ts']['t'], checkpoint['ts']['i'])
+
+        if (minKey is None) or (thisKey < minKey):
+            minKey = thisKey
+            minCheckpoint = checkpoint
+
+    if (minCheckpoint is not None) and (minCheckpoint['ts'] is not None):
+        minCheckpoint['ts'] = Timestamp(minCheckpoint['ts']['t'], minCheckpoint['ts']['i'])
+
+    return minCheckpoint
+
+
+def initialize_checkpoints(appConfig):
+    # every processing thread starts at the starting position, checkpoints from a run with more threads are removed
+    if appConfig['startTs'] == "RESUME_TOKEN":
+        endTs = None
+        resumeToken = appConfig['startPosition']
+    else:
+        endTs = appConfig['startTs']
+        resumeToken = None
+
+    os.makedirs(appConfig['checkpointDir'], exist_ok=True)
+
+    threadFileNames = []
+    for threadnum in range(appConfig['numProcessingThreads']):
+        threadFileNames.append(checkpoint_file_name(appConfig, threadnum))
+        save_checkpoint(threadFileNames[-1], endTs, resumeToken)
+
+    for fileName in glob.glob(checkpoint_file_pattern(appConfig)):
+        if fileName not in threadFileNames:
+            os.remove(fileName)
+
+
+class Checkpointer:
+    # records the position of the last change applied by a processing thread
+    def __init__(self, appConfig, threadnum):
+        self.fileName = checkpoint_file_name(appConfig, threadnum)
+        self.lastTs = None
+        self.lastSaveTime = time.time()
+
+    def commit(self, endTs, resumeToken):
+        # call after a successful bulk_write, everything read up to endTs has been applied
+        save_checkpoint(self.fileName, endTs, resumeToken)
+        self.lastTs = endTs
+        self.lastSaveTime = time.time()
+
+    def idle(self, endTs, resumeToken):
+        # call when nothing is pending so threads without recent writes still move forward
+        if (endTs != self.lastTs) and (time.time() >= (self.lastSaveTime + checkpointIdleSeconds)):
+            self.commit(endTs, resumeToken)
@@ -0,0 +1,212 @@
+from datetime import datetime
+from collections import deque
+import zlib
+import queue
+import time
+import pymongo
+import bson
+from bson.objectid import ObjectId
+import warnings
+
+
+# number of changes sent to a processing thread in a single queue message
+dispatchBatchSize = 100
+
+# number of queue messages a processing thread can fall behind before the reader waits
+dispatchQueueDepth = 100
+
+# maximum number of seconds a change waits in the reader before being sent
+dispatchMaxSeconds = 1
+
+
+def logIt(threadnum, message):
+    logTimeStamp = datetime.utcnow().isoformat()[:-3] + 'Z'
+    print("[{}] thread {:>3d} | {}".format(logTimeStamp,threadnum,message))
+
+
+def partition_for(documentId, numPartitions):
+    # NOTE: Python's non-deterministic hash() cannot be used as it is seeded at startup, since this code is multiprocessing we need all hash calls to be the same between processes
+    #   crc32 of the BSON bytes of the _id is stable across processes, hosts, and Python versions and much cheaper than a cryptographic hash
+    #   the common _id types use their BSON value bytes directly, encoding a document is only needed for the others
+    idType = type(documentId)
+    if idType is ObjectId:
+        idBytes = documentId.binary
+    elif idType is str:
+        idBytes = documentId.encode('utf-8')
+    elif idType is int:
+        idBytes = documentId.to_bytes(8, 'little', signed=True)
+    else:
+        idBytes = bson.encode({'_id':documentId})
+    return zlib.crc32(idBytes) % numPartitions
+
+
+def oplog_watermark(doc):
+    # a no-op entry at the position of the reader, processors skip it but move their position forward
+    return {'ts':doc['ts'], 'op':'n', 'ns':doc['ns'], 'o':{'msg':'watermark'}}
+
+
+def change_stream_watermark(change):
+    # position of the reader, processors apply nothing for it but move their position forward
+    return {'_id':change['_id'], 'clusterTime':change['clusterTime'], 'ns':change['ns'], 'operationType':'watermark'}
+
+
+class Dispatcher:
+    # buffers changes per processing thread, all changes for an _id go to the same thread in the order they were read
+    def __init__(self, dispatchQueues, watermarkFunction=None):
+        self.dispatchQueues = dispatchQueues
+        self.numPartitions = len(dispatchQueues)
+        self.buffers = [[] for loop in range(self.numPartitions)]
+        self.lastFlush = time.time()
+        self.watermarkFunction = watermarkFunction
+        self.lastChange = None
+        self.lastWatermarkChange = None
+
+    def route(self, documentId, change):
+        thisPartition = partition_for(documentId, self.numPartitions)
+        self.buffers[thisPartition].append(change)
+        self.lastChange = change
+        if len(self.buffers[thisPartition]) >= dispatchBatchSize:
+            self.dispatchQueues[thisPartition].put(self.buffers[thisPartition])
+            self.buffers[thisPartition] = []
+        if time.time() >= (self.lastFlush + dispatchMaxSeconds):
+            self.flush()
+
+    def flush(self):
+        # every thread is sent the position of the reader, everything before it has already been routed
+        #   so a thread that receives few changes can still checkpoint past the changes of other threads
+        if (self.watermarkFunction is not None) and (self.lastChange is not self.lastWatermarkChange):
+            thisWatermark = self.watermarkFunction(self.lastChange)
+            for thisPartition in range(self.numPartitions):
+                self.buffers[thisPartition].append(thisWatermark)
+            self.lastWatermarkChange = self.lastChange
+
+        for thisPartition in range(self.numPartitions):
+            if len(self.buffers[thisPartition]) > 0:
+                self.dispatchQueues[thisPartition].put(self.buffers[thisPartition])
+                self.buffers[thisPartition] = []
+        self.lastFlush = time.time()
+
+    def close(self):
+        # None tells the processing threads there are no more changes
+        self.flush()
+        for thisQueue in self.dispatchQueues:
+            thisQueue.put(None)
+
+
+class DispatchedCursor:
+    # reads the changes routed to a processing thread, supports the parts of the cursor and change stream interfaces used by the processors
+    def __init__(self, dispatchQ, idleSeconds=1):
+        self.dispatchQ = dispatchQ
+        self.idleSeconds = idleSeconds
+        self.pending = deque()
+        self.alive = True
+
+    def __iter__(self):
+        # stops when nothing has arrived for idleSeconds, like a tailable cursor
+        while True:
+            change = self.try_next()
+            if change is None:
+                return
+            yield change
+
+    def try_next(self):
+        if len(self.pending) == 0:
+            if not self.alive:
+                return None
+            try:
+                thisBatch = self.dispatchQ.get(timeout=self.idleSeconds)
+            except queue.Empty:
+                return None
+            if thisBatch is None:
+                self.alive = False
+                return None
+            self.pending.extend(thisBatch)
+        return self.pending.popleft()
+
+    def close(self):
+        pass
+
+
+def oplog_reader(appConfig, dispatchQueues):
+    warnings.filterwarnings("ignore","You appear to be connected to a DocumentDB cluster.")
+
+    if appConfig['verboseLogging']:
+        logIt(-1,'oplog reader started')
+
+    c = pymongo.MongoClient(host=appConfig["sourceUri"],appname='migrcdc')
+    oplog = c.local.oplog.rs
+
+    dispatcher = Dispatcher(dispatchQueues, oplog_watermark)
+
+    startTime = time.time()
+    allDone = False
+
+    # starting timestamp
+    endTs = appConfig["startTs"]
+
+    while not allDone:
+        if appConfig['verboseLogging']:
+            logIt(-1,"Creating oplog tailing cursor for timestamp {}".format(endTs.as_datetime()))
+
+        cursor = oplog.find({'ts': {'$gte': endTs},'ns':appConfig["sourceNs"],'op':{'$in':['i','u','d']}},cursor_type=pymongo.CursorType.TAILABLE_AWAIT,oplog_replay=True)
+
+        while cursor.alive and not allDone:
+            for doc in cursor:
+                # check if time to exit
+                if ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
+                    allDone = True
+                    break
+
+                endTs = doc['ts']
+
+                if (doc['op'] == 'u'):
+                    dispatcher.route(doc['o2']['_id'], doc)
+                else:
+                    dispatcher.route(doc['o']['_id'], doc)
+
+            # nothing arrived in the oplog for 1 second, send what we have and pause before trying again
+            dispatcher.flush()
+            if not allDone:
+                time.sleep(1)
+
+    dispatcher.close()
+    c.close()
+
+
+def change_stream_reader(appConfig, dispatchQueues):
+    warnings.filterwarnings("ignore","You appear to be connected to a DocumentDB cluster.")
+
+    if appConfig['verboseLogging']:
+        logIt(-1,'change stream reader started')
+
+    sourceConnection = pymongo.MongoClient(host=appConfig["sourceUri"],appname='migrcdc')
+    sourceDb = sourceConnection[appConfig["sourceNs"].split('.',1)[0]]
+    sourceColl = sourceDb[appConfig["sourceNs"].split('.',1)[1]]
+
+    dispatcher = Dispatcher(dispatchQueues, change_stream_watermark)
+
+    startTime = time.time()
+    allDone = False
+
+    if (appConfig["startTs"] == "RESUME_TOKEN"):
+        stream = sourceColl.watch(resume_after={'_data': appConfig["startPosition"]}, max_await_time_ms=1000, full_document='updateLookup', pipeline=[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}])
+    else:
+        stream = sourceColl.watch(start_at_operation_time=appConfig["startTs"], max_await_time_ms=1000, full_document='updateLookup', pipeline=[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}])
+
+    while not allDone:
+        # check if time to exit
+        if ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
+            allDone = True
+            break
+
+        change = stream.try_next()
+
+        if change is None:
+            # nothing arrived for 1 second, send what we have
+            dispatcher.flush()
+        else:
+            dispatcher.route(change['documentKey']['_id'], change)
+
+    stream.close()
+    dispatcher.close()
+    sourceConnection.close()
@@ -0,0 +1,42 @@
+import os
+import sys
+import time
+import hashlib
+import uuid
+from bson.objectid import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import cdc_dispatch
+
+
+numIds = 1000000
+numPartitions = 32
+
+
+def sha512_partition(documentId, numPartitions):
+    # previous technique, kept for comparison
+    return int(hashlib.sha512(str(documentId).encode('utf-8')).hexdigest(), 16) % numPartitions
+
+
+def benchmark(name, partitionFunction, idList):
+    counts = [0] * numPartitions
+    startTime = time.time()
+    for thisId in idList:
+        counts[partitionFunction(thisId, numPartitions)] += 1
+    elapsedSeconds = time.time() - startTime
+    print("  {:<12} {:8.3f} seconds | {:12,.0f} ids/second | smallest partition {:,} | largest partition {:,}".format(name,elapsedSeconds,len(idList)/elapsedSeconds,min(counts),max(counts)))
+
+
+def main():
+    idTypes = {'objectid':[ObjectId() for loop in range(numIds)],
+               'int':list(range(numIds)),
+               'string':[str(uuid.uuid4()) for loop in range(numIds)]}
+
+    for thisType in idTypes:
+        print("{:,} {} _id values into {} partitions".format(numIds,thisType,numPartitions))
+        benchmark('sha512', sha512_partition, idTypes[thisType])
+        benchmark('crc32-bson', cdc_dispatch.partition_for, idTypes[thisType])
+
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,13 @@ import pymongo
 from bson.timestamp import Timestamp
 import threading
 import multiprocessing as mp
-import hashlib
+import zlib
+import queue
 import argparse
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+import bson
+from bson.objectid import ObjectId
 
 
 #Logger function
@@ -16,20 +20,184 @@ def logIt(threadnum, message):
     logTimeStamp = datetime.utcnow().isoformat()[:-3] + 'Z'
     print("[{}] thread {:>3d} | {}".format(logTimeStamp,threadnum,message))
 
-#Function to process the change stream
+# number of changes sent to a processing thread in a single queue message
+dispatchBatchSize = 100
 
-def change_stream_processor(threadnum, appConfig, perfQ):
+# number of queue messages a processing thread can fall behind before the reader waits
+dispatchQueueDepth = 100
+
+# maximum number of seconds a change waits in the reader before being sent
+dispatchMaxSeconds = 1
+
+
+def partition_for(thisNs, documentId, numPartitions):
+    # NOTE: Python's non-deterministic hash() cannot be used as it is seeded at startup, since this code is multiprocessing we need all hash calls to be the same between processes
+    #   crc32 of the namespace and the BSON bytes of the _id is stable across processes and much cheaper than a cryptographic hash
+    idType = type(documentId)
+    if idType is ObjectId:
+        idBytes = documentId.binary
+    elif idType is str:
+        idBytes = documentId.encode('utf-8')
+    elif idType is int:
+        idBytes = documentId.to_bytes(8, 'little', signed=True)
+    else:
+        idBytes = bson.encode({'_id':documentId})
+    return zlib.crc32(idBytes, zlib.crc32(thisNs.encode('utf-8'))) % numPartitions
+
+
+def watermark(change):
+    # marks the reader position for a processing thread with nothing to apply, so its resume token keeps advancing
+    return {'_id':change['_id'],'clusterTime':change['clusterTime'],'ns':change['ns'],'operationType':'watermark'}
+
+
+class Dispatcher:
+    # buffers changes per processing thread, all changes for a document go to the same thread in the order they were read
+    def __init__(self, dispatchQueues):
+        self.dispatchQueues = dispatchQueues
+        self.numPartitions = len(dispatchQueues)
+        self.buffers = [[] for loop in range(self.numPartitions)]
+        self.lastFlush = time.time()
+        self.lastChange = None
+        self.lastWatermarkChange = None
+
+    def route(self, change):
+        self.lastChange = change
+        thisNs = change['ns']['db']+'.'+change['ns']['coll']
+        thisPartition = partition_for(thisNs, change['documentKey']['_id'], self.numPartitions)
+        self.buffers[thisPartition].append(change)
+        if len(self.buffers[thisPartition]) >= dispatchBatchSize:
+            self.dispatchQueues[thisPartition].put(self.buffers[thisPartition])
+            self.buffers[thisPartition] = []
+        if time.time() >= (self.lastFlush + dispatchMaxSeconds):
+            self.flush()
+
+    def flush(self):
+        # every change read so far has been queued once the buffers are sent, threads without changes are sent the reader position
+        sendWatermark = (self.lastChange is not None) and (self.lastChange is not self.lastWatermarkChange)
+        for thisPartition in range(self.numPartitions):
+            if sendWatermark:
+                self.buffers[thisPartition].append(watermark(self.lastChange))
+            if len(self.buffers[thisPartition]) > 0:
+                self.dispatchQueues[thisPartition].put(self.buffers[thisPartition])
+                self.buffers[thisPartition] = []
+        if sendWatermark:
+            self.lastWatermarkChange = self.lastChange
+        self.lastFlush = time.time()
+
+    def close(self):
+        # None tells the processing threads there are no more changes
+        self.flush()
+        for thisQueue in self.dispatchQueues:
+            thisQueue.put(None)
+
+
+#Function to read the change stream once and route each change to a processing thread
+def change_stream_reader(appConfig, dispatchQueues):
     if appConfig['verboseLogging']:
-        logIt(threadnum,'thread started')
+        logIt(-1,'change stream reader started')
 
     sourceConnection = pymongo.MongoClient(host=appConfig["sourceUri"],appname='mvutool')
-    destConnection = pymongo.MongoClient(host=appConfig["targetUri"],appname='mvutool')
+    dispatcher = Dispatcher(dispatchQueues)
     startTime = time.time()
-    lastFeedback = time.time()
+
+    if appConfig['updateDeltas']:
+        # updates are applied from updateDescription, no need to look up the full document
+        watchOptions = {'pipeline':[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}}]}
+    else:
+        watchOptions = {'full_document':'updateLookup', 'pipeline':[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}]}
+
+    if not appConfig["sourceDb"]:
+        stream = sourceConnection.watch(resume_after={'_data': appConfig["startPosition"]}, max_await_time_ms=1000, **watchOptions)
+    else:
+        sourceDatabase=sourceConnection[appConfig["sourceDb"]]
+        stream = sourceDatabase.watch(resume_after={'_data': appConfig["startPosition"]}, max_await_time_ms=1000, **watchOptions)
+
+    if appConfig['verboseLogging']:
+        logIt(-1,"Creating change stream cursor for resume token {}".format(appConfig["startPosition"]))
+
+    while stream.alive:
+        if ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
+            break
+
+        change = stream.try_next()
+
+        if change is None:
+            # nothing arrived for 1 second, send what we have
+            dispatcher.flush()
+        else:
+            dispatcher.route(change)
+
+    stream.close()
+    dispatcher.close()
+    sourceConnection.close()
+
+
+def update_delta(updateDescription):
+    # list of update documents applying the change in order
+    #   truncated arrays are shortened first with an empty $push and $slice, in an update of their own since
+    #   the updated fields can include elements of the same array (arr and arr.1) which conflict in a single update
+    #   then $set the changed fields and $unset the removed ones
+    updateDocList = []
+    if updateDescription.get('truncatedArrays'):
+        updateDocList.append({'$push': {thisArray['field']: {'$each': [], '$slice': thisArray['newSize']} for thisArray in updateDescription['truncatedArrays']}})
+    updateDoc = {}
+    if updateDescription.get('updatedFields'):
+        updateDoc['$set'] = updateDescription['updatedFields']
+    if updateDescription.get('removedFields'):
+        updateDoc['$unset'] = {thisField: 1 for thisField in updateDescription['removedFields']}
+    if len(updateDoc) > 0:
+        updateDocList.append(updateDoc)
+    return updateDocList
+
+
+def get_collection(destConnection, destCollections, ns):
+    # collection handles are cached, batches usually touch the same namespaces
+    if ns not in destCollections:
+        destDatabase=destConnection[(ns.split('.',1)[0])]
+        destCollections[ns]=destDatabase[(ns.split('.',1)[1])]
+    return destCollections[ns]
+
+
+def apply_namespace(destCollection, bulkOpList, bulkOpListReplace):
+    try:
+        result = destCollection.bulk_write(bulkOpList,ordered=True)
+    except:
+        # replace inserts as replaces
+        result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
+
+
+def apply_batch(executor, destConnection, destCollections, nsBulkOpDict, nsBulkOpDictReplace):
+    # namespaces are written concurrently, each by a single ordered bulk_write so the order of changes to a document is preserved
+    futureList = []
+    for ns in nsBulkOpDict:
+        destCollection = get_collection(destConnection, destCollections, ns)
+        futureList.append(executor.submit(apply_namespace, destCollection, nsBulkOpDict[ns], nsBulkOpDictReplace[ns]))
+    return futureList
+
+
+def wait_for_batch(futureList, batchMessage, perfQ):
+    # raises if any namespace failed, the batch is only reported once every namespace has been written
+    for thisFuture in futureList:
+        thisFuture.result()
+    if batchMessage is not None:
+        perfQ.put(batchMessage)
+
+
+#Function to process the changes routed to this thread
+
+def change_stream_processor(threadnum, appConfig, perfQ, dispatchQ):
+    if appConfig['verboseLogging']:
+        logIt(threadnum,'thread started')
+
+    destConnection = pymongo.MongoClient(host=appConfig["targetUri"],appname='mvutool')
+    destCollections = {}
+    executor = ThreadPoolExecutor(max_workers=appConfig['numFlushThreads'])
+    # the previous batch is written while the next one is collected
+    pendingFutures = []
+    pendingMessage = None
     lastBatch = time.time()
     allDone = False
     threadOplogEntries = 0
-    waitcount=0
     nsBulkOpDict = defaultdict(list)
     nsBulkOpDictReplace= defaultdict(list)
     # list with replace, not insert, in case document already exists (replaying old oplog)
@@ -37,151 +205,109 @@ def change_stream_processor(threadnum, appConfig, perfQ):
     numTotalBatches = 0
     printedFirstTs = False
     myClusterOps = 0
+    resumeToken = 'N/A'
+    lastReportedResumeToken = resumeToken
+    pendingChanges = deque()
 
     # starting timestamp
     endTs = appConfig["startTs"]
 
-    if (appConfig["startTs"] == "RESUME_TOKEN") and not appConfig["sourceDb"] :
-        stream = sourceConnection.watch(resume_after={'_data': appConfig["startPosition"]}, full_document='updateLookup', pipeline=[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}])
-        
-    else:
-        sourceDatabase=sourceConnection[appConfig["sourceDb"]]
-        stream = sourceDatabase.watch(resume_after={'_data': appConfig["startPosition"]}, full_document='updateLookup', pipeline=[{'$match': {'operationType': {'$in': ['insert','update','replace','delete']}}},{'$project':{'updateDescription':0}}])
-    
-
-    if appConfig['verboseLogging']:
-        if (appConfig["startTs"] == "RESUME_TOKEN"):
-            logIt(threadnum,"Creating change stream cursor for resume token {}".format(appConfig["startPosition"]))
-    
-    while  not allDone:
-        while stream.alive:
-            change = stream.try_next()
-            if ((time.time() - startTime) > appConfig['durationSeconds']) and (appConfig['durationSeconds'] != 0):
+    while not allDone:
+        if len(pendingChanges) == 0:
+            try:
+                changeList = dispatchQ.get(timeout=1)
+            except queue.Empty:
+                changeList = []
+
+            if changeList is None:
+                # the reader has finished
                 allDone = True
-                break
-            
-            # FIXED: Separate the timeout logic from change processing
-            if change is None:
-                waitcount += 1
-                if waitcount <= appConfig["maxSecondsBetweenBatches"]:
-                    time.sleep(1)
-                    continue
-                else:
-                    # Timeout reached - process any pending batch and reset
-                    waitcount = 0
-                    if numCurrentBulkOps > 0:
-                        # Force batch processing due to timeout
-                        if appConfig['verboseLogging']:
-                            logIt(threadnum, f'Timeout reached, processing batch of {numCurrentBulkOps} operations')
-                        
-                        bulkOpList=[]
-                        bulkOpListReplace=[]
-                        if not appConfig['dryRun']:
-                            for ns in nsBulkOpDict:
-                                destDatabase=destConnection[(ns.split('.',1)[0])]
-                                destCollection=destDatabase[(ns.split('.',1)[1])]
-                                bulkOpList=nsBulkOpDict[ns]
-                                try:
-                                    result = destCollection.bulk_write(bulkOpList,ordered=True)
-                                except:
-                                    # replace inserts as replaces
-                                    bulkOpListReplace=nsBulkOpDictReplace[ns]
-                                    result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
-                        perfQ.put({"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum,"resumeToken":"N/A"})
-                        nsBulkOpDict = defaultdict(list)
-                        nsBulkOpDictReplace= defaultdict(list)
-                        numCurrentBulkOps = 0
-                        numTotalBatches += 1
-                        lastBatch = time.time()
-                    continue
-            
-            # Reset wait count when we get a real change
-            waitcount = 0
-            
-            # Process the actual change
+            else:
+                pendingChanges.extend(changeList)
+
+        while (len(pendingChanges) > 0) and (numCurrentBulkOps < appConfig["maxOperationsPerBatch"]):
+            change = pendingChanges.popleft()
             endTs = change['clusterTime']
             resumeToken = change['_id']['_data']
             thisDb = change['ns']['db']
             thisCol=change['ns']['coll']
             thisNs=thisDb+'.'+thisCol
             thisOp = change['operationType']
-            
-            if ((int(hashlib.sha512(str(change['documentKey']).encode('utf-8')).hexdigest(), 16) % appConfig["numProcessingThreads"]) == threadnum):
-                threadOplogEntries += 1
-                if (not printedFirstTs) and (thisOp in ['insert','update','replace','delete']):
-                    if appConfig['verboseLogging']:
-                        logIt(threadnum,'first timestamp = {} aka {}'.format(change['clusterTime'],change['clusterTime'].as_datetime()))
-                    printedFirstTs = True
-
-                if (thisOp == 'insert'):
+
+            threadOplogEntries += 1
+            if (not printedFirstTs) and (thisOp in ['insert','update','replace','delete']):
+                if appConfig['verboseLogging']:
+                    logIt(threadnum,'first timestamp = {} aka {}'.format(change['clusterTime'],change['clusterTime'].as_datetime()))
+                printedFirstTs = True
+
+            if (thisOp == 'insert'):
+                myClusterOps += 1
+                nsBulkOpDict[thisNs].append(pymongo.InsertOne(change['fullDocument']))
+                nsBulkOpDictReplace[thisNs].append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
+                numCurrentBulkOps += 1
+            elif (thisOp == 'update') and appConfig['updateDeltas']:
+                # only the changed fields, a document that no longer exists on the target is not recreated
+                updateDocList = update_delta(change['updateDescription'])
+                if len(updateDocList) > 0:
                     myClusterOps += 1
-                    nsBulkOpDict[thisNs].append(pymongo.InsertOne(change['fullDocument']))
-                    nsBulkOpDictReplace[thisNs].append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
+                for updateDoc in updateDocList:
+                    nsBulkOpDict[thisNs].append(pymongo.UpdateOne(change['documentKey'],updateDoc))
+                    nsBulkOpDictReplace[thisNs].append(pymongo.UpdateOne(change['documentKey'],updateDoc))
                     numCurrentBulkOps += 1
-                elif (thisOp in ['update','replace']):
-                    # update/replace
-                    if (change['fullDocument'] is not None):
-                        myClusterOps += 1
-                        nsBulkOpDict[thisNs].append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
-                        nsBulkOpDictReplace[thisNs].append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
-                        numCurrentBulkOps += 1
-                    else:
-                        pass
-                elif (thisOp == 'delete'):
+            elif (thisOp in ['update','replace']):
+                # update/replace
+                if (change['fullDocument'] is not None):
                     myClusterOps += 1
-                    nsBulkOpDict[thisNs].append(pymongo.DeleteOne({'_id':change['documentKey']['_id']}))
-                    nsBulkOpDictReplace[thisNs].append(pymongo.DeleteOne({'_id':change['documentKey']['_id']}))
+                    nsBulkOpDict[thisNs].append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
+                    nsBulkOpDictReplace[thisNs].append(pymongo.ReplaceOne(change['documentKey'],change['fullDocument'],upsert=True))
                     numCurrentBulkOps += 1
-                elif (thisOp in ['drop','rename','dropDatabase','invalidate']):
-                    # operations we do not track
-                    pass
                 else:
-                    print(change)
-                    sys.exit(1)
-            
-            # Check if we need to process batch (either by count or time)
-            if ((numCurrentBulkOps >= appConfig["maxOperationsPerBatch"]) or (time.time() >= (lastBatch + appConfig["maxSecondsBetweenBatches"])) ) and (numCurrentBulkOps > 0):
-                bulkOpList=[]
-                bulkOpListReplace=[]
-                if not appConfig['dryRun']:
-                    for ns in nsBulkOpDict:
-                        destDatabase=destConnection[(ns.split('.',1)[0])]
-                        destCollection=destDatabase[(ns.split('.',1)[1])]
-                        bulkOpList=nsBulkOpDict[ns]
-                        try:
-                            result = destCollection.bulk_write(bulkOpList,ordered=True)
-                        except:
-                            # replace inserts as replaces
-                            bulkOpListReplace=nsBulkOpDictReplace[ns]
-                            result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
-                perfQ.put({"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum,"resumeToken":resumeToken})
-                nsBulkOpDict = defaultdict(list)
-                nsBulkOpDictReplace= defaultdict(list)
-                numCurrentBulkOps = 0
-                numTotalBatches += 1
-                lastBatch = time.time()
-
-    if (numCurrentBulkOps > 0):
-        bulkOpList=[]
-        bulkOpListReplace=[]
-        print("Inside While",numCurrentBulkOps)
-        if not appConfig['dryRun']:
-            for ns in nsBulkOpDict:
-                destDatabase=destConnection[(ns.split('.',1)[0])]
-                destCollection=destDatabase[(ns.split('.',1)[1])]
-                bulkOpList=nsBulkOpDict[ns]
-                try:
-                    result = destCollection.bulk_write(bulkOpList,ordered=True)
-                except:
-                    # replace inserts as replaces
-                    bulkOpListReplace=nsBulkOpDictReplace[ns]
-                    result = destCollection.bulk_write(bulkOpListReplace,ordered=True)
-        nsBulkOpDict = defaultdict(list)
-        nsBulkOpDictReplace= defaultdict(list)
-        numCurrentBulkOps = 0
-        numTotalBatches += 1
-
-    sourceConnection.close()
+                    pass
+            elif (thisOp == 'delete'):
+                myClusterOps += 1
+                nsBulkOpDict[thisNs].append(pymongo.DeleteOne({'_id':change['documentKey']['_id']}))
+                nsBulkOpDictReplace[thisNs].append(pymongo.DeleteOne({'_id':change['documentKey']['_id']}))
+                numCurrentBulkOps += 1
+            elif (thisOp in ['drop','rename','dropDatabase','invalidate']):
+                # operations we do not track
+                pass
+            elif (thisOp == 'watermark'):
+                # reader position, nothing to apply
+                pass
+            else:
+                print(change)
+                sys.exit(1)
+
+        # Check if we need to process batch (either by count or time)
+        if ((numCurrentBulkOps >= appConfig["maxOperationsPerBatch"]) or (time.time() >= (lastBatch + appConfig["maxSecondsBetweenBatches"])) or allDone) and (numCurrentBulkOps > 0):
+            if appConfig['verboseLogging'] and (numCurrentBulkOps < appConfig["maxOperationsPerBatch"]):
+                logIt(threadnum, f'Timeout reached, processing batch of {numCurrentBulkOps} operations')
+            # wait for the previous batch so a namespace is never written by two batches at once
+            wait_for_batch(pendingFutures, pendingMessage, perfQ)
+            pendingFutures = []
+            if not appConfig['dryRun']:
+                pendingFutures = apply_batch(executor, destConnection, destCollections, nsBulkOpDict, nsBulkOpDictReplace)
+            pendingMessage = {"name":"batchCompleted","operations":numCurrentBulkOps,"endts":endTs,"processNum":threadnum,"resumeToken":resumeToken}
+            lastReportedResumeToken = resumeToken
+            nsBulkOpDict = defaultdict(list)
+            nsBulkOpDictReplace= defaultdict(list)
+            numCurrentBulkOps = 0
+            numTotalBatches += 1
+            lastBatch = time.time()
+
+        elif (pendingMessage is not None) and all(thisFuture.done() for thisFuture in pendingFutures):
+            # report the previous batch without waiting for the next one
+            wait_for_batch(pendingFutures, pendingMessage, perfQ)
+            pendingFutures = []
+            pendingMessage = None
+
+        elif (pendingMessage is None) and (numCurrentBulkOps == 0) and (resumeToken != lastReportedResumeToken):
+            # everything routed to this thread has been applied, report the reader position it has caught up to
+            perfQ.put({"name":"batchCompleted","operations":0,"endts":endTs,"processNum":threadnum,"resumeToken":resumeToken})
+            lastReportedResumeToken = resumeToken
+
+    wait_for_batch(pendingFutures, pendingMessage, perfQ)
+    executor.shutdown()
     destConnection.close()
     perfQ.put({"name":"processCompleted","processNum":threadnum})
 
@@ -225,6 +351,7 @@ def reporter(appConfig, perfQ):
     numWorkersCompleted = 0
     numProcessedOplogEntries = 0
     
+    # latest (cluster time, resume token) applied by each processing thread
     dtDict = {}
     
     while (numWorkersCompleted < appConfig["numProcessingThreads"]):
@@ -235,21 +362,21 @@ def reporter(appConfig, perfQ):
             qMessage = perfQ.get_nowait()
             if qMessage['name'] == "batchCompleted":
                 numProcessedOplogEntries += qMessage['operations']
-                thisEndDt = qMessage['endts'].as_datetime().replace(tzinfo=None)
+                # cluster times order the changes, datetimes only have a resolution of one second
+                thisEndTs = qMessage['endts']
                 thisProcessNum = qMessage['processNum']
-                if (thisProcessNum in dtDict) and (thisEndDt > dtDict[thisProcessNum]):
-                    dtDict[thisProcessNum] = thisEndDt
-                else:
-                    dtDict[thisProcessNum] = thisEndDt
-                #print("received endTs = {}".format(thisEndTs.as_datetime()))
-                if 'resumeToken' in qMessage:
-                    resumeToken = qMessage['resumeToken']
-                else:
-                    resumeToken = 'N/A'
+                if (thisProcessNum not in dtDict) or (thisEndTs >= dtDict[thisProcessNum][0]):
+                    dtDict[thisProcessNum] = (thisEndTs, qMessage.get('resumeToken','N/A'))
 
             elif qMessage['name'] == "processCompleted":
                 numWorkersCompleted += 1
 
+        # each thread only applies the changes routed to it, so restarting is only safe from the thread furthest behind
+        if len(dtDict) == appConfig["numProcessingThreads"]:
+            resumeToken = min(dtDict.values())[1]
+        else:
+            resumeToken = 'N/A'
+
         # total total
         elapsedSeconds = nowTime - startTime
         totalOpsPerSecond = numProcessedOplogEntries / elapsedSeconds
@@ -268,7 +395,7 @@ def reporter(appConfig, perfQ):
         totSecondsBehind = 0
         numSecondsBehindEntries = 0
         for thisDt in dtDict:
-            totSecondsBehind = (dtUtcNow - dtDict[thisDt].replace(tzinfo=None)).total_seconds()
+            totSecondsBehind = (dtUtcNow - dtDict[thisDt][0].as_datetime().replace(tzinfo=None)).total_seconds()
             numSecondsBehindEntries += 1
 
         avgSecondsBehind = int(totSecondsBehind / max(numSecondsBehindEntries,1))
@@ -324,6 +451,12 @@ def main():
                         default=1,
                         help='Number of threads (parallel processing)')
 
+    parser.add_argument('--flush-threads',
+                        required=False,
+                        type=int,
+                        default=8,
+                        help='Number of collections each processing thread writes to concurrently')
+
     parser.add_argument('--max-seconds-between-batches',
                         required=False,
                         type=int,
@@ -356,6 +489,11 @@ def main():
                         action='store_true',
                         help='Display the current change stream resume token')
 
+    parser.add_argument('--update-deltas',
+                        required=False,
+                        action='store_true',
+                        help='Apply updates as $set/$unset of the changed fields instead of replacing the full document looked up on the source')
+
     args = parser.parse_args()
 
     MIN_PYTHON = (3, 7)
@@ -367,6 +505,7 @@ def main():
     appConfig['sourceUri'] = args.source_uri
     appConfig['targetUri'] = args.target_uri
     appConfig['numProcessingThreads'] = args.threads
+    appConfig['numFlushThreads'] = args.flush_threads
     appConfig['maxSecondsBetweenBatches'] = args.max_seconds_between_batches
     appConfig['maxOperationsPerBatch'] = args.max_operations_per_batch
     appConfig['durationSeconds'] = args.duration_seconds
@@ -375,6 +514,7 @@ def main():
     appConfig['sourceDb'] = args.source_database
     appConfig['startPosition'] = args.start_position
     appConfig['verboseLogging'] = args.verbose
+    appConfig['updateDeltas'] = args.update_deltas
     appConfig['cdcSource'] = 'changeStream'
 
     if args.get_resume_token:
@@ -397,9 +537,14 @@ def main():
     t = threading.Thread(target=reporter,args=(appConfig,q))
     t.start()
     
+    # one reader routes each change to a processing thread by namespace and _id
+    dispatchQueues = [mp.Queue(maxsize=dispatchQueueDepth) for loop in range(appConfig["numProcessingThreads"])]
+
     processList = []
+    p = mp.Process(target=change_stream_reader,args=(appConfig,dispatchQueues))
+    processList.append(p)
     for loop in range(appConfig["numProcessingThreads"]):
-        p = mp.Process(target=change_stream_processor,args=(loop,appConfig,q))
+        p = mp.Process(target=change_stream_processor,args=(loop,appConfig,q,dispatchQueues[loop]))
         processList.append(p)
         
     for process in processList:
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Unit tests for applying change stream updates as deltas (--update-deltas)
+"""
+
+import os
+import copy
+import unittest
+import importlib.util
+
+
+def load_mvu_tool():
+    # the script name is not a valid module name
+    spec = importlib.util.spec_from_file_location("mvu_cdc_migrator", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mvu-cdc-migrator.py'))
+    mvu_tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mvu_tool)
+    return mvu_tool
+
+
+mvu_tool = load_mvu_tool()
+
+
+def update_paths(update_doc):
+    """Return every field path modified by an update document"""
+    return [path for operator in update_doc.values() for path in operator]
+
+
+def has_path_conflict(update_doc):
+    """True if one path modified by the update is the same as or a prefix of another, the server rejects these updates"""
+    paths = update_paths(update_doc)
+    for i, path in enumerate(paths):
+        for other in paths[i+1:]:
+            if path == other or other.startswith(path + '.') or path.startswith(other + '.'):
+                return True
+    return False
+
+
+def get_parent(document, path):
+    """Return the container holding the last element of a dotted path, and that element's key"""
+    parts = path.split('.')
+    parent = document
+    for part in parts[:-1]:
+        parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+    key = parts[-1]
+    return parent, int(key) if isinstance(parent, list) else key
+
+
+def apply_update(document, update_doc):
+    """Apply the operators produced by update_delta to a document"""
+    if has_path_conflict(update_doc):
+        raise ValueError("conflicting update paths {}".format(update_paths(update_doc)))
+    for path, push in update_doc.get('$push', {}).items():
+        parent, key = get_parent(document, path)
+        parent[key] = parent[key][:push['$slice']]
+    for path, value in update_doc.get('$set', {}).items():
+        parent, key = get_parent(document, path)
+        parent[key] = value
+    for path in update_doc.get('$unset', {}):
+        parent, key = get_parent(document, path)
+        if isinstance(parent, list):
+            parent[key] = None
+        else:
+            del parent[key]
+    return document
+
+
+class TestUpdateDelta(unittest.TestCase):
+    """Test the update documents built from a change's updateDescription"""
+
+    def test_set_and_unset(self):
+        """Test updated and removed fields are a single update"""
+        update_doc_list = mvu_tool.update_delta({'updatedFields': {'a': 1, 'b.c': 2}, 'removedFields': ['d'], 'truncatedArrays': []})
+
+        self.assertEqual(update_doc_list, [{'$set': {'a': 1, 'b.c': 2}, '$unset': {'d': 1}}])
+
+    def test_empty_update(self):
+        """Test an update that changes nothing produces no updates"""
+        self.assertEqual(mvu_tool.update_delta({'updatedFields': {}, 'removedFields': [], 'truncatedArrays': []}), [])
+        self.assertEqual(mvu_tool.update_delta({}), [])
+
+    def test_truncation_only(self):
+        """Test a truncated array alone is a single $push with $slice"""
+        update_doc_list = mvu_tool.update_delta({'updatedFields': {}, 'removedFields': [], 'truncatedArrays': [{'field': 'arr', 'newSize': 2}]})
+
+        self.assertEqual(update_doc_list, [{'$push': {'arr': {'$each': [], '$slice': 2}}}])
+
+    def test_truncation_and_element_update(self):
+        """Test an array truncated and updated in the same change is applied without conflicting paths"""
+        source = {'_id': 1, 'arr': [1, 2, 3, 4], 'x': 1}
+        target = copy.deepcopy(source)
+        # arr [1,2,3,4] -> [1,9] and x removed
+        update_description = {'updatedFields': {'arr.1': 9}, 'removedFields': ['x'], 'truncatedArrays': [{'field': 'arr', 'newSize': 2}]}
+
+        update_doc_list = mvu_tool.update_delta(update_description)
+
+        # the truncation is applied first, in an update of its own
+        self.assertEqual(len(update_doc_list), 2)
+        self.assertEqual(update_doc_list[0], {'$push': {'arr': {'$each': [], '$slice': 2}}})
+        for update_doc in update_doc_list:
+            self.assertFalse(has_path_conflict(update_doc))
+            apply_update(target, update_doc)
+        self.assertEqual(target, {'_id': 1, 'arr': [1, 9]})
+
+    def test_truncation_of_nested_array(self):
+        """Test a truncated array within an embedded document with an element of the same array updated"""
+        target = {'_id': 1, 'a': {'arr': [[1, 2], [3, 4], [5, 6]]}}
+        update_description = {'updatedFields': {'a.arr.0.1': 7}, 'removedFields': [], 'truncatedArrays': [{'field': 'a.arr', 'newSize': 1}]}
+
+        for update_doc in mvu_tool.update_delta(update_description):
+            apply_update(target, update_doc)
+
+        self.assertEqual(target, {'_id': 1, 'a': {'arr': [[1, 7]]}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,8 @@
 import argparse
 import sys
 import csv
-import glob
 import os
 import datetime as dt
-import pymongo
 import importlib.util
 
 # Compressor to use for compression analysis
@@ -14,8 +12,8 @@ COMPRESSOR = 'zstd-3-dict'
 # Fixed dictionary size in Amazon DocumentDB 8.0 dictionary-based compression
 DICTIONARY_SIZE_BYTES = 4096
 
-# Server alias base for output file naming
-SERVER_ALIAS_BASE = 'temp'
+# Number of collections analyzed concurrently
+NUM_THREADS = 8
 
 
 def load_compression_module():
@@ -59,10 +57,10 @@ def load_compression_module():
         compression_module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(compression_module)
         
-        # Verify the module has the required getData function
-        if not hasattr(compression_module, 'getData'):
+        # Verify the module has the required analyzeCollections function
+        if not hasattr(compression_module, 'analyzeCollections'):
             raise RuntimeError(
-                f"Compression module loaded but missing required 'getData' function.\n"
+                f"Compression module loaded but missing required 'analyzeCollections' function.\n"
                 f"The compression-review.py file may be corrupted or outdated."
             )
         
@@ -76,222 +74,133 @@ def load_compression_module():
         )
 
 
-def cleanup_csv_files(csv_files):
+def run_compression_analysis(uri, sample_size, dictionary_sample_size, sample_dir=None, sample_max_age_hours=None):
     """
-    Remove CSV files and log any errors.
-    
-    Args:
-        csv_files: Iterable of CSV file paths to remove
-    """
-    for csv_file in csv_files:
-        try:
-            os.remove(csv_file)
-            print(f"Cleaned up partial file: {csv_file}", file=sys.stderr)
-        except Exception as e:
-            print(f"Warning: Could not remove file {csv_file}: {e}", file=sys.stderr)
-
-
-def run_compression_and_get_output(uri, sample_size, dictionary_sample_size):
-    """
-    Run compression analysis and return the path to the generated CSV file.
+    Run compression analysis in-process and return the results for each collection.
     
     Args:
         uri: MongoDB connection URI
         sample_size: Number of documents to sample per collection
         dictionary_sample_size: Number of documents for dictionary creation
+        sample_dir: Directory of stored samples to reuse and add to, None to always sample
+        sample_max_age_hours: Stored samples older than this are taken again, None to reuse them regardless of age
         
     Returns:
-        str: Path to the generated compression CSV file
+        dict: Dictionary mapping 'db.collection' to compression data and collection stats
         
     Raises:
-        RuntimeError: If compression analysis fails or no CSV file is created
+        RuntimeError: If compression analysis fails
     """
     print("Running compression analysis...")
     
     # Load the compression module
     compression_module = load_compression_module()
     
-    # Create server alias with PID for concurrency safety
-    server_alias = f"{SERVER_ALIAS_BASE}-{os.getpid()}"
-    
-    # Get list of existing CSV files before running compression analysis
-    csv_pattern = f"{server_alias}-*-compression-review.csv"
-    existing_csv_files = set(glob.glob(csv_pattern))
-    
     # Configure and run compression analysis
     app_config = {
         'uri': uri,
-        'serverAlias': server_alias,
         'sampleSize': sample_size,
         'compressor': COMPRESSOR,
         'dictionarySampleSize': dictionary_sample_size,
-        'dictionarySize': DICTIONARY_SIZE_BYTES
+        'dictionarySize': DICTIONARY_SIZE_BYTES,
+        'numThreads': NUM_THREADS,
+        'sampleDir': sample_dir,
+        'sampleMaxAgeHours': sample_max_age_hours
     }
     
+    comp_data = {}
+    
     try:
-        compression_module.getData(app_config)
+        for result in compression_module.analyzeCollections(app_config):
+            # collStats was gathered with the sample, no further server calls are needed
+            coll_stats = result['collStats']
+            key = f"{result['dbName']}.{result['collName']}"
+            comp_data[key] = {
+                'db_name': result['dbName'],
+                'coll_name': result['collName'],
+                'num_docs': coll_stats['count'],
+                'avg_doc_size': int(coll_stats.get('avgObjSize', 0)),
+                'comp_ratio': result['compressors'][COMPRESSOR]['projectedCompRatio'],
+                'total_indexes': coll_stats.get('nindexes', 0),
+                'index_size_bytes': coll_stats.get('totalIndexSize', 0)
+            }
     except Exception as e:
-        # Clean up any partial CSV files that may have been created
-        current_csv_files = set(glob.glob(csv_pattern))
-        new_csv_files = current_csv_files - existing_csv_files
-        if new_csv_files:
-            cleanup_csv_files(new_csv_files)
         raise RuntimeError(f"Error running compression analysis: {e}")
     
-    # Find the newly created CSV file by comparing before and after
-    current_csv_files = set(glob.glob(csv_pattern))
-    new_csv_files = current_csv_files - existing_csv_files
-    
-    if not new_csv_files:
-        raise RuntimeError(f"No new CSV file created. Expected pattern: {csv_pattern}")
-    
-    if len(new_csv_files) > 1:
-        print(f"Warning: Multiple new CSV files found: {new_csv_files}", file=sys.stderr)
-        # Use the most recent one
-        latest_csv = max(new_csv_files, key=os.path.getmtime)
-    else:
-        latest_csv = new_csv_files.pop()
-    
-    print(f"Parsing results from: {latest_csv}")
-    return latest_csv
-
-
-def parse_compression_csv(csv_filepath):
-    """
-    Parse compression review CSV and extract collection data.
-    
-    Args:
-        csv_filepath: Path to the compression review CSV file
-        
-    Returns:
-        dict: Dictionary mapping 'db.collection' to compression data
-        
-    Raises:
-        RuntimeError: If CSV header cannot be found or file is invalid
-    """
-    comp_data = {}
-    
-    with open(csv_filepath, 'r') as f:
-        # Read all lines to find where the actual data starts
-        lines = f.readlines()
-        
-        # Find the header line (starts with dbName)
-        header_idx = None
-        for i, line in enumerate(lines):
-            if line.startswith('dbName'):
-                header_idx = i
-                break
-        
-        if header_idx is None:
-            raise RuntimeError("Could not find data header in CSV")
-        
-        # Use DictReader for named column access
-        reader = csv.DictReader(lines[header_idx:])
-        
-        for row in reader:
-            try:
-                # Access columns by name instead of index
-                db_name = row['dbName']
-                coll_name = row['collName']
-                num_docs = int(row['numDocs'])
-                avg_doc_size = int(row['avgDocSize'])
-                comp_ratio = float(row['projectedCompRatio'])
-                
-                key = f"{db_name}.{coll_name}"
-                comp_data[key] = {
-                    'db_name': db_name,
-                    'coll_name': coll_name,
-                    'num_docs': num_docs,
-                    'avg_doc_size': avg_doc_size,
-                    'comp_ratio': comp_ratio
-                }
-            except (KeyError, ValueError) as e:
-                # Skip rows with missing columns or invalid data
-                print(f"Warning: Skipping row due to error: {e}", file=sys.stderr)
-                continue
-    
     return comp_data
 
 
-def generate_sizing_csv(comp_data, uri):
+def generate_sizing_csv(comp_data):
     """
-    Generate cost estimator CSV by combining compression data with MongoDB stats.
+    Generate cost estimator CSV from the compression data and collection stats.
     
     Args:
-        comp_data: Dictionary of compression data from parse_compression_csv()
-        uri: MongoDB connection URI
+        comp_data: Dictionary of compression data from run_compression_analysis()
         
     Returns:
         str: Path to the generated sizing CSV file
     """
-    print("Connecting to MongoDB to gather additional stats...")
-    
     # Create output CSV file
     log_timestamp = dt.datetime.now(dt.timezone.utc).strftime('%Y%m%d%H%M%S')
     output_filename = f"sizing-{log_timestamp}.csv"
     
-    with pymongo.MongoClient(host=uri, appname='workload-calc', serverSelectionTimeoutMS=5000) as client:
-        with open(output_filename, 'w', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            
-            # Write header
-            csvwriter.writerow([
-                'SLNo', 'Database_Name', 'Collection_Name', 'Document_Count',
-                'Average_Document_Size', 'Total_Indexes', 'Index_Size',
-                'Index_Working_Set', 'Data_Working_Set', 'Inserts_Per_Day',
-                'Updates_Per_Day', 'Deletes_Per_Day', 'Reads_Per_Day',
-                'Compression_Ratio'
-            ])
-            
-            sl_no = 1
+    with open(output_filename, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        
+        # Write header
+        csvwriter.writerow([
+            'SLNo', 'Database_Name', 'Collection_Name', 'Document_Count',
+            'Average_Document_Size', 'Total_Indexes', 'Index_Size',
+            'Index_Working_Set', 'Data_Working_Set', 'Inserts_Per_Day',
+            'Updates_Per_Day', 'Deletes_Per_Day', 'Reads_Per_Day',
+            'Compression_Ratio'
+        ])
+        
+        sl_no = 1
+        
+        # Iterate through collections from compression data
+        for key, data in comp_data.items():
+            db_name = data['db_name']
+            coll_name = data['coll_name']
             
-            # Iterate through collections from compression data
-            for key, data in comp_data.items():
-                db_name = data['db_name']
-                coll_name = data['coll_name']
+            try:
+                doc_count = data['num_docs']
+                avg_doc_size = data['avg_doc_size']
+                total_indexes = data['total_indexes']
+                index_size_gb = data['index_size_bytes'] / (1024 * 1024 * 1024)
+                comp_ratio = data['comp_ratio']
+                
+                # Default estimates for workload metrics
+                index_working_set = 100
+                data_working_set = 10
+                inserts_per_day = 0
+                updates_per_day = 0
+                deletes_per_day = 0
+                reads_per_day = 0
+                
+                # Write row
+                csvwriter.writerow([
+                    sl_no,
+                    db_name,
+                    coll_name,
+                    doc_count,
+                    avg_doc_size,
+                    total_indexes,
+                    f"{index_size_gb:.4f}",
+                    index_working_set,
+                    data_working_set,
+                    inserts_per_day,
+                    updates_per_day,
+                    deletes_per_day,
+                    reads_per_day,
+                    f"{comp_ratio:.4f}"
+                ])
                 
-                try:
-                    # Get collection stats from MongoDB
-                    stats = client[db_name].command("collStats", coll_name)
-                    
-                    doc_count = data['num_docs']
-                    avg_doc_size = data['avg_doc_size']
-                    total_indexes = stats.get('nindexes', 0)
-                    index_size_bytes = stats.get('totalIndexSize', 0)
-                    index_size_gb = index_size_bytes / (1024 * 1024 * 1024)
-                    comp_ratio = data['comp_ratio']
-                    
-                    # Default estimates for workload metrics
-                    index_working_set = 100
-                    data_working_set = 10
-                    inserts_per_day = 0
-                    updates_per_day = 0
-                    deletes_per_day = 0
-                    reads_per_day = 0
-                    
-                    # Write row
-                    csvwriter.writerow([
-                        sl_no,
-                        db_name,
-                        coll_name,
-                        doc_count,
-                        avg_doc_size,
-                        total_indexes,
-                        f"{index_size_gb:.4f}",
-                        index_working_set,
-                        data_working_set,
-                        inserts_per_day,
-                        updates_per_day,
-                        deletes_per_day,
-                        reads_per_day,
-                        f"{comp_ratio:.4f}"
-                    ])
-                    
-                    sl_no += 1
-                    
-                except Exception as e:
-                    print(f"Error processing {db_name}.{coll_name}: {e}", file=sys.stderr)
-                    continue
+                sl_no += 1
+                
+            except (KeyError, TypeError) as e:
+                print(f"Error processing {db_name}.{coll_name}: {e}", file=sys.stderr)
+                continue
     
     return output_filename
 
@@ -342,6 +251,16 @@ def main():
                         default=100,
                         help='Number of documents to sample for dictionary creation')
     
+    parser.add_argument('--sample-dir',
+                        required=False,
+                        type=str,
+                        help='Directory to store sampled documents in, later runs reuse the stored samples instead of sampling again')
+    
+    parser.add_argument('--sample-max-age-hours',
+                        required=False,
+                        type=float,
+                        help='Sample collections again when their stored sample is older than this many hours, default is to always reuse stored samples')
+    
     args = parser.parse_args()
     
     # Validate arguments
@@ -350,21 +269,18 @@ def main():
     except ValueError as e:
         parser.error(str(e))
     
-    compression_csv = None  # Initialize to handle cleanup in finally
-    
     try:
-        # Run compression analysis and get the output CSV file
-        compression_csv = run_compression_and_get_output(
+        # Run compression analysis, this also gathers the collection stats
+        comp_data = run_compression_analysis(
             uri=args.uri,
             sample_size=args.sample_size,
-            dictionary_sample_size=args.dictionary_sample_size
+            dictionary_sample_size=args.dictionary_sample_size,
+            sample_dir=args.sample_dir,
+            sample_max_age_hours=args.sample_max_age_hours
         )
         
-        # Parse compression CSV to extract collection data
-        comp_data = parse_compression_csv(compression_csv)
-        
-        # Generate sizing CSV by combining compression data with MongoDB stats
-        output_filename = generate_sizing_csv(comp_data, args.uri)
+        # Generate sizing CSV from the compression data and collection stats
+        output_filename = generate_sizing_csv(comp_data)
         
         print(f"\nSizing CSV generated: {output_filename}")
         print("\n" + "="*80)
@@ -386,10 +302,6 @@ def main():
     except RuntimeError as e:
         print(str(e), file=sys.stderr)
         sys.exit(1)
-    finally:
-        # Clean up the compression-review CSV file if it was created
-        if compression_csv is not None:
-            cleanup_csv_files([compression_csv])
 
 if __name__ == "__main__":
     main()
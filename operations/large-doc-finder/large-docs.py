@@ -1,4 +1,7 @@
 import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from bson import json_util
 import pymongo
 import time
 import concurrent.futures
@@ -8,11 +11,23 @@ import sys
 import logging
 import signal
 import sys
+import os
 from threading import Lock
 from datetime import datetime
 
 shutdown_flag = False
 
+# Upper limit on the number of _id ranges, and the number of sampled _id values per range used to find their boundaries
+MAX_RANGES = 20000
+SAMPLES_PER_RANGE = 5
+
+# $type aliases of each BSON type bracket in sort order, comparison operators only match values in the same bracket
+ID_TYPE_BRACKETS = [['minKey'], ['null'], ['int', 'long', 'double', 'decimal'], ['symbol', 'string'], ['object'], ['binData'],
+                    ['objectId'], ['bool'], ['date'], ['timestamp'], ['regex'], ['maxKey']]
+
+# Document processor of a worker process when scanning with --use-processes
+worker_processor = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -56,85 +71,101 @@ class BatchCounter:
                 sys.stdout.flush()
 
 class DocumentProcessor:
-    _last_id_lock = Lock()
-    _last_processed_id = None
-    
-    def __init__(self, collection, size_threshold, batch_counter, batch_size):
+    def __init__(self, collection, size_threshold, batch_size, size_mode='encode'):
         self.collection = collection
         self.size_threshold = size_threshold
-        self.batch_counter = batch_counter
         self.batch_size = batch_size
+        self.size_mode = size_mode
+
+    def find_sizes(self, query):
+        # Yields (document, size) for the documents matching query
+        if self.size_mode == 'server':
+            # Only _id and the size are sent by the server
+            pipeline = [{"$match": query}, {"$project": {"_id": 1, "size": {"$bsonSize": "$$ROOT"}}}]
+            for doc in self.collection.aggregate(pipeline, hint="_id_", batchSize=self.batch_size):
+                yield doc, doc["size"]
+        elif self.size_mode == 'raw':
+            # The size is the length of the raw BSON, the document is not decoded
+            raw_collection = self.collection.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+            for doc in raw_collection.find(query).hint("_id_").batch_size(self.batch_size):
+                yield doc, len(doc.raw)
+        else:
+            for doc in self.collection.find(query).hint("_id_").batch_size(self.batch_size):
+                yield doc, get_bson_size(doc)
 
-    def get_next_batch(self):
-        with DocumentProcessor._last_id_lock:
-            query = {"_id": {"$gt": DocumentProcessor._last_processed_id}} if DocumentProcessor._last_processed_id else {}
-            
-            docs = list(self.collection.find(
-                query,
-                {"_id": 1},
-                limit=self.batch_size,
-                sort=[("_id", 1)]
-            ).hint("_id_"))
-            
-            if not docs:
-                return None, None
-                
-            start_id = docs[0]["_id"]
-            end_id = docs[-1]["_id"]
-            DocumentProcessor._last_processed_id = end_id
-            
-            return start_id, end_id
+    def scan_range(self, range_num, start_id, end_id):
+        # Returns (range number, documents scanned, large documents, completed), an incomplete range is scanned again on resume
+        doc_count = 0
+        range_large_docs = []
 
-    def process_batch(self, batch_cursor):
-        while True:
-            if shutdown_flag:
-                break
-                
-            start_id, end_id = self.get_next_batch()
-            if not start_id:
-                break
-                
-            batch_large_docs = []
-            doc_count = 0
-            
-            try:
-                query = {
-                    "_id": {
-                        "$gte": start_id,
-                        "$lte": end_id
-                    }
-                }
-                
-                batch_cursor = self.collection.find(query).hint("_id_")
-                
-                for doc in batch_cursor:
-                    if shutdown_flag:
-                        break
-                        
-                    doc_count += 1
-                    doc_id = doc["_id"]
-                    
-                    try:
-                        size = get_bson_size(doc)
-                        
-                        if size > self.size_threshold:
-                            batch_large_docs.append((doc_id, size))
-                            
-                    except Exception as e:
-                        if not shutdown_flag:
-                            logger.error(f"Error processing document {doc_id}: {str(e)}")
-                    
-                    doc = None
-                
-                if doc_count > 0 or batch_large_docs:
-                    self.batch_counter.increment(doc_count, len(batch_large_docs))
-                    yield True, batch_large_docs
-                    
-            except Exception as e:
-                logger.error(f"Error processing batch: {str(e)}")
-                yield False, []
-                
-            batch_cursor = None
+        try:
+            for doc, size in self.find_sizes(id_range_query(start_id, end_id)):
+                if shutdown_flag:
+                    return range_num, doc_count, range_large_docs, False
+
+                doc_count += 1
+
+                if size is not None and size > self.size_threshold:
+                    range_large_docs.append((doc["_id"], size))
+
+        except Exception as e:
+            if not shutdown_flag:
+                logger.error(f"Error processing range {range_num}: {str(e)}")
+            return range_num, doc_count, range_large_docs, False
+
+        return range_num, doc_count, range_large_docs, True
+
+
+def type_bracket(type_name):
+    for bracket_num, this_bracket in enumerate(ID_TYPE_BRACKETS):
+        if type_name in this_bracket:
+            return bracket_num
+    return len(ID_TYPE_BRACKETS)
+
+
+def id_bound_query(boundary, op):
+    # _id >= ("$gte") or < ("$lt") a boundary, _id values of the types sorting after (or before) it are matched with $type
+    bracket = type_bracket(boundary["type"])
+    if op == "$gte":
+        other_brackets = ID_TYPE_BRACKETS[bracket + 1:]
+    else:
+        other_brackets = ID_TYPE_BRACKETS[:bracket]
+    other_types = [type_name for this_bracket in other_brackets for type_name in this_bracket]
+    or_list = [{"_id": {op: boundary["value"]}}]
+    if other_types:
+        or_list.append({"_id": {"$type": other_types}})
+    return {"$or": or_list}
+
+
+def id_range_query(start_id, end_id):
+    # Range of _id values from the start boundary (inclusive) to the end boundary (exclusive), None is unbounded
+    #   a range can span several BSON types when the _id values are of mixed types
+    if start_id is not None and end_id is not None and type_bracket(start_id["type"]) == type_bracket(end_id["type"]):
+        # no _id of another type sorts between the boundaries, a single index range
+        return {"_id": {"$gte": start_id["value"], "$lt": end_id["value"]}}
+    and_list = []
+    if start_id is not None:
+        and_list.append(id_bound_query(start_id, "$gte"))
+    if end_id is not None:
+        and_list.append(id_bound_query(end_id, "$lt"))
+    return {"$and": and_list} if and_list else {}
+
+
+def worker_signal_handler(signum, frame):
+    global shutdown_flag
+    shutdown_flag = True
+
+def init_worker(config, size_mode):
+    # Each worker process has its own connection
+    global worker_processor
+    signal.signal(signal.SIGINT, worker_signal_handler)
+    signal.signal(signal.SIGTERM, worker_signal_handler)
+    client = pymongo.MongoClient(config['uri'])
+    col = client[config['databaseName']][config['collectionName']]
+    worker_processor = DocumentProcessor(col, config['largeDocThreshold'], config['batchSize'], size_mode)
+
+def scan_range_in_worker(range_num, start_id, end_id):
+    return worker_processor.scan_range(range_num, start_id, end_id)
 
 
 def signal_handler(signum, frame):
@@ -185,22 +216,64 @@ def validate_config(config):
         raise ValueError("Collection name cannot be empty")
 
 def create_id_ranges(batch_size, collection, total_docs):
+    # Split the _id values into ranges of about batch_size documents using a sorted sample of _id values
+    # Each boundary holds the _id value and its BSON type
     if total_docs == 0:
         return []
 
-    # Just getting min_id
+    num_ranges = min((total_docs + batch_size - 1) // batch_size, MAX_RANGES)
+    if num_ranges <= 1:
+        return [(None, None)]
+
     pipeline = [
-        {"$project": {"_id": 1}},
-        {"$sort": {"_id": 1}},
-        {"$limit": 1}
+        {"$sample": {"size": num_ranges * SAMPLES_PER_RANGE}},
+        {"$project": {"_id": 1, "type": {"$type": "$_id"}}},
+        {"$sort": {"_id": 1}}
     ]
-    
-    result = list(collection.aggregate(pipeline, hint="_id_"))
-    if not result:
-        return []
 
-    # Each thread will use this as a starting point to create their own range
-    return [(result[0]["_id"], None)]
+    sample_ids = [{"value": doc["_id"], "type": doc["type"]} for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+    if not sample_ids:
+        return [(None, None)]
+
+    boundaries = []
+    for range_num in range(1, num_ranges):
+        this_id = sample_ids[range_num * len(sample_ids) // num_ranges]
+        if not boundaries or this_id != boundaries[-1]:
+            boundaries.append(this_id)
+
+    return list(zip([None] + boundaries, boundaries + [None]))
+
+def load_checkpoint(checkpoint_file, namespace):
+    # First line holds the _id ranges, then one line per completed range
+    id_ranges = None
+    completed_ranges = {}
+
+    if not os.path.exists(checkpoint_file):
+        return id_ranges, completed_ranges
+
+    with open(checkpoint_file, 'r+') as f:
+        lines = f.readlines()
+        if lines and not lines[-1].endswith('\n'):
+            # Partially written line from an interrupted run
+            lines.pop()
+            f.truncate(sum(len(line.encode('utf-8')) for line in lines))
+
+    for line in lines:
+        entry = json_util.loads(line)
+        if 'ranges' in entry:
+            if entry['namespace'] != namespace:
+                raise ValueError(f"Checkpoint file {checkpoint_file} is for {entry['namespace']}, remove it or use a different --checkpoint-file")
+            id_ranges = [tuple(id_range) for id_range in entry['ranges']]
+        else:
+            completed_ranges[entry['range']] = (entry['docs'], [tuple(large_doc) for large_doc in entry['large_docs']])
+
+    return id_ranges, completed_ranges
+
+def write_checkpoint(checkpoint_file, entry, mode='a'):
+    with open(checkpoint_file, mode) as f:
+        f.write(json_util.dumps(entry, json_options=json_util.CANONICAL_JSON_OPTIONS) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
 
 def write_to_csv(filename, data, mode='a', batch_size=1000):
     try:
@@ -234,17 +307,20 @@ def get_collection_doc_count(collection):
         logger.error(f"Error getting document count from stats: {str(e)}")
         raise
 
-def process_future_results(future, large_docs_data):
-    large_docs_count = 0
+def get_size_mode(collection, size_only):
+    if not size_only:
+        return 'encode'
     try:
-        for success, batch_large_docs in future.result():
-            if batch_large_docs:
-                large_docs_count += len(batch_large_docs)
-                for doc_id, size in batch_large_docs:
-                    large_docs_data.append((str(doc_id), size, f"{size / (1024*1024):.2f}"))
-    except Exception as e:
-        logger.error(f"Error processing future results: {str(e)}")
-    return large_docs_count
+        list(collection.aggregate([{"$limit": 1}, {"$project": {"_id": 1, "size": {"$bsonSize": "$$ROOT"}}}]))
+        logger.info("Using server-side $bsonSize for document sizes")
+        return 'server'
+    except pymongo.errors.OperationFailure as e:
+        logger.info(f"Server-side $bsonSize is not supported ({str(e)}), using raw BSON length for document sizes")
+        return 'raw'
+
+def add_large_docs(large_docs_data, range_large_docs):
+    for doc_id, size in range_large_docs:
+        large_docs_data.append((str(doc_id), size, f"{size / (1024*1024):.2f}"))
 
 def main():
     signal.signal(signal.SIGINT, signal_handler)
@@ -261,6 +337,9 @@ def main():
     parser.add_argument('--collection', required=True, type=str, help='Collection name')
     parser.add_argument('--csv', default='large_doc_', type=str, help='Prefix for the CSV output filename')
     parser.add_argument('--large-doc-size', type=int, default=8388608, help='Large document size threshold in bytes (default 8388608 - 8MB)')
+    parser.add_argument('--size-only', action='store_true', help='Only retrieve _id and document size, using $bsonSize on the server or the raw BSON length if not supported')
+    parser.add_argument('--use-processes', action='store_true', help='Scan ranges in worker processes instead of threads')
+    parser.add_argument('--checkpoint-file', type=str, help='File recording the scanned ranges, a rerun after an interruption resumes from it (default <csv prefix><database>.<collection>.checkpoint)')
 
     args = parser.parse_args()
 
@@ -271,7 +350,10 @@ def main():
         'databaseName': args.database,
         'collectionName': args.collection,
         'csvName': args.csv,
-        'largeDocThreshold': int(args.large_doc_size)
+        'largeDocThreshold': int(args.large_doc_size),
+        'sizeOnly': args.size_only,
+        'useProcesses': args.use_processes,
+        'checkpointFile': args.checkpoint_file or f"{args.csv}{args.database}.{args.collection}.checkpoint"
     }
 
     try:
@@ -284,6 +366,7 @@ def main():
     csv_filename = f"{appConfig['csvName']}{timestamp}.csv"
     large_docs_found = 0
     large_docs_data = []
+    scan_complete = False
 
     logger.info("Connecting to database...")
     
@@ -297,42 +380,52 @@ def main():
         logger.info(f"Total Documents: {total_docs:,}")
 
         batch_size = appConfig['batchSize']
-        num_batches = (total_docs + batch_size - 1) // batch_size
-
-        logger.info(f"Creating {num_batches:,} segments with {batch_size:,} docs per segment")
+        namespace = f"{appConfig['databaseName']}.{appConfig['collectionName']}"
+        checkpoint_file = appConfig['checkpointFile']
+
+        id_ranges, completed_ranges = load_checkpoint(checkpoint_file, namespace)
+        if id_ranges is None:
+            id_ranges = create_id_ranges(batch_size, col, total_docs)
+            write_checkpoint(checkpoint_file, {'namespace': namespace, 'ranges': [list(id_range) for id_range in id_ranges]}, mode='w')
+            logger.info(f"Created {len(id_ranges):,} segments with approximately {batch_size:,} docs per segment")
+        else:
+            logger.info(f"Resuming from {checkpoint_file}, {len(completed_ranges):,} of {len(id_ranges):,} segments already scanned")
 
         logger.info('Starting document scan...')
 
-        metadata = [
-            ['Database', appConfig['databaseName']],
-            ['Collection', appConfig['collectionName']],
-            ['Batch size', batch_size],
-            ['Number of threads', appConfig['numProcesses']],
-            ['Total documents', total_docs],
-            ['Large document threshold (bytes)', appConfig['largeDocThreshold']],
-            ['Large document threshold (MB)', f"{appConfig['largeDocThreshold'] / (1024*1024):.2f}"],
-            ['Scan Start Time', datetime.now().isoformat()],
-        ]
+        size_mode = get_size_mode(col, appConfig['sizeOnly'])
 
         batch_counter = BatchCounter(total_docs) 
-        processor = DocumentProcessor(col, appConfig['largeDocThreshold'], batch_counter=batch_counter, batch_size=batch_size)
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=appConfig['numProcesses']) as executor:
-            futures = set()
-            large_docs_found = 0
-                
-            for _ in range(appConfig['numProcesses']):
-                if shutdown_flag:
-                    print('\nStopping batch submission...', flush=True)
-                    break
+        for range_docs, range_large_docs in completed_ranges.values():
+            batch_counter.increment(range_docs, len(range_large_docs))
+            add_large_docs(large_docs_data, range_large_docs)
+            large_docs_found += len(range_large_docs)
+
+        # Every range is an independent task, the executor queue hands them out to the workers
+        if appConfig['useProcesses']:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=appConfig['numProcesses'], initializer=init_worker, initargs=(appConfig, size_mode))
+            scan_range = scan_range_in_worker
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=appConfig['numProcesses'])
+            scan_range = DocumentProcessor(col, appConfig['largeDocThreshold'], batch_size, size_mode).scan_range
+
+        num_incomplete = 0
 
-                processor = DocumentProcessor(col, appConfig['largeDocThreshold'], 
-                                        batch_counter=batch_counter, 
-                                        batch_size=batch_size)
-                future = executor.submit(processor.process_batch, None)
-                futures.add(future)
+        with executor:
+            futures = [executor.submit(scan_range, range_num, start_id, end_id)
+                       for range_num, (start_id, end_id) in enumerate(id_ranges) if range_num not in completed_ranges]
 
             for future in concurrent.futures.as_completed(futures):
+                range_num, range_docs, range_large_docs, range_completed = future.result()
+
+                if range_completed:
+                    write_checkpoint(checkpoint_file, {'range': range_num, 'docs': range_docs, 'large_docs': [list(large_doc) for large_doc in range_large_docs]})
+                    batch_counter.increment(range_docs, len(range_large_docs))
+                    add_large_docs(large_docs_data, range_large_docs)
+                    large_docs_found += len(range_large_docs)
+                else:
+                    num_incomplete += 1
+
                 if shutdown_flag:
                     print('\nCancelling remaining tasks...', flush=True)
                     for f in futures:
@@ -340,7 +433,9 @@ def main():
                             f.cancel()
                     break
 
-                large_docs_found += process_future_results(future, large_docs_data)
+        scan_complete = (num_incomplete == 0)
+        if not scan_complete:
+            logger.error(f"{num_incomplete:,} segments were not scanned, run the same command to scan them")
 
         end_time = time.time()
         duration_str = time.strftime('%H:%M:%S', time.gmtime(end_time - start_time))
@@ -390,6 +485,10 @@ def main():
                 if large_docs_data:
                     write_to_csv(csv_filename, large_docs_data, mode='a')
 
+                # The scan is complete, the next run starts a new scan
+                if scan_complete and os.path.exists(appConfig['checkpointFile']):
+                    os.remove(appConfig['checkpointFile'])
+
             except Exception as e:
                 logger.error(f"Failed to write to CSV: {str(e)}")
             
@@ -404,6 +503,7 @@ def main():
             print("=" * 80)
         else:
             print("\nScript terminated by user")
+            print(f"Scanned segments are saved in {appConfig['checkpointFile']}, run the same command to resume")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,7 +1,10 @@
 import argparse
 import datetime as dt
 import sys
+import os
 import json
+import urllib.parse
+import bson
 import pymongo
 import time
 import lz4.block
@@ -9,47 +12,285 @@ import bz2
 import lzma
 import zstandard as zstd
 import zlib
+from concurrent.futures import ThreadPoolExecutor
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
 
 
-def createDictionary(appConfig, databaseName, collectionName, client):
-    dictionarySampleSize = appConfig['dictionarySampleSize']
-    dictionarySize = appConfig['dictionarySize']
+allCompressors = ['lz4-fast','lz4-high','lz4-fast-dict','lz4-high-dict','zstd-1','zstd-3','zstd-5','zstd-1-dict','zstd-3-dict','zstd-5-dict','bz2-1','lzma-0','zlib-1']
+dictCompressors = ['lz4-fast-dict','lz4-high-dict','zstd-1-dict','zstd-3-dict','zstd-5-dict']
+supportedCompressors = ['lz4-fast','zstd-3-dict']
+
+# collections with fewer documents are compressed without a dictionary
+minDictionaryDocs = 100
+
+# collection statistics kept with a stored sample
+collStatsFields = ['count','size','storageSize','avgObjSize','compression','nindexes','totalIndexSize']
+
+# documents are read as raw BSON, the bytes the server stores and compresses
+rawCodecOptions = CodecOptions(document_class=RawBSONDocument)
+
+
+def sampleFileName(appConfig, databaseName, collectionName, suffix):
+    # namespaces are quoted so any collection name is a valid file name
+    return os.path.join(appConfig['sampleDir'], urllib.parse.quote("{}.{}".format(databaseName,collectionName),safe='') + suffix)
+
+
+def writeSampleFile(fileName, docList):
+    # raw BSON documents back to back, the same layout as mongodump
+    with open(fileName + ".tmp", 'wb') as f:
+        for docBytes in docList:
+            f.write(docBytes)
+    os.replace(fileName + ".tmp", fileName)
+
+
+def readSampleFile(fileName, maxDocs):
+    docList = []
+    with open(fileName, 'rb') as f:
+        for thisDoc in bson.decode_file_iter(f, codec_options=rawCodecOptions):
+            if len(docList) >= maxDocs:
+                break
+            docList.append(thisDoc.raw)
+    return docList
+
+
+def loadSample(appConfig, databaseName, collectionName):
+    # returns the stored sample of a collection, None if there isn't one, it is smaller than requested, or it is too old
+    metaFileName = sampleFileName(appConfig, databaseName, collectionName, '.json')
+    if not os.path.isfile(metaFileName):
+        return None
+
+    with open(metaFileName, 'r') as f:
+        sampleMeta = json.load(f)
+
+    if (sampleMeta['sampleSize'] < appConfig['sampleSize']) or (sampleMeta['dictionarySampleSize'] < appConfig['dictionarySampleSize']):
+        return None
+
+    sampleAgeHours = (dt.datetime.now(dt.timezone.utc) - dt.datetime.fromisoformat(sampleMeta['sampledAt'])).total_seconds() / 3600
+    if (appConfig.get('sampleMaxAgeHours') is not None) and (sampleAgeHours > appConfig['sampleMaxAgeHours']):
+        print("stored sample for collection {}.{} is {:.1f} hours old, sampling again".format(databaseName,collectionName,sampleAgeHours))
+        return None
+
+    # $sample returns documents in random order, so the first documents of a larger sample are a sample themselves
+    collectionSample = {'collStats':sampleMeta['collStats'], 'exceptions':0, 'sampleAgeHours':sampleAgeHours}
+    collectionSample['sampleDocs'] = readSampleFile(sampleFileName(appConfig, databaseName, collectionName, '.bson'), appConfig['sampleSize'])
+    collectionSample['dictDocs'] = readSampleFile(sampleFileName(appConfig, databaseName, collectionName, '.dict.bson'), appConfig['dictionarySampleSize'])
+
+    return collectionSample
+
+
+def saveSample(appConfig, databaseName, collectionName, collectionSample):
+    # metadata is written last, a sample without it is incomplete and is not used
+    writeSampleFile(sampleFileName(appConfig, databaseName, collectionName, '.bson'), collectionSample['sampleDocs'])
+    writeSampleFile(sampleFileName(appConfig, databaseName, collectionName, '.dict.bson'), collectionSample['dictDocs'])
+
+    sampleMeta = {}
+    sampleMeta['sampledAt'] = dt.datetime.now(dt.timezone.utc).isoformat()
+    sampleMeta['sampleSize'] = appConfig['sampleSize']
+    sampleMeta['dictionarySampleSize'] = appConfig['dictionarySampleSize']
+    sampleMeta['collStats'] = collectionSample['collStats']
+
+    metaFileName = sampleFileName(appConfig, databaseName, collectionName, '.json')
+    with open(metaFileName + ".tmp", 'w') as f:
+        json.dump(sampleMeta, f)
+    os.replace(metaFileName + ".tmp", metaFileName)
 
-    col = client[databaseName][collectionName]
 
-    print("creating dictionary for {}.{} of {:d} bytes using {:d} samples".format(databaseName,collectionName,dictionarySize,dictionarySampleSize))
-    dictTrainingDocs = []
-    dictSampleDocs = col.aggregate([{"$sample":{"size":dictionarySampleSize}}])
-    for thisDoc in dictSampleDocs:
-        docAsString = json.dumps(thisDoc,default=str)
-        docAsBytes = str.encode(docAsString)
-        dictTrainingDocs.append(docAsBytes)
+def sampleDocuments(client, databaseName, collectionName, sampleSize):
+    col = client[databaseName].get_collection(collectionName,codec_options=rawCodecOptions)
+
+    docList = []
+    for thisDoc in col.aggregate([{"$sample":{"size":sampleSize}}]):
+        docList.append(thisDoc.raw)
+    return docList
+
+
+def sampleCollection(appConfig, client, databaseName, collectionName, needDictionary):
+    # collection stats plus the documents to compress and to train a dictionary on, read from the sample directory when possible
+    if appConfig.get('sampleDir') is not None:
+        collectionSample = loadSample(appConfig, databaseName, collectionName)
+        if collectionSample is not None:
+            print("using stored sample for collection {}.{} taken {:.1f} hours ago".format(databaseName,collectionName,collectionSample['sampleAgeHours']))
+            return collectionSample
+
+    # get the collection stats
+    print("sampling collection {}.{}".format(databaseName,collectionName))
+    collStats = client[databaseName].command("collStats",collectionName)
+
+    collectionSample = {'collStats':{}, 'sampleDocs':[], 'dictDocs':[], 'exceptions':0}
+    for thisField in collStatsFields:
+        if thisField in collStats:
+            collectionSample['collStats'][thisField] = collStats[thisField]
+
+    # collections with no documents are not sampled
+    if collStats['count'] > 0:
+        try:
+            # dictionary documents are always kept in the sample directory so any compressor can use them later
+            if (needDictionary or (appConfig.get('sampleDir') is not None)) and (collStats['count'] >= minDictionaryDocs):
+                collectionSample['dictDocs'] = sampleDocuments(client, databaseName, collectionName, appConfig['dictionarySampleSize'])
+            collectionSample['sampleDocs'] = sampleDocuments(client, databaseName, collectionName, appConfig['sampleSize'])
+        except:
+            collectionSample['exceptions'] += 1
+
+    # a failed sample is not stored so the next run tries again
+    if (appConfig.get('sampleDir') is not None) and (collectionSample['exceptions'] == 0):
+        saveSample(appConfig, databaseName, collectionName, collectionSample)
+
+    return collectionSample
+
+
+def createDictionary(appConfig, databaseName, collectionName, dictTrainingDocs):
+    dictionarySize = appConfig['dictionarySize']
+
+    print("creating dictionary for {}.{} of {:d} bytes using {:d} samples".format(databaseName,collectionName,dictionarySize,len(dictTrainingDocs)))
     dict_data = zstd.train_dictionary(dictionarySize,dictTrainingDocs)
 
     return dict_data
 
 
-def getData(appConfig):
-    print('connecting to server')
-    client = pymongo.MongoClient(host=appConfig['uri'],appname='comprevw')
+def getCompressFunction(compressor, zstdDict):
+    # returns a function compressing bytes, dictionary compressors fall back to no dictionary when zstdDict is None
+    if compressor == 'lz4-fast' or (compressor == 'lz4-fast-dict' and zstdDict is None):
+        return lambda docBytes: lz4.block.compress(docBytes,mode='fast',acceleration=1)
+    elif compressor == 'lz4-high' or (compressor == 'lz4-high-dict' and zstdDict is None):
+        return lambda docBytes: lz4.block.compress(docBytes,mode='high_compression',compression=1)
+    elif compressor == 'lz4-fast-dict':
+        dictBytes = zstdDict.as_bytes()
+        return lambda docBytes: lz4.block.compress(docBytes,mode='fast',acceleration=1,dict=dictBytes)
+    elif compressor == 'lz4-high-dict':
+        dictBytes = zstdDict.as_bytes()
+        return lambda docBytes: lz4.block.compress(docBytes,mode='high_compression',compression=1,dict=dictBytes)
+    elif compressor in ['zstd-1','zstd-3','zstd-5','zstd-1-dict','zstd-3-dict','zstd-5-dict']:
+        # instantiate the compressor for zstandard (it doesn't support 1-shot compress), one per collection as they are not thread safe
+        zstdLevel = int(compressor.split('-')[1])
+        if compressor.endswith('-dict'):
+            zstdCompressor = zstd.ZstdCompressor(level=zstdLevel,dict_data=zstdDict)
+        else:
+            zstdCompressor = zstd.ZstdCompressor(level=zstdLevel,dict_data=None)
+        return zstdCompressor.compress
+    elif compressor == 'bz2-1':
+        return lambda docBytes: bz2.compress(docBytes,compresslevel=1)
+    elif compressor == 'lzma-0':
+        return lambda docBytes: lzma.compress(docBytes,format=lzma.FORMAT_XZ,preset=0)
+    elif compressor == 'zlib-1':
+        return lambda docBytes: zlib.compress(docBytes,level=1)
+    else:
+        print('Unknown compressor | {}'.format(compressor))
+        sys.exit(1)
 
-    compressor = appConfig['compressor']
-    sampleSize = appConfig['sampleSize']
 
-    # log output to file
-    logTimeStamp = dt.datetime.now(dt.timezone.utc).strftime('%Y%m%d%H%M%S')
-    logFileName = "{}-{}-{}-compression-review.csv".format(appConfig['serverAlias'],compressor,logTimeStamp)
-    logFileHandle = open(logFileName, "w")
+def analyzeCollection(appConfig, client, compressors, thisDbName, thisCollName):
+    # samples the collection once and compresses the sample with every compressor, returns None for collections with no documents
+    collectionSample = sampleCollection(appConfig, client, thisDbName, thisCollName, any(thisCompressor in dictCompressors for thisCompressor in compressors))
+    collStats = collectionSample['collStats']
+
+    if collStats['count'] == 0:
+        # exclude collections with no documents
+        return None
+
+    print("analyzing collection {}.{}".format(thisDbName,thisCollName))
+
+    numExceptions = collectionSample['exceptions']
+    sampleDocs = collectionSample['sampleDocs']
 
-    # output miscellaneos parameters to csv
-    logFileHandle.write("{},{},{},{}\n".format('compressor','docsSampled','dictDocsSampled','dictBytes'))
-    logFileHandle.write("{},{:d},{:d},{:d}\n".format(compressor,sampleSize,appConfig['dictionarySampleSize'],appConfig['dictionarySize']))
-    logFileHandle.write("\n")
+    try:
+        # build the dictionary once if needed (and there are enough documents), it is shared by all dictionary compressors
+        zstdDict = None
+        if any(thisCompressor in dictCompressors for thisCompressor in compressors) and collStats['count'] >= minDictionaryDocs:
+            zstdDict = createDictionary(appConfig, thisDbName, thisCollName, collectionSample['dictDocs'])
+
+        compressFunctions = {}
+        for thisCompressor in compressors:
+            compressFunctions[thisCompressor] = getCompressFunction(thisCompressor, zstdDict)
+
+    except:
+        numExceptions += 1
+        compressFunctions = {}
+
+    collectionResult = {'dbName':thisDbName, 'collName':thisCollName, 'collStats':collStats, 'compressors':{}}
+
+    totDocs = len(sampleDocs)
+    if (totDocs == 0):
+        collectionResult['avgSample'] = 0
+        collectionResult['minSample'] = 0
+        collectionResult['maxSample'] = 0
+    else:
+        docSizes = [len(docBytes) for docBytes in sampleDocs]
+        collectionResult['avgSample'] = int(sum(docSizes) / totDocs)
+        collectionResult['minSample'] = min(docSizes)
+        collectionResult['maxSample'] = max(docSizes)
+
+    for thisCompressor in compressors:
+        compExceptions = numExceptions
+        minCompBytes = 999999999
+        maxCompBytes = 0
+        totCompBytes = 0
+        totTimeNs = 0
+
+        if thisCompressor in compressFunctions:
+            compressFunction = compressFunctions[thisCompressor]
+            try:
+                for docBytes in sampleDocs:
+                    startTimeNs = time.time_ns()
+
+                    # compress it
+                    compressed = compressFunction(docBytes)
+
+                    totTimeNs += time.time_ns() - startTimeNs
+
+                    compBytes = len(compressed)
+                    totCompBytes += compBytes
+                    if (compBytes < minCompBytes):
+                        minCompBytes = compBytes
+                    if (compBytes > maxCompBytes):
+                        maxCompBytes = compBytes
+
+            except:
+                compExceptions += 1
+
+        if (totDocs == 0) or (totCompBytes == 0):
+            avgCompBytes = 0
+            minCompBytes = 0
+            maxCompBytes = 0
+            compRatio = 0.0
+        else:
+            avgCompBytes = int(totCompBytes / totDocs)
+            compRatio = int(collStats.get('avgObjSize',0)) / avgCompBytes
+
+        collectionResult['compressors'][thisCompressor] = {'minComp':minCompBytes, 'maxComp':maxCompBytes, 'avgComp':avgCompBytes, 'projectedCompRatio':compRatio, 'exceptions':compExceptions, 'compTimeMs':totTimeNs/1000000}
+
+    return collectionResult
+
+
+def csvRow(collectionResult, compressor):
+    collStats = collectionResult['collStats']
+    compResult = collectionResult['compressors'][compressor]
+
+    collectionCompressionRatio = collStats['size'] / collStats['storageSize']
+    gbDivisor = 1024*1024*1024
+    collectionCount = collStats['count']
+    collectionAvgObjSize = int(collStats.get('avgObjSize',0))
+    collectionSizeGB = collStats['size']/gbDivisor
+    collectionStorageSizeGB = collStats['storageSize']/gbDivisor
+    # check if compression is enabled
+    compressionInfo = collStats.get('compression',{'enable':False,'threshold':-1})
+    compressionEnabled = compressionInfo.get('enable',False)
+    compressionThreshold = compressionInfo.get('threshold',0)
+    if compressionEnabled:
+        #compressionEnabledString = 'Y'
+        compCsvString = "{}/{}".format('Y',compressionThreshold)
+    else:
+        #compressionEnabledString = 'N'
+        compCsvString = ""
 
-    # output header to csv
-    logFileHandle.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format('dbName','collName','numDocs','avgDocSize','sizeGB','storageGB','existingCompRatio','compEnabled','minSample','maxSample','avgSample','minComp','maxComp','avgComp','projectedCompRatio','exceptions','compTime(ms)'))
+    return "{},{},{:d},{:d},{:.4f},{:.4f},{:.4f},{},{:d},{:d},{:d},{:d},{:d},{:d},{:.4f},{:d},{:.4f}\n".format(collectionResult['dbName'],collectionResult['collName'],collectionCount,
+        collectionAvgObjSize,collectionSizeGB,collectionStorageSizeGB,collectionCompressionRatio,compCsvString,collectionResult['minSample'],collectionResult['maxSample'],collectionResult['avgSample'],
+        compResult['minComp'],compResult['maxComp'],compResult['avgComp'],compResult['projectedCompRatio'],compResult['exceptions'],compResult['compTimeMs'])
 
+
+def getCollections(client):
     # get databases - filter out admin, config, local, and system
+    collectionList = []
     dbSkipList = ['admin','config','local','system']
     try:
         dbDict = client.admin.command("listDatabases",nameOnly=True,filter={"name":{"$nin":dbSkipList}})['databases']
@@ -70,140 +311,74 @@ def getData(appConfig):
                 # exclude certain collections
                 pass
             else:
-                # get the collection stats
-                print("analyzing collection {}.{}".format(thisDbName,thisCollName))
-                collStats = client[thisDbName].command("collStats",thisCollName)
-
-                if collStats['count'] == 0:
-                    # exclude collections with no documents
-                    continue
-
-                collectionCompressionRatio = collStats['size'] / collStats['storageSize']
-                gbDivisor = 1024*1024*1024
-                collectionCount = collStats['count']
-                collectionAvgObjSize = int(collStats.get('avgObjSize',0))
-                collectionSizeGB = collStats['size']/gbDivisor
-                collectionStorageSizeGB = collStats['storageSize']/gbDivisor
-                # check if compression is enabled
-                compressionInfo = collStats.get('compression',{'enable':False,'threshold':-1})
-                compressionEnabled = compressionInfo.get('enable',False)
-                compressionThreshold = compressionInfo.get('threshold',0)
-                if compressionEnabled:
-                    #compressionEnabledString = 'Y'
-                    compCsvString = "{}/{}".format('Y',compressionThreshold)
-                else:
-                    #compressionEnabledString = 'N'
-                    compCsvString = ""
-
-
-                numExceptions = 0
-                minDocBytes = 999999999
-                maxDocBytes = 0
-                totDocs = 0
-                totDocBytes = 0
-                minLz4Bytes = 999999999
-                maxLz4Bytes = 0
-                totLz4Bytes = 0
-                totTimeMs = 0
-                totTimeNs = 0
-
-                # build the dictionary if needed (and there are enough documents)
-                if compressor in ['lz4-fast-dict','lz4-high-dict','zstd-1-dict','zstd-3-dict','zstd-5-dict']:
-                    if collectionCount >= 100:
-                        zstdDict = createDictionary(appConfig, thisDbName, thisCollName, client)
-
-                # instantiate the compressor for zstandard (it doesn't support 1-shot compress)
-                if compressor == 'zstd-1' or (compressor == 'zstd-1-dict' and collectionCount < 100):
-                    zstdCompressor = zstd.ZstdCompressor(level=1,dict_data=None)
-                elif compressor == 'zstd-3' or (compressor == 'zstd-3-dict' and collectionCount < 100):
-                    zstdCompressor = zstd.ZstdCompressor(level=3,dict_data=None)
-                elif compressor == 'zstd-5' or (compressor == 'zstd-5-dict' and collectionCount < 100):
-                    zstdCompressor = zstd.ZstdCompressor(level=5,dict_data=None)
-                elif compressor == 'zstd-1-dict':
-                    zstdCompressor = zstd.ZstdCompressor(level=1,dict_data=zstdDict)
-                elif compressor == 'zstd-3-dict':
-                    zstdCompressor = zstd.ZstdCompressor(level=3,dict_data=zstdDict)
-                elif compressor == 'zstd-5-dict':
-                    zstdCompressor = zstd.ZstdCompressor(level=5,dict_data=zstdDict)
-
-                try:
-                    sampleDocs = client[thisDbName][thisCollName].aggregate([{"$sample":{"size":sampleSize}}])
-                    for thisDoc in sampleDocs:
-                        totDocs += 1
-                        docAsString = json.dumps(thisDoc,default=str)
-                        docBytes = len(docAsString)
-                        totDocBytes += docBytes
-                        if (docBytes < minDocBytes):
-                            minDocBytes = docBytes
-                        if (docBytes > maxDocBytes):
-                            maxDocBytes = docBytes
-
-                        startTimeMs = time.time()
-                        startTimeNs = time.time_ns()
-
-                        # compress it
-                        if compressor == 'lz4-fast' or (compressor == 'lz4-fast-dict' and collectionCount < 100):
-                            compressed = lz4.block.compress(docAsString.encode(),mode='fast',acceleration=1)
-                        elif compressor == 'lz4-high' or (compressor == 'lz4-high-dict' and collectionCount < 100):
-                            compressed = lz4.block.compress(docAsString.encode(),mode='high_compression',compression=1)
-                        elif compressor == 'lz4-fast-dict':
-                            compressed = lz4.block.compress(docAsString.encode(),mode='fast',acceleration=1,dict=zstdDict.as_bytes())
-                        elif compressor == 'lz4-high-dict':
-                            compressed = lz4.block.compress(docAsString.encode(),mode='high_compression',compression=1,dict=zstdDict.as_bytes())
-                        elif compressor in ['zstd-1','zstd-3','zstd-5','zstd-1-dict','zstd-3-dict','zstd-5-dict']:
-                            compressed = zstdCompressor.compress(docAsString.encode())
-                        elif compressor == 'bz2-1':
-                            compressed = bz2.compress(docAsString.encode(),compresslevel=1)
-                        elif compressor == 'lzma-0':
-                            compressed = lzma.compress(docAsString.encode(),format=lzma.FORMAT_XZ,preset=0)
-                        elif compressor == 'zlib-1':
-                            compressed = zlib.compress(docAsString.encode(),level=1)
-                        else:
-                            print('Unknown compressor | {}'.format('compressor'))
-                            sys.exit(1)
-
-                        totTimeMs += time.time() - startTimeMs
-                        totTimeNs += time.time_ns() - startTimeNs
-
-                        lz4Bytes = len(compressed)
-                        totLz4Bytes += lz4Bytes
-                        if (lz4Bytes < minLz4Bytes):
-                            minLz4Bytes = lz4Bytes
-                        if (lz4Bytes > maxLz4Bytes):
-                            maxLz4Bytes = lz4Bytes
-
-                except:
-                    numExceptions += 1
-
-                if (totDocs == 0):
-                    avgDocBytes = 0
-                    minDocBytes = 0
-                    maxDocBytes = 0
-                    avgLz4Bytes = 0
-                    minLz4Bytes = 0
-                    maxLz4Bytes = 0
-                    lz4Ratio = 0.0
-                else:
-                    avgDocBytes = int(totDocBytes / totDocs)
-                    avgLz4Bytes = int(totLz4Bytes / totDocs)
-                    lz4Ratio = collectionAvgObjSize / avgLz4Bytes
-
-                logFileHandle.write("{},{},{:d},{:d},{:.4f},{:.4f},{:.4f},{},{:d},{:d},{:d},{:d},{:d},{:d},{:.4f},{:d},{:.4f}\n".format(thisDb['name'],thisColl['name'],collectionCount,
-                    collectionAvgObjSize,collectionSizeGB,collectionStorageSizeGB,collectionCompressionRatio,compCsvString,minDocBytes,maxDocBytes,avgDocBytes,minLz4Bytes,maxLz4Bytes,avgLz4Bytes,lz4Ratio,numExceptions,totTimeNs/1000000))
-
-
-    logFileHandle.close() 
-    client.close()
-    
-    
+                collectionList.append((thisDbName,thisCollName))
+    return collectionList
+
+
+def analyzeCollections(appConfig):
+    # yields the result of each non-empty collection in collection order, used by getData and by other tools in-process
+    print('connecting to server')
+    client = pymongo.MongoClient(host=appConfig['uri'],appname='comprevw')
+
+    # a single compressor or a list of compressors, every compressor is evaluated against the same sample
+    compressors = appConfig['compressor']
+    if isinstance(compressors, str):
+        compressors = [compressors]
+    numThreads = appConfig.get('numThreads',1)
+
+    if appConfig.get('sampleDir') is not None:
+        os.makedirs(appConfig['sampleDir'], exist_ok=True)
+
+    try:
+        collectionList = getCollections(client)
+
+        # collections are analyzed concurrently
+        with ThreadPoolExecutor(max_workers=numThreads) as executor:
+            for collectionResult in executor.map(lambda thisNs: analyzeCollection(appConfig, client, compressors, thisNs[0], thisNs[1]), collectionList):
+                if collectionResult is not None:
+                    yield collectionResult
+    finally:
+        client.close()
+
+
+def getData(appConfig):
+    compressors = appConfig['compressor']
+    if isinstance(compressors, str):
+        compressors = [compressors]
+    sampleSize = appConfig['sampleSize']
+
+    # log output to file, one per compressor
+    logTimeStamp = dt.datetime.now(dt.timezone.utc).strftime('%Y%m%d%H%M%S')
+    logFileHandles = {}
+    for compressor in compressors:
+        logFileName = "{}-{}-{}-compression-review.csv".format(appConfig['serverAlias'],compressor,logTimeStamp)
+        logFileHandle = open(logFileName, "w")
+        logFileHandles[compressor] = logFileHandle
+
+        # output miscellaneos parameters to csv
+        logFileHandle.write("{},{},{},{}\n".format('compressor','docsSampled','dictDocsSampled','dictBytes'))
+        logFileHandle.write("{},{:d},{:d},{:d}\n".format(compressor,sampleSize,appConfig['dictionarySampleSize'],appConfig['dictionarySize']))
+        logFileHandle.write("\n")
+
+        # output header to csv
+        logFileHandle.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format('dbName','collName','numDocs','avgDocSize','sizeGB','storageGB','existingCompRatio','compEnabled','minSample','maxSample','avgSample','minComp','maxComp','avgComp','projectedCompRatio','exceptions','compTime(ms)'))
+
+    for collectionResult in analyzeCollections(appConfig):
+        for compressor in compressors:
+            logFileHandles[compressor].write(csvRow(collectionResult, compressor))
+
+    for logFileHandle in logFileHandles.values():
+        logFileHandle.close()
+
+
 def main():
     parser = argparse.ArgumentParser(description='Check compressibility of collections')
-        
+
     parser.add_argument('--skip-python-version-check',
                         required=False,
                         action='store_true',
                         help='Permit execution on Python 3.6 and prior')
-    
+
     parser.add_argument('--uri',
                         required=True,
                         type=str,
@@ -222,24 +397,41 @@ def main():
 
     parser.add_argument('--compressor',
                         required=False,
-                        choices=['lz4-fast','lz4-high','lz4-fast-dict','lz4-high-dict','zstd-1','zstd-3','zstd-5','zstd-1-dict','zstd-3-dict','zstd-5-dict','bz2-1','lzma-0','zlib-1'],
+                        nargs='+',
+                        choices=allCompressors,
                         type=str,
-                        help='Compressor')
-    
+                        help='One or more compressors, each is evaluated against the same sample')
+
     parser.add_argument('--dictionary-sample-size',
                         required=False,
                         type=int,
                         default=100,
                         help='Number of documents to sample for dictionary creation')
-    
+
     parser.add_argument('--dictionary-size',
                         required=False,
                         type=int,
                         default=4096,
                         help='Size of dictionary (bytes)')
 
+    parser.add_argument('--threads',
+                        required=False,
+                        type=int,
+                        default=8,
+                        help='Number of collections to analyze concurrently, default 8')
+
+    parser.add_argument('--sample-dir',
+                        required=False,
+                        type=str,
+                        help='Directory to store sampled documents in, later runs reuse the stored samples instead of sampling again')
+
+    parser.add_argument('--sample-max-age-hours',
+                        required=False,
+                        type=float,
+                        help='Sample collections again when their stored sample is older than this many hours, default is to always reuse stored samples')
+
     args = parser.parse_args()
-    
+
     # check for minimum Python version
     MIN_PYTHON = (3, 7)
     if (not args.skip_python_version_check) and (sys.version_info < MIN_PYTHON):
@@ -252,16 +444,18 @@ def main():
     appConfig['compressor'] = args.compressor
     appConfig['dictionarySampleSize'] = int(args.dictionary_sample_size)
     appConfig['dictionarySize'] = int(args.dictionary_size)
-
-    supportedCompressors=['lz4-fast','zstd-3-dict']
+    appConfig['numThreads'] = int(args.threads)
+    appConfig['sampleDir'] = args.sample_dir
+    appConfig['sampleMaxAgeHours'] = args.sample_max_age_hours
 
     if appConfig['compressor'] is None:
         # execute for each supported compression algorithm
-        for thisCompressor in supportedCompressors:
-            appConfig['compressor'] = thisCompressor
-            getData(appConfig)
-    else:
-        getData(appConfig)
+        appConfig['compressor'] = supportedCompressors
+
+    # remove duplicates, keeping the order requested
+    appConfig['compressor'] = list(dict.fromkeys(appConfig['compressor']))
+
+    getData(appConfig)
 
 
 if __name__ == "__main__":
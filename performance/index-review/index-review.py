@@ -5,7 +5,9 @@ import json
 import pymongo
 import time
 import os
+import bisect
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 
 def ensureDirect(uri,appname):
@@ -48,12 +50,13 @@ def getData(appConfig):
     print('connecting to server')
     client = pymongo.MongoClient(**ensureDirect(appConfig['connectionString'],'indxrev'))
 
-    serverOpCounters = client.admin.command("serverStatus")['opcounters']
-    serverMetricsDocument = client.admin.command("serverStatus")['metrics']['document']
-    serverUptime = client.admin.command("serverStatus")['uptime']
-    serverHost = client.admin.command("serverStatus")['host']
-    serverLocalTime = client.admin.command("serverStatus")['localTime']
-    collectionStats = getCollectionStats(client)
+    serverStatus = client.admin.command("serverStatus")
+    serverOpCounters = serverStatus['opcounters']
+    serverMetricsDocument = serverStatus['metrics']['document']
+    serverUptime = serverStatus['uptime']
+    serverHost = serverStatus['host']
+    serverLocalTime = serverStatus['localTime']
+    collectionStats = getCollectionStats(client, appConfig)
 
     client.close()
 
@@ -77,45 +80,75 @@ def getData(appConfig):
     return logFileName
 
 
-def getCollectionStats(client):
+def getCollectionNames(client, dbName):
+    returnList = []
+    collCursor = client[dbName].list_collections()
+    for thisColl in collCursor:
+        #print(thisColl)
+        if thisColl.get('type','NOT-FOUND') == 'view':
+            # exclude views
+            pass
+        elif thisColl['name'] in ['system.profile']:
+            # exclude certain collections
+            pass
+        else:
+            returnList.append(thisColl['name'])
+    return returnList
+
+
+def getCollectionInfo(client, appConfig, dbName, collName):
+    # collection stats and index info for a single collection, None if a command exceeds the timeout
+    print("{}.{}".format(dbName,collName))
+    try:
+        #collStats = client[dbName].command("collstats",collName)['wiredTiger']['cursor']
+        collStats = client[dbName].command("collStats",collName,maxTimeMS=appConfig['commandTimeoutMs'])
+
+        # get index info
+        indexInfo = list(client[dbName][collName].aggregate([{"$indexStats":{}}],maxTimeMS=appConfig['commandTimeoutMs']))
+    except pymongo.errors.ExecutionTimeout:
+        print("  skipping collection {}.{} | exceeded command timeout of {} ms".format(dbName,collName,appConfig['commandTimeoutMs']))
+        return None
+
+    # put keys into a proper list to maintain order
+    for thisIndex in indexInfo:
+        keyAsList = []
+        keyAsString = ""
+        for thisKey in thisIndex['key']:
+            keyAsList.append([thisKey,thisIndex['key'][thisKey]])
+            keyAsString += "{}||{}||".format(thisKey,thisIndex['key'][thisKey])
+        thisIndex['keyAsList'] = keyAsList.copy()
+        thisIndex['keyAsString'] = keyAsString
+
+    collStats['indexInfo'] = indexInfo
+    return collStats
+
+
+def getCollectionStats(client, appConfig):
     returnDict = OrderedDict()
+    numSkipped = 0
     
     # get databases - filter out admin, config, local, and system
     dbDict = client.admin.command("listDatabases",nameOnly=True,filter={"name":{"$nin":['admin','config','local','system']}})['databases']
-    for thisDb in dbDict:
-        #print(thisDb)
-        collCursor = client[thisDb['name']].list_collections()
-        for thisColl in collCursor:
-            #print(thisColl)
-            if thisColl.get('type','NOT-FOUND') == 'view':
-                # exclude views
-                pass
-            elif thisColl['name'] in ['system.profile']:
-                # exclude certain collections
-                pass
-            else:
-                #collStats = client[thisDb['name']].command("collstats",thisColl['name'])['wiredTiger']['cursor']
-                print("{}.{}".format(thisDb['name'],thisColl['name']))
-                collStats = client[thisDb['name']].command("collStats",thisColl['name'])
-                if thisDb['name'] not in returnDict:
-                    returnDict[thisDb['name']] = {}
-                returnDict[thisDb['name']][thisColl['name']] = collStats.copy()
-                
-                # get index info
-                indexInfo = list(client[thisDb['name']][thisColl['name']].aggregate([{"$indexStats":{}}]))
-                
-                # put keys into a proper list to maintain order
-                for thisIndex in indexInfo:
-                    keyAsList = []
-                    keyAsString = ""
-                    for thisKey in thisIndex['key']:
-                        keyAsList.append([thisKey,thisIndex['key'][thisKey]])
-                        keyAsString += "{}||{}||".format(thisKey,thisIndex['key'][thisKey])
-                    thisIndex['keyAsList'] = keyAsList.copy()
-                    thisIndex['keyAsString'] = keyAsString
-                    
-                returnDict[thisDb['name']][thisColl['name']]['indexInfo'] = indexInfo.copy()
-    
+    dbNameList = [thisDb['name'] for thisDb in dbDict]
+
+    # collections are read concurrently over the shared client, results are added in database and collection order
+    with ThreadPoolExecutor(max_workers=appConfig['numThreads']) as executor:
+        nsList = []
+        for dbName, collNameList in zip(dbNameList, executor.map(lambda dbName: getCollectionNames(client, dbName), dbNameList)):
+            for collName in collNameList:
+                nsList.append((dbName,collName))
+
+        for (dbName, collName), collStats in zip(nsList, executor.map(lambda thisNs: getCollectionInfo(client, appConfig, thisNs[0], thisNs[1]), nsList)):
+            if collStats is None:
+                numSkipped += 1
+                continue
+            if dbName not in returnDict:
+                returnDict[dbName] = {}
+            returnDict[dbName][collName] = collStats
+
+    if numSkipped > 0:
+        print("WARNING | {} collection(s) skipped due to command timeouts, increase --command-timeout-ms to include them".format(numSkipped))
+
     return returnDict
     
     
@@ -124,14 +157,14 @@ def evalIndexes(appConfig):
     with open(appConfig['files'][0], 'r') as index_file:
         idxDict = json.load(index_file, object_pairs_hook=OrderedDict)
 
-    # load additional files
-    addlIdxDictList = []
-    addlIdxCount = 0
+    # load additional files, only the index usage is needed so each is reduced to its operation counts once loaded
+    addlOpsDict = {}
+    addlNsDict = {}
+    numAddlFiles = len(appConfig['files']) - 1
     for filePtr in range(1,len(appConfig['files'])):
         print("  loading additional file {}".format(appConfig['files'][filePtr]))
         with open(appConfig['files'][filePtr], 'r') as index_file:
-            addlIdxDictList.append(json.load(index_file, object_pairs_hook=OrderedDict))
-            addlIdxCount += 1
+            addIndexOps(addlOpsDict, addlNsDict, json.load(index_file, object_pairs_hook=OrderedDict))
 
     outFile1 = open(appConfig['serverAlias']+'-collections.csv','wt')
 
@@ -173,6 +206,9 @@ def evalIndexes(appConfig):
 
     outFile1.write("{},{},{},{},{},{},{},{},{},{},{},{},{},{},{}\n".format('database','collection','doc-count','average-doc-size','size-GB','storageSize-GB','coll-unused-pct','num-indexes','indexSize-GB','ins/day','upd/day','del/day','ins/sec','upd/sec','del/sec'))
 
+    # collections missing from the prior index-review file have no churn calculated
+    numMissingPrior = 0
+
     # for each database
     for thisDb in idxDict["start"]["collstats"]:
         print("  database {}".format(thisDb))
@@ -181,9 +217,17 @@ def evalIndexes(appConfig):
         for thisColl in idxDict["start"]["collstats"][thisDb]:
             printedCollection = False
             thisCollInfo = idxDict["start"]["collstats"][thisDb][thisColl]
+            sortedIndexKeys = getSortedIndexKeys(thisCollInfo["indexInfo"])
             bToGb = 1024*1024*1024
             collectionUnusedPct = thisCollInfo.get('unusedStorageSize', {}).get('unusedPercent', -1.0)
 
+            # servers whose file does not include this collection (skipped for a timeout or not yet replicated), index usage there is unknown
+            numMissingServers = numAddlFiles - addlNsDict.get((thisDb,thisColl),0)
+            if numMissingServers > 0:
+                printedCollection = True
+                print("    collection {}".format(thisColl))
+                print("        WARNING | not found in {} of {} additional file(s), index usage on those servers is unknown".format(numMissingServers,numAddlFiles))
+
             if appConfig['opsFile'] is not None:
                 # calculate churn from oplog/changestream data
                 thisNs = "{}.{}".format(thisDb,thisColl)
@@ -197,22 +241,33 @@ def evalIndexes(appConfig):
 
             elif appConfig['priorIndexReviewFile'] is not None:
                 # calculate churn from prior primary instance index-review file
-                try:
-                    numSecondsUptime = idxDict["start"]["uptime"] - appConfig['priorDict']['start']['uptime']
-                    numDaysUptime = numSecondsUptime / 86400
-                    insPerDay = int((thisCollInfo['opCounter']['numDocsIns'] - appConfig['priorDict']['start']['collstats'][thisDb][thisColl]['opCounter']['numDocsIns']) / numDaysUptime)
-                    updPerDay = int((thisCollInfo['opCounter']['numDocsUpd'] - appConfig['priorDict']['start']['collstats'][thisDb][thisColl]['opCounter']['numDocsUpd']) / numDaysUptime)
-                    delPerDay = int((thisCollInfo['opCounter']['numDocsDel'] - appConfig['priorDict']['start']['collstats'][thisDb][thisColl]['opCounter']['numDocsDel']) / numDaysUptime)
-                    insPerSec = int((thisCollInfo['opCounter']['numDocsIns'] - appConfig['priorDict']['start']['collstats'][thisDb][thisColl]['opCounter']['numDocsIns']) / numSecondsUptime)
-                    updPerSec = int((thisCollInfo['opCounter']['numDocsUpd'] - appConfig['priorDict']['start']['collstats'][thisDb][thisColl]['opCounter']['numDocsUpd']) / numSecondsUptime)
-                    delPerSec = int((thisCollInfo['opCounter']['numDocsDel'] - appConfig['priorDict']['start']['collstats'][thisDb][thisColl]['opCounter']['numDocsDel']) / numSecondsUptime)
-                except:
-                    insPerDay = 0
-                    updPerDay = 0
-                    delPerDay = 0
-                    insPerSec = 0
-                    updPerSec = 0
-                    delPerSec = 0
+                priorCollInfo = appConfig['priorDict']['start']['collstats'].get(thisDb,{}).get(thisColl)
+                if priorCollInfo is None:
+                    # collection was skipped or did not exist when the prior file was created, churn is unknown
+                    numMissingPrior += 1
+                    insPerDay = ''
+                    updPerDay = ''
+                    delPerDay = ''
+                    insPerSec = ''
+                    updPerSec = ''
+                    delPerSec = ''
+                else:
+                    try:
+                        numSecondsUptime = idxDict["start"]["uptime"] - appConfig['priorDict']['start']['uptime']
+                        numDaysUptime = numSecondsUptime / 86400
+                        insPerDay = int((thisCollInfo['opCounter']['numDocsIns'] - priorCollInfo['opCounter']['numDocsIns']) / numDaysUptime)
+                        updPerDay = int((thisCollInfo['opCounter']['numDocsUpd'] - priorCollInfo['opCounter']['numDocsUpd']) / numDaysUptime)
+                        delPerDay = int((thisCollInfo['opCounter']['numDocsDel'] - priorCollInfo['opCounter']['numDocsDel']) / numDaysUptime)
+                        insPerSec = int((thisCollInfo['opCounter']['numDocsIns'] - priorCollInfo['opCounter']['numDocsIns']) / numSecondsUptime)
+                        updPerSec = int((thisCollInfo['opCounter']['numDocsUpd'] - priorCollInfo['opCounter']['numDocsUpd']) / numSecondsUptime)
+                        delPerSec = int((thisCollInfo['opCounter']['numDocsDel'] - priorCollInfo['opCounter']['numDocsDel']) / numSecondsUptime)
+                    except:
+                        insPerDay = 0
+                        updPerDay = 0
+                        delPerDay = 0
+                        insPerSec = 0
+                        updPerSec = 0
+                        delPerSec = 0
 
             else:
                 # calculate churn as estimate using operations since instance startup
@@ -243,22 +298,20 @@ def evalIndexes(appConfig):
                 indexUnusedPct = thisIdx.get('unusedStorageSize', {}).get('unusedSizePercent', -1.0)
 
                 # check extra servers for non-usage
-                numXtraOps = 0
-                if addlIdxCount > 0:
-                    for n in range(0,addlIdxCount):
-                        for xtraIdx in addlIdxDictList[n]["start"]["collstats"][thisDb][thisColl]["indexInfo"]:
-                            if xtraIdx["name"] == thisIdx["name"]:
-                                numXtraOps += xtraIdx["accesses"]["ops"]
+                numXtraOps = addlOpsDict.get((thisDb,thisColl,thisIdx["name"]),0)
 
                 # check index for non-usage (all servers)
                 if (thisIdx["accesses"]["ops"]+numXtraOps == 0):
                     if not printedCollection:
                         printedCollection = True
                         print("    collection {}".format(thisColl))
-                    print("        index {} | has never been used".format(thisIdx["name"]))
+                    if numMissingServers > 0:
+                        print("        index {} | has not been used on the servers reporting this collection, usage unknown on {} server(s)".format(thisIdx["name"],numMissingServers))
+                    else:
+                        print("        index {} | has never been used".format(thisIdx["name"]))
 
                 # check index for redundancy
-                redundantList = checkIfRedundant(thisIdx["name"],thisIdx["keyAsString"],idxDict["start"]["collstats"][thisDb][thisColl]["indexInfo"])
+                redundantList = checkIfRedundant(thisIdx["name"],thisIdx["keyAsString"],sortedIndexKeys)
                 isRedundant = "No"
                 if len(redundantList) > 0:
                     if not printedCollection:
@@ -278,16 +331,45 @@ def evalIndexes(appConfig):
     outFile1.close()
     outFile2.close()
 
+    if numMissingPrior > 0:
+        print("WARNING | {} collection(s) not found in the prior index review file, their churn is left blank".format(numMissingPrior))
 
-def checkIfRedundant(idxName,idxKeyAsString,indexList):
-    returnList = []
-    for thisIdx in indexList:
+
+def addIndexOps(opsDict, nsDict, idxDict):
+    # sums index operations by (database, collection, index name) so usage on other servers is a single lookup
+    # nsDict counts the files containing each (database, collection), a collection missing from a file has unknown usage there
+    for thisDb in idxDict["start"]["collstats"]:
+        for thisColl in idxDict["start"]["collstats"][thisDb]:
+            nsDict[(thisDb,thisColl)] = nsDict.get((thisDb,thisColl),0) + 1
+            for thisIdx in idxDict["start"]["collstats"][thisDb][thisColl]["indexInfo"]:
+                opsKey = (thisDb,thisColl,thisIdx["name"])
+                opsDict[opsKey] = opsDict.get(opsKey,0) + thisIdx["accesses"]["ops"]
+
+
+def getSortedIndexKeys(indexList):
+    # (keyAsString, position, name) of each index sorted by key, indexes whose keys start with the same fields are adjacent
+    sortedKeys = []
+    for idxPos, thisIdx in enumerate(indexList):
         if thisIdx["name"] in ["_id","_id_"]:
             continue
-        if thisIdx["name"] == idxName:
-            continue
-        if thisIdx["keyAsString"].startswith(idxKeyAsString):
-            returnList.append(thisIdx["name"])
+        sortedKeys.append((thisIdx["keyAsString"],idxPos,thisIdx["name"]))
+    sortedKeys.sort()
+    return sortedKeys
+
+
+def checkIfRedundant(idxName,idxKeyAsString,sortedKeys):
+    # indexes covering this one have keys starting with its key, they sort directly after it
+    coveringList = []
+    keyPtr = bisect.bisect_left(sortedKeys,(idxKeyAsString,))
+    while (keyPtr < len(sortedKeys)) and sortedKeys[keyPtr][0].startswith(idxKeyAsString):
+        if sortedKeys[keyPtr][2] != idxName:
+            coveringList.append(sortedKeys[keyPtr][1:])
+        keyPtr += 1
+
+    # report in the order the indexes were listed
+    returnList = []
+    for idxPos, thisName in sorted(coveringList):
+        returnList.append(thisName)
     return returnList
 
 
@@ -381,6 +463,18 @@ def main():
                         type=str,
                         help='File from prior run of index-review tool on primary instance, used to calculate collection level operations per day.')
 
+    parser.add_argument('--threads',
+                        required=False,
+                        type=int,
+                        default=8,
+                        help='Number of collections to gather statistics for concurrently, default 8')
+
+    parser.add_argument('--command-timeout-ms',
+                        required=False,
+                        type=int,
+                        default=60000,
+                        help='Maximum time for each collStats and $indexStats command, collections exceeding it are skipped, default 60000')
+
     args = parser.parse_args()
     
     # check for minimum Python version
@@ -399,6 +493,8 @@ def main():
     appConfig['serverAlias'] = args.server_alias
     appConfig['opsFile'] = args.ops_file
     appConfig['priorIndexReviewFile'] = args.prior_index_review_file
+    appConfig['numThreads'] = args.threads
+    appConfig['commandTimeoutMs'] = args.command_timeout_ms
     
     #checkReplicaSet(appConfig)
 
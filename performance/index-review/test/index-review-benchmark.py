@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import random
+import importlib.util
+from collections import OrderedDict
+
+
+numCollections = 1000
+numIndexesPerCollection = 100
+numServers = 3
+fieldNames = ['a','b','c','d','e','f']
+
+
+def loadIndexReview():
+    # the script name is not a valid module name
+    spec = importlib.util.spec_from_file_location("index_review", os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'index-review.py'))
+    indexReview = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(indexReview)
+    return indexReview
+
+
+def syntheticIndexReview(seed):
+    # same collections and indexes on every server, usage differs
+    random.seed(seed)
+    collStats = OrderedDict()
+    collStats['benchdb'] = OrderedDict()
+    for collNum in range(numCollections):
+        indexInfo = [{"name":"_id_","keyAsString":"_id||1||","accesses":{"ops":random.randint(0,10)}}]
+        keyRandom = random.Random(collNum)
+        for idxNum in range(numIndexesPerCollection):
+            keyAsString = ""
+            for thisField in keyRandom.sample(fieldNames,keyRandom.randint(1,4)):
+                keyAsString += "{}||{}||".format(thisField,keyRandom.choice([1,-1]))
+            indexInfo.append({"name":"idx{}".format(idxNum),"keyAsString":keyAsString,"accesses":{"ops":random.choice([0,0,random.randint(1,1000)])}})
+        collStats['benchdb']["coll{}".format(collNum)] = {"indexInfo":indexInfo}
+    return {"start":{"collstats":collStats}}
+
+
+def legacyCheckIfRedundant(idxName,idxKeyAsString,indexList):
+    # previous technique, kept for comparison
+    returnList = []
+    for thisIdx in indexList:
+        if thisIdx["name"] in ["_id","_id_"]:
+            continue
+        if thisIdx["name"] == idxName:
+            continue
+        if thisIdx["keyAsString"].startswith(idxKeyAsString):
+            returnList.append(thisIdx["name"])
+    return returnList
+
+
+def legacyEval(idxDict, addlIdxDictList):
+    # previous technique, kept for comparison
+    results = []
+    for thisDb in idxDict["start"]["collstats"]:
+        for thisColl in idxDict["start"]["collstats"][thisDb]:
+            indexList = idxDict["start"]["collstats"][thisDb][thisColl]["indexInfo"]
+            for thisIdx in indexList:
+                if thisIdx["name"] in ["_id","_id_"]:
+                    continue
+                numXtraOps = 0
+                for n in range(0,len(addlIdxDictList)):
+                    for xtraIdx in addlIdxDictList[n]["start"]["collstats"][thisDb][thisColl]["indexInfo"]:
+                        if xtraIdx["name"] == thisIdx["name"]:
+                            numXtraOps += xtraIdx["accesses"]["ops"]
+                results.append((thisColl,thisIdx["name"],numXtraOps,legacyCheckIfRedundant(thisIdx["name"],thisIdx["keyAsString"],indexList)))
+    return results
+
+
+def currentEval(indexReview, idxDict, addlIdxDictList):
+    results = []
+    addlOpsDict = {}
+    addlNsDict = {}
+    for addlIdxDict in addlIdxDictList:
+        indexReview.addIndexOps(addlOpsDict, addlNsDict, addlIdxDict)
+    for thisDb in idxDict["start"]["collstats"]:
+        for thisColl in idxDict["start"]["collstats"][thisDb]:
+            indexList = idxDict["start"]["collstats"][thisDb][thisColl]["indexInfo"]
+            sortedIndexKeys = indexReview.getSortedIndexKeys(indexList)
+            for thisIdx in indexList:
+                if thisIdx["name"] in ["_id","_id_"]:
+                    continue
+                numXtraOps = addlOpsDict.get((thisDb,thisColl,thisIdx["name"]),0)
+                results.append((thisColl,thisIdx["name"],numXtraOps,indexReview.checkIfRedundant(thisIdx["name"],thisIdx["keyAsString"],sortedIndexKeys)))
+    return results
+
+
+def benchmark(name, evalFunction):
+    startTime = time.time()
+    results = evalFunction()
+    elapsedSeconds = time.time() - startTime
+    numRedundant = sum(1 for thisResult in results if len(thisResult[3]) > 0)
+    print("  {:<8} {:8.3f} seconds | {:,} indexes | {:,} redundant".format(name,elapsedSeconds,len(results),numRedundant))
+    return results
+
+
+def main():
+    indexReview = loadIndexReview()
+
+    print("generating {:,} collections of {:,} indexes on {} servers".format(numCollections,numIndexesPerCollection,numServers))
+    idxDict = syntheticIndexReview(0)
+    addlIdxDictList = [syntheticIndexReview(serverNum) for serverNum in range(1,numServers)]
+
+    legacyResults = benchmark('legacy', lambda: legacyEval(idxDict, addlIdxDictList))
+    currentResults = benchmark('current', lambda: currentEval(indexReview, idxDict, addlIdxDictList))
+
+    if legacyResults != currentResults:
+        sys.exit("results differ")
+    print("  results match")
+
+
+if __name__ == "__main__":
+    main()